@@ -1,5 +1,6 @@
-from flask import Flask
+from flask import Flask, request
 from .utils import is_admin
+from .helpers import MAP_READ_LIMIT, UploadRequest
 from flask_wtf.csrf import CSRFProtect
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
@@ -45,6 +46,11 @@ def create_app():
     
     # Security: File upload limits
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB max file size
+    # GIS imports stream from a spooled temp file, so they can be larger
+    app.config['MAX_IMPORT_CONTENT_LENGTH'] = int(
+        os.environ.get('MAX_IMPORT_CONTENT_LENGTH', 512 * 1024 * 1024)
+    )
+    app.request_class = UploadRequest
     
     @app.context_processor
     def inject_admin():
@@ -60,7 +66,12 @@ def create_app():
         # Updated CSP to allow map tiles, Font Awesome icons, and external resources needed for functionality
         response.headers['Content-Security-Policy'] = "default-src 'self'; script-src 'self' 'unsafe-inline' cdnjs.cloudflare.com unpkg.com; style-src 'self' 'unsafe-inline' cdnjs.cloudflare.com fonts.googleapis.com fonts.gstatic.com unpkg.com; img-src 'self' data: https://*.tile.openstreetmap.org https://*.openstreetmap.org https://*.leafletjs.com *.unpkg.com; font-src 'self' fonts.gstatic.com cdnjs.cloudflare.com https://cdnjs.cloudflare.com; connect-src 'self' https://*.tile.openstreetmap.org https://*.openstreetmap.org https://*.leafletjs.com *.unpkg.com"
         response.headers['Referrer-Policy'] = 'strict-origin-when-cross-origin'
-        response.headers['Cache-Control'] = 'public, max-age=3600'
+        # Static files keep for an hour; everything else revalidates unless the
+        # view set its own policy (map shells and versioned APIs use ETags)
+        if request.path.startswith(app.static_url_path + '/'):
+            response.headers['Cache-Control'] = 'public, max-age=3600'
+        else:
+            response.headers.setdefault('Cache-Control', 'private, no-cache')
         return response
     
     # Security: Error handlers that don't leak information
@@ -72,11 +83,28 @@ def create_app():
     def server_error(error):
         return {'error': 'Internal server error'}, 500
 
+    # Keyset pagination helpers for templates, 400 for bad cursors
+    from .pagination import init_pagination
+    init_pagination(app)
+
     # Database connection management
     from .db import init_db_connection
     init_db_connection(app)
 
+    # Schema migrations (indexes, search and spatial tables)
+    from .migrations import migrate
+    migrate(app)
+
+    # Per-request query instrumentation and /admin/perf
+    from .instrumentation import init_instrumentation
+    init_instrumentation(app)
+
     from .routes import register_routes
     register_routes(app)
 
+    # Security: map reads (@map_read) get their own, higher limit
+    for endpoint, view in list(app.view_functions.items()):
+        if getattr(view, 'map_read', False):
+            app.view_functions[endpoint] = limiter.limit(MAP_READ_LIMIT)(view)
+
     return app
@@ -1,7 +1,7 @@
 
 from flask import render_template, request, redirect, session
 from werkzeug.utils import secure_filename
-from app.db import get_db
+from app.db import get_db, execute_write
 from app.utils import is_admin, UPLOAD_FOLDER, allowed_file
 from app.helpers import login_required
 import pathlib, os
@@ -31,7 +31,6 @@ def admin_routes(app):
     def admin_upload():
         if not is_admin():
             return redirect("/")
-        db = get_db()
         name = request.form.get("name")
         formula = request.form.get("formula")
         properties = request.form.get("properties")
@@ -47,12 +46,11 @@ def admin_routes(app):
             image.save(str(filepath))
             image_path = f"/static/images/{filename}"
 
-        db.execute(
+        execute_write(
             """INSERT INTO minerals (name, formula, properties, uses, economic, countries, image)
                VALUES (?, ?, ?, ?, ?, ?, ?)""",
             (name, formula, properties, uses, economic, countries, image_path)
         )
-        db.commit()
         return redirect("/admin")
 
     @app.route("/admin/edit/<int:id>", methods=["GET", "POST"])
@@ -71,13 +69,12 @@ def admin_routes(app):
                 image.save(str(filepath))
                 image_path = f"/static/images/{filename}"
 
-            db.execute(
+            execute_write(
                 """UPDATE minerals SET name=?, formula=?, properties=?, uses=?, economic=?, countries=?, image=? WHERE id=?""",
                 (request.form.get("name"), request.form.get("formula"), request.form.get("properties"),
                  request.form.get("uses"), request.form.get("economic"), request.form.get("countries"),
                  image_path, id)
             )
-            db.commit()
             return redirect(f"/mineral/{id}")
         return render_template("edit.html", mineral=mineral)
 
@@ -92,6 +89,5 @@ def admin_routes(app):
             img_path = mineral["image"].lstrip("/")
             if os.path.exists(img_path):
                 os.remove(img_path)
-        db.execute("DELETE FROM minerals WHERE id = ?", (id,))
-        db.commit()
+        execute_write("DELETE FROM minerals WHERE id = ?", (id,))
         return redirect("/admin")
@@ -1,6 +1,6 @@
 from flask import render_template, request, redirect, session
 from werkzeug.security import generate_password_hash, check_password_hash
-from app.db import get_db
+from app.db import get_db, execute_write
 from app.roles import ROLES
 from app.helpers import validate_password
 import re
@@ -87,15 +87,13 @@ def auth_routes(app):
                 return render_template("register.html", error="Input fields too long", roles=ROLES)
             
             hash_pw = generate_password_hash(password)
-            db = get_db()
             
             try:
-                db.execute(
+                execute_write(
                     """INSERT INTO users (username, hash, role, organization, expertise) 
                        VALUES (?, ?, ?, ?, ?)""",
                     (username, hash_pw, role, organization, expertise)
                 )
-                db.commit()
                 return redirect("/login")
             except Exception as e:
                 # Generic error message to prevent information leakage
@@ -0,0 +1,301 @@
+"""
+Map Clustering
+Grid clustering of the map layers, precomputed for every zoom level.
+Points are bucketed into 64px cells of the Web Mercator grid and each
+cell keeps running sums, so the spatial_changes log can be replayed to
+update clusters incrementally after imports and edits.
+"""
+
+import hashlib
+import json
+import math
+import threading
+from flask import Response, jsonify, request
+from app.db import get_db, get_writer
+from app.helpers import map_read
+from app.spatial import SPATIAL_LAYERS, MAX_LATITUDE, bbox_condition, layer_version, viewport_args
+
+MAX_CLUSTER_ZOOM = 16
+CELLS_PER_TILE = 4    # 256px tiles / 64px cells
+
+# layer: columns returned for unclustered points
+POINT_FIELDS = {
+    'deposits': "name, status, region, mineral_type_id",
+    'claims': "claim_id, company_name, status, claim_type",
+    'sites': "name, accessibility, exploration_status",
+    'states': "name, capital, primary_minerals",
+}
+
+# ============================================================
+# GRID
+# ============================================================
+
+def mercator(lon, lat):
+    """Web Mercator position of a point, both axes in [0, 1)."""
+    lat = min(max(lat, -MAX_LATITUDE), MAX_LATITUDE)
+    rad = math.radians(lat)
+    x = (lon + 180.0) / 360.0
+    y = (1.0 - math.log(math.tan(rad) + 1.0 / math.cos(rad)) / math.pi) / 2.0
+    return x, y
+
+def grid_cell(x, y, zoom):
+    """Cluster cell holding a Mercator position at a zoom level."""
+    n = CELLS_PER_TILE << zoom
+    return min(max(int(x * n), 0), n - 1), min(max(int(y * n), 0), n - 1)
+
+# ============================================================
+# STORAGE & INCREMENTAL MAINTENANCE
+# ============================================================
+
+def cluster_seq(db, layer):
+    """Last spatial_changes seq folded into a layer's clusters."""
+    row = db.execute("SELECT seq FROM map_cluster_state WHERE layer = ?", (layer,)).fetchone()
+    return row[0] if row else 0
+
+def _set_cluster_seq(conn, layer, seq):
+    conn.execute(
+        "INSERT INTO map_cluster_state (layer, seq) VALUES (?, ?) "
+        "ON CONFLICT (layer) DO UPDATE SET seq = excluded.seq",
+        (layer, seq)
+    )
+
+def _apply(conn, layer, deltas):
+    """Add (+1) or remove (-1) points from the cells at every zoom level."""
+    cells = {}
+    for sign, point_id, lon, lat in deltas:
+        x, y = mercator(lon, lat)
+        for zoom in range(MAX_CLUSTER_ZOOM + 1):
+            cell = cells.setdefault((zoom, *grid_cell(x, y, zoom)), [0, 0.0, 0.0, 0])
+            cell[0] += sign
+            cell[1] += sign * lon
+            cell[2] += sign * lat
+            cell[3] += sign * point_id
+
+    conn.executemany("""
+        INSERT INTO map_clusters (layer, zoom, cell_x, cell_y, count, sum_lon, sum_lat, sum_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (layer, zoom, cell_x, cell_y) DO UPDATE SET
+            count = count + excluded.count,
+            sum_lon = sum_lon + excluded.sum_lon,
+            sum_lat = sum_lat + excluded.sum_lat,
+            sum_id = sum_id + excluded.sum_id
+    """, [(layer, *key, *totals) for key, totals in cells.items()])
+    conn.execute("DELETE FROM map_clusters WHERE layer = ? AND count <= 0", (layer,))
+
+def rebuild_clusters(conn, layer):
+    """Recompute a layer's clusters from scratch."""
+    table = SPATIAL_LAYERS[layer][0]
+    version = layer_version(conn, layer)
+
+    conn.execute("DELETE FROM map_clusters WHERE layer = ?", (layer,))
+    conn.execute("DELETE FROM map_cluster_points WHERE layer = ?", (layer,))
+    points = [tuple(row) for row in conn.execute(f"""
+        SELECT id, longitude, latitude FROM {table}
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    """)]
+    conn.executemany(
+        "INSERT INTO map_cluster_points (layer, id, lon, lat) VALUES (?, ?, ?, ?)",
+        [(layer, *point) for point in points]
+    )
+    _apply(conn, layer, [(1, *point) for point in points])
+    _set_cluster_seq(conn, layer, version)
+
+def sync_clusters(conn, layer):
+    """
+    Replay changes logged since the last sync into a layer's clusters.
+    Only rows whose coordinates changed touch the cluster cells. Runs on
+    the writer (schedule_sync); returns the number of point moves applied.
+    """
+    table = SPATIAL_LAYERS[layer][0]
+    changes = conn.execute(
+        "SELECT row_id, MAX(seq) FROM spatial_changes WHERE layer = ? AND seq > ? GROUP BY row_id",
+        (layer, cluster_seq(conn, layer))
+    ).fetchall()
+    if not changes:
+        return 0
+
+    version = max(change[1] for change in changes)
+    ids = json.dumps([change[0] for change in changes])
+
+    old = {row[0]: (row[1], row[2]) for row in conn.execute(
+        "SELECT id, lon, lat FROM map_cluster_points "
+        "WHERE layer = ? AND id IN (SELECT value FROM json_each(?))",
+        (layer, ids)
+    )}
+    new = {row[0]: (row[1], row[2]) for row in conn.execute(f"""
+        SELECT id, longitude, latitude FROM {table}
+        WHERE id IN (SELECT value FROM json_each(?))
+          AND latitude IS NOT NULL AND longitude IS NOT NULL
+    """, (ids,))}
+
+    deltas = []
+    for point_id, _ in changes:
+        before, after = old.get(point_id), new.get(point_id)
+        if before == after:
+            continue
+        if before:
+            deltas.append((-1, point_id, *before))
+        if after:
+            deltas.append((1, point_id, *after))
+
+    conn.executemany(
+        "DELETE FROM map_cluster_points WHERE layer = ? AND id = ?",
+        [(layer, point_id) for sign, point_id, _, _ in deltas if sign < 0]
+    )
+    conn.executemany(
+        "INSERT INTO map_cluster_points (layer, id, lon, lat) VALUES (?, ?, ?, ?)",
+        [(layer, point_id, lon, lat) for sign, point_id, lon, lat in deltas if sign > 0]
+    )
+    _apply(conn, layer, deltas)
+    _set_cluster_seq(conn, layer, version)
+
+    # Keep the newest entry so the layer version survives pruning
+    conn.execute("DELETE FROM spatial_changes WHERE layer = ? AND seq < ?", (layer, version))
+    return len(deltas)
+
+_syncs = {}  # (database, layer): Future of the queued sync
+_syncs_lock = threading.Lock()
+
+def schedule_sync(layer, database=None):
+    """Queue sync_clusters on the writer unless a sync of the layer is already pending."""
+    writer = get_writer(database)
+    key = (writer.pool.database, layer)
+    with _syncs_lock:
+        future = _syncs.get(key)
+        if future is None or future.done():
+            future = _syncs[key] = writer.submit(sync_clusters, layer)
+    return future
+
+def ensure_clusters(db, layer):
+    """
+    Version of the clusters to serve for a layer. If the layer changed
+    since they were synced, a background sync is queued and the previous
+    version is served until it commits, so reads never wait on the writer.
+    """
+    version = cluster_seq(db, layer)
+    if version < layer_version(db, layer):
+        schedule_sync(layer)
+    return version
+
+# ============================================================
+# QUERIES
+# ============================================================
+
+def _point_feature(row, fields):
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [row['longitude'], row['latitude']]},
+        'properties': {'id': row['id'], **{f: row[f] for f in fields}},
+    }
+
+def layer_points(db, layer, where, params):
+    """Point features (with POINT_FIELDS) of the layer rows matching a condition on alias t."""
+    table = SPATIAL_LAYERS[layer][0]
+    fields = [f.strip() for f in POINT_FIELDS[layer].split(',')]
+    rows = db.execute(f"""
+        SELECT id, longitude, latitude, {POINT_FIELDS[layer]} FROM {table} t
+        WHERE {where} AND latitude IS NOT NULL AND longitude IS NOT NULL
+    """, params).fetchall()
+    return [_point_feature(row, fields) for row in rows]
+
+def get_clusters(db, layer, zoom, bbox=None):
+    """
+    GeoJSON features for a viewport: cluster features (cluster=True,
+    point_count, expansion_zoom) plus single points with their fields.
+    Above MAX_CLUSTER_ZOOM every point in bbox is returned individually,
+    so callers must pass a bbox there.
+    """
+    bbox = bbox or (-180.0, -90.0, 180.0, 90.0)
+
+    if zoom > MAX_CLUSTER_ZOOM:
+        condition, params = bbox_condition(layer, 't', bbox)
+        return layer_points(db, layer, condition, params)
+
+    west, south, east, north = bbox
+    x0, y0 = grid_cell(*mercator(west, north), zoom)
+    x1, y1 = grid_cell(*mercator(east, south), zoom)
+    if west <= east:
+        x_ranges = [(x0, x1)]
+    else:
+        x_ranges = [(x0, (CELLS_PER_TILE << zoom) - 1), (0, x1)]
+    return cluster_features(db, layer, zoom, x_ranges, (y0, y1))
+
+def cluster_features(db, layer, zoom, x_ranges, y_range):
+    """GeoJSON features for the clusters in ranges of grid cells."""
+    features = []
+    single_ids = []
+    for first, last in x_ranges:
+        rows = db.execute("""
+            SELECT count, sum_lon, sum_lat, sum_id FROM map_clusters
+            WHERE layer = ? AND zoom = ?
+              AND cell_x BETWEEN ? AND ? AND cell_y BETWEEN ? AND ?
+        """, (layer, zoom, first, last, *y_range)).fetchall()
+
+        for row in rows:
+            if row['count'] == 1:
+                single_ids.append(row['sum_id'])
+                continue
+            features.append({
+                'type': 'Feature',
+                'geometry': {
+                    'type': 'Point',
+                    'coordinates': [row['sum_lon'] / row['count'], row['sum_lat'] / row['count']],
+                },
+                'properties': {
+                    'cluster': True,
+                    'point_count': row['count'],
+                    'expansion_zoom': zoom + 1,
+                },
+            })
+
+    if single_ids:
+        features.extend(layer_points(db, layer, "id IN (SELECT value FROM json_each(?))",
+                                     (json.dumps(single_ids),)))
+    return features
+
+# ============================================================
+# API
+# ============================================================
+
+def clustering_routes(app):
+    """Register the map clustering API"""
+
+    @app.route("/api/clusters/<layer>")
+    @map_read
+    def api_clusters(layer):
+        """Clustered features of a map layer for ?zoom= (and optional ?bbox=)"""
+        if layer not in SPATIAL_LAYERS:
+            return jsonify({'error': f'Unknown layer: {layer}'}), 404
+
+        try:
+            bbox, zoom = viewport_args()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if zoom is None:
+            return jsonify({'error': 'zoom is required'}), 400
+        # Unclustered zooms list every point in the box: never the whole world
+        if zoom > MAX_CLUSTER_ZOOM and bbox is None:
+            return jsonify({'error': f'bbox is required above zoom {MAX_CLUSTER_ZOOM}'}), 400
+
+        db = get_db()
+        version = ensure_clusters(db, layer)
+
+        # Versioned by the clusters actually served, which may trail the layer
+        # while a sync is pending
+        query = repr(sorted(request.args.items(multi=True)))
+        etag = f"clusters-{layer}-v{version}-" + hashlib.sha1(query.encode('utf-8')).hexdigest()[:16]
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = jsonify({
+                'type': 'FeatureCollection',
+                'layer': layer,
+                'zoom': zoom,
+                'version': version,
+                'features': get_clusters(db, layer, zoom, bbox),
+            })
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    print("✓ Map clustering routes registered")
@@ -1,35 +1,398 @@
+import atexit
+import queue
 import sqlite3
 import os
-from flask import g, current_app
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from urllib.parse import quote
+from flask import g, current_app, has_request_context, request
+from app.instrumentation import instrument, instrumentation_enabled
 
 DATABASE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'minerals.db')
 
+# Production tuning profile applied to every connection.
+# Override per key with app.config['SQLITE_TUNING'] or SQLITE_<KEY> env vars.
+DEFAULT_TUNING = {
+    'journal_mode': 'WAL',         # readers keep flowing while a writer commits
+    'synchronous': 'NORMAL',       # durable across app crashes in WAL mode
+    'mmap_size': 268435456,        # 256 MB of the file memory-mapped
+    'cache_size': -65536,          # negative = KiB, so 64 MB page cache
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,          # ms; SQLite's busy handler backs off while waiting
+}
+
+_TUNING_CHOICES = {
+    'journal_mode': {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'},
+    'synchronous': {'OFF', 'NORMAL', 'FULL', 'EXTRA'},
+    'temp_store': {'DEFAULT', 'FILE', 'MEMORY'},
+}
+
+def load_tuning(overrides=None):
+    """
+    Build a validated tuning profile from the defaults, environment
+    variables and explicit overrides (highest precedence).
+    """
+    tuning = dict(DEFAULT_TUNING)
+    for key in DEFAULT_TUNING:
+        env_value = os.environ.get(f'SQLITE_{key.upper()}')
+        if env_value:
+            tuning[key] = env_value
+    tuning.update(overrides or {})
+
+    for key, value in tuning.items():
+        if key in _TUNING_CHOICES:
+            value = str(value).upper()
+            if value not in _TUNING_CHOICES[key]:
+                raise ValueError(f"Invalid SQLite {key}: {value}")
+        elif key in DEFAULT_TUNING:
+            value = int(value)
+        else:
+            raise ValueError(f"Unknown SQLite tuning option: {key}")
+        tuning[key] = value
+    return tuning
+
+def apply_tuning(conn, tuning):
+    """
+    Apply a tuning profile to a connection.
+    Values are validated by load_tuning() before they reach the PRAGMAs.
+    """
+    for key, value in tuning.items():
+        conn.execute(f"PRAGMA {key} = {value}")
+
+class ConnectionPool:
+    """
+    Long-lived SQLite connections, one per thread.
+    Connections survive across requests so SQLite's page cache and the
+    sqlite3 statement cache stay warm. Each checkout health-checks the
+    connection and resets any state a previous request left behind.
+    After a fork (gunicorn workers) inherited connections are dropped
+    and the child opens its own.
+    """
+
+    def __init__(self, database, tuning=None, readonly=False):
+        self.database = database
+        self.readonly = readonly
+        self.tuning = tuning if tuning is not None else load_tuning()
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def connect(self):
+        """
+        Open a new, tuned connection that is not tracked by the pool.
+        """
+        tuning = dict(self.tuning)
+        if self.readonly:
+            # Read-only connections cannot change the (persistent) journal mode
+            tuning.pop('journal_mode', None)
+            conn = sqlite3.connect(
+                f"file:{quote(self.database)}?mode=ro",
+                uri=True,
+                check_same_thread=False,
+                timeout=tuning['busy_timeout'] / 1000.0,
+                cached_statements=256
+            )
+        else:
+            conn = sqlite3.connect(
+                self.database,
+                check_same_thread=False,
+                timeout=tuning['busy_timeout'] / 1000.0,
+                cached_statements=256
+            )
+        conn.row_factory = sqlite3.Row
+        # Enable foreign keys for referential integrity
+        conn.execute("PRAGMA foreign_keys = ON")
+        apply_tuning(conn, tuning)
+        return conn
+
+    def _connect(self):
+        conn = self.connect()
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def _check_fork(self):
+        """Forget connections inherited from the parent process."""
+        if os.getpid() != self._pid:
+            # Never close inherited handles: SQLite connections must not be
+            # used (or closed) across a fork, so just drop the references.
+            self._local = threading.local()
+            self._connections = []
+            self._lock = threading.Lock()
+            self._pid = os.getpid()
+
+    def _is_healthy(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self):
+        """
+        Check out this thread's connection, opening it if needed.
+        """
+        self._check_fork()
+        conn = getattr(self._local, 'conn', None)
+
+        if conn is not None and not self._is_healthy(conn):
+            self._discard(conn)
+            conn = None
+
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+
+        # Reset per-request state
+        if conn.in_transaction:
+            conn.rollback()
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def release(self, conn):
+        """
+        Return a connection to the pool, rolling back uncommitted work.
+        """
+        if os.getpid() != self._pid:
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+
+    def _discard(self, conn):
+        if getattr(self._local, 'conn', None) is conn:
+            self._local.conn = None
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def close_all(self):
+        """Close every connection opened by this process."""
+        if os.getpid() != self._pid:
+            return
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+class WriteQueue:
+    """
+    Serialized writer: one thread owns the only write connection and
+    drains a queue of write jobs. Jobs that arrive together are group
+    committed in a single transaction; each job runs in its own SAVEPOINT
+    so a failing job is rolled back without affecting the others.
+    """
+
+    MAX_BATCH = 64
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self):
+        # The writer thread does not survive a fork; start one per process
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._thread = None
+                self._pid = os.getpid()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='sqlite-writer', daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue fn(conn, *args, **kwargs) for the writer thread.
+        Returns a Future resolved with fn's result once it is committed.
+        """
+        self._ensure_thread()
+        future = Future()
+        self._queue.put((fn, args, kwargs, future))
+        return future
+
+    def _run(self):
+        conn = None
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.MAX_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                if conn is None:
+                    conn = self.pool.connect()
+                    conn.isolation_level = None  # transactions are managed explicitly
+                self._run_batch(conn, batch)
+            except Exception as e:
+                if conn is not None and conn.in_transaction:
+                    try:
+                        conn.execute("ROLLBACK")
+                    except sqlite3.Error:
+                        conn.close()
+                        conn = None
+                for _, _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _run_batch(self, conn, batch):
+        done = []
+        conn.execute("BEGIN IMMEDIATE")
+
+        for fn, args, kwargs, future in batch:
+            # Skip jobs whose caller gave up waiting (run_write cancelled them)
+            if not future.set_running_or_notify_cancel():
+                continue
+            conn.execute("SAVEPOINT write_job")
+            try:
+                result = fn(conn, *args, **kwargs)
+            except Exception as e:
+                conn.execute("ROLLBACK TO write_job")
+                conn.execute("RELEASE write_job")
+                future.set_exception(e)
+            else:
+                conn.execute("RELEASE write_job")
+                done.append((future, result))
+
+        conn.execute("COMMIT")
+        for future, result in done:
+            future.set_result(result)
+
+_pools = {}
+_writers = {}
+_pools_lock = threading.Lock()
+
+def get_pool(database=None, readonly=False):
+    """
+    Get the connection pool for a database file (one pool per path and mode).
+    """
+    tuning = None
+    if database is None:
+        database = current_app.config.get('DATABASE', DATABASE_PATH)
+        tuning = current_app.config.get('SQLITE_TUNING')
+    key = (database, readonly)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = ConnectionPool(database, tuning, readonly)
+    return pool
+
+def get_writer(database=None):
+    """
+    Get the serialized write queue for a database file.
+    """
+    pool = get_pool(database)
+    writer = _writers.get(pool.database)
+    if writer is None:
+        with _pools_lock:
+            writer = _writers.setdefault(pool.database, WriteQueue(pool))
+    return writer
+
+def run_write(fn, *args, **kwargs):
+    """
+    Run fn(conn, *args, **kwargs) on the writer thread and wait for commit.
+    fn must not commit itself. Returns fn's result or re-raises its error.
+    A job still queued after WRITE_TIMEOUT is cancelled so it never runs;
+    one the writer has already started is waited for, since it will commit.
+    """
+    future = get_writer().submit(fn, *args, **kwargs)
+    try:
+        return future.result(timeout=current_app.config.get('WRITE_TIMEOUT', 60))
+    except FutureTimeoutError:
+        if future.cancel():
+            raise
+        return future.result()
+
+def execute_write(sql, params=()):
+    """
+    Run a single write statement through the writer queue.
+    Returns the lastrowid of the statement.
+    """
+    return run_write(lambda conn: conn.execute(sql, params).lastrowid)
+
+def _is_read_request():
+    return has_request_context() and request.method in ('GET', 'HEAD', 'OPTIONS')
+
 def get_db():
     """
-    Get or create a database connection for the current request.
-    Connections are cached in Flask's application context (g object).
+    Get a database connection for the current request.
+    GET/HEAD requests receive a read-only connection; writes should go
+    through run_write()/execute_write(). Connections come from a
+    per-thread pool and are cached in Flask's application context (g
+    object) for the duration of the request.
     """
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            DATABASE_PATH,
-            check_same_thread=False,
-            timeout=5.0  # 5 second timeout for database lock
-        )
-        g.db.row_factory = sqlite3.Row
-        # Enable foreign keys for referential integrity
-        g.db.execute("PRAGMA foreign_keys = ON")
+        readonly = _is_read_request()
+        conn = get_pool(readonly=readonly).acquire()
+        if has_request_context() and instrumentation_enabled():
+            conn = instrument(conn)
+        g.db = conn
+        g.db_readonly = readonly
     return g.db
 
 def close_db(e=None):
     """
-    Close database connection at the end of request.
+    Return the database connection to the pool at the end of request.
     """
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        # Unwrap instrumented connections before handing them back
+        db = getattr(db, 'wrapped', db)
+        get_pool(readonly=g.pop('db_readonly', False)).release(db)
+
+def _close_all_pools():
+    for pool in list(_pools.values()):
+        pool.close_all()
+
+def check_tuning(app):
+    """
+    Report the effective SQLite settings at startup.
+    SQLite silently ignores some PRAGMAs (e.g. WAL on network filesystems),
+    so read the values back instead of trusting the profile.
+    """
+    with app.app_context():
+        pool = get_pool()
+        conn = pool.connect()
+        try:
+            effective = {
+                key: conn.execute(f"PRAGMA {key}").fetchone()[0]
+                for key in pool.tuning
+            }
+        finally:
+            conn.close()
+
+    print("✓ SQLite tuning: " + ", ".join(f"{k}={v}" for k, v in effective.items()))
+    if str(effective['journal_mode']).upper() != pool.tuning['journal_mode']:
+        print(f"⚠ SQLite journal_mode is {effective['journal_mode']}, "
+              f"expected {pool.tuning['journal_mode']}")
+    return effective
 
 def init_db_connection(app):
     """
     Initialize database connection handling for Flask app.
     """
+    app.config.setdefault('DATABASE', DATABASE_PATH)
+    app.config['SQLITE_TUNING'] = load_tuning(app.config.get('SQLITE_TUNING'))
     app.teardown_appcontext(close_db)
+    check_tuning(app)
+
+atexit.register(_close_all_pools)
@@ -3,10 +3,64 @@ Deposit and Mining Claims Management
 Manage deposits and claims imported from QGIS
 """
 
+import json
+from functools import lru_cache
 from flask import render_template, request, jsonify, redirect, session
-from app.db import get_db
+from app.db import get_db, execute_write, run_write
 from app.utils import is_admin
 from app.helpers import login_required
+from app.pagination import Keyset, page_args, paginate
+from app.geometry import parse_polygons, shapes_overlap
+from app.states import assign_states
+
+ADMIN_DEPOSITS_KEYSET = Keyset(("COALESCE(d.status, '')", 'desc'), ("d.name", 'asc'), ("d.id", 'asc'))
+ADMIN_CLAIMS_KEYSET = Keyset(("COALESCE(c.status, '')", 'desc'), ("c.claim_id", 'asc'), ("c.id", 'asc'))
+
+# Claim pairs whose bboxes intersect: each claim with a polygon probes the
+# claims R*Tree with its own bbox instead of being compared with every claim.
+# CROSS JOIN pins that loop order; left to itself the planner may scan the
+# R*Tree on the outside.
+CONFLICT_CANDIDATES_SQL = """
+    SELECT a.id AS a_id, r.id AS b_id
+    FROM mining_claims a
+    CROSS JOIN mining_claims_rtree r
+      ON r.min_lon <= a.max_lon AND r.max_lon >= a.min_lon
+     AND r.min_lat <= a.max_lat AND r.max_lat >= a.min_lat
+    CROSS JOIN mining_claims b ON b.id = r.id
+    WHERE a.geometry IS NOT NULL AND b.geometry IS NOT NULL
+"""
+
+def find_claim_conflicts(db, claim_id=None):
+    """
+    Pairs of claim ids whose polygons overlap: every pair when claim_id is
+    None, otherwise the claims overlapping that one. Candidates come from
+    the R*Tree; each is confirmed with an exact polygon test.
+    Returns (pairs, candidate count).
+    """
+    if claim_id is None:
+        candidates = db.execute(CONFLICT_CANDIDATES_SQL + " AND r.id > a.id")
+    else:
+        candidates = db.execute(CONFLICT_CANDIDATES_SQL + " AND a.id = ? AND r.id != a.id", (claim_id,))
+
+    @lru_cache(maxsize=4096)
+    def shape(row_id):
+        row = db.execute("SELECT geometry FROM mining_claims WHERE id = ?", (row_id,)).fetchone()
+        return parse_polygons(json.loads(row['geometry']))
+
+    pairs = []
+    checked = 0
+    for a_id, b_id in candidates.fetchall():
+        checked += 1
+        if shapes_overlap(shape(a_id), shape(b_id)):
+            pairs.append((a_id, b_id))
+    return pairs, checked
+
+def _claim_summaries(db, ids):
+    rows = db.execute("""
+        SELECT id, claim_id, company_name, status, claim_type, area_hectares
+        FROM mining_claims WHERE id IN (SELECT value FROM json_each(?))
+    """, (json.dumps(sorted(set(ids))),)).fetchall()
+    return {row['id']: dict(row) for row in rows}
 
 def deposit_routes(app):
     """Register deposit and claims management routes"""
@@ -24,14 +78,13 @@ def deposit_routes(app):
         
         db = get_db()
         
-        # Get all deposits with mineral type info
-        deposits = db.execute("""
+        # One page of deposits with mineral type info
+        cursor, limit = page_args()
+        deposits, next_cursor = paginate(db, """
             SELECT d.*, mt.name as mineral_name
             FROM deposits d
             LEFT JOIN mineral_types mt ON d.mineral_type_id = mt.id
-            ORDER BY d.status DESC, d.name ASC
-        """).fetchall()
-        deposits = [dict(d) for d in deposits]
+        """, [], [], ADMIN_DEPOSITS_KEYSET, cursor, limit)
         
         # Get mineral types for dropdowns
         mineral_types = db.execute(
@@ -39,18 +92,20 @@ def deposit_routes(app):
         ).fetchall()
         mineral_types = [dict(m) for m in mineral_types]
         
-        # Get statistics
-        stats = {
-            'total': len(deposits),
-            'active': len([d for d in deposits if d['status'] == 'Active']),
-            'prospect': len([d for d in deposits if d['status'] == 'Prospect']),
-            'historical': len([d for d in deposits if d['status'] == 'Historical'])
-        }
+        # Get statistics (over all deposits, not just this page)
+        stats = dict(db.execute("""
+            SELECT COUNT(*) as total,
+                   COALESCE(SUM(status = 'Active'), 0) as active,
+                   COALESCE(SUM(status = 'Prospect'), 0) as prospect,
+                   COALESCE(SUM(status = 'Historical'), 0) as historical
+            FROM deposits
+        """).fetchone())
         
         return render_template("admin_deposits.html",
                              deposits=deposits,
                              mineral_types=mineral_types,
-                             stats=stats)
+                             stats=stats,
+                             next_cursor=next_cursor)
     
     @app.route("/admin/deposits/<int:deposit_id>", methods=["GET"])
     @login_required
@@ -94,15 +149,8 @@ def deposit_routes(app):
         db = get_db()
         
         if request.method == "POST":
-            # Update deposit
-            db.execute("""
-                UPDATE deposits
-                SET name = ?, mineral_type_id = ?, location_name = ?,
-                    latitude = ?, longitude = ?, country = ?, region = ?,
-                    estimated_reserves_tonnes = ?, average_grade = ?,
-                    confidence_level = ?, discovery_year = ?, status = ?, notes = ?
-                WHERE id = ?
-            """, (
+            # Form values are read here: the writer thread has no request
+            values = (
                 request.form.get('name'),
                 request.form.get('mineral_type_id') or None,
                 request.form.get('location_name'),
@@ -117,8 +165,21 @@ def deposit_routes(app):
                 request.form.get('status'),
                 request.form.get('notes'),
                 deposit_id
-            ))
-            db.commit()
+            )
+
+            def update_deposit(db):
+                db.execute("""
+                    UPDATE deposits
+                    SET name = ?, mineral_type_id = ?, location_name = ?,
+                        latitude = ?, longitude = ?, country = ?, region = ?,
+                        estimated_reserves_tonnes = ?, average_grade = ?,
+                        confidence_level = ?, discovery_year = ?, status = ?, notes = ?
+                    WHERE id = ?
+                """, values)
+                # Same transaction: the edit never commits without its state
+                assign_states(db, 'deposits', [deposit_id])
+
+            run_write(update_deposit)
             
             return redirect(f"/admin/deposits/{deposit_id}")
         
@@ -151,14 +212,14 @@ def deposit_routes(app):
         if not is_admin():
             return jsonify({'error': 'Not authorized'}), 403
         
-        db = get_db()
-        
-        # Delete related mining claims
-        db.execute("DELETE FROM mining_claims WHERE deposit_id = ?", (deposit_id,))
+        def delete_deposit(db):
+            # Delete related mining claims
+            db.execute("DELETE FROM mining_claims WHERE deposit_id = ?", (deposit_id,))
+            
+            # Delete deposit
+            db.execute("DELETE FROM deposits WHERE id = ?", (deposit_id,))
         
-        # Delete deposit
-        db.execute("DELETE FROM deposits WHERE id = ?", (deposit_id,))
-        db.commit()
+        run_write(delete_deposit)
         
         return redirect("/admin/deposits")
     
@@ -175,14 +236,13 @@ def deposit_routes(app):
         
         db = get_db()
         
-        # Get all claims with deposit info
-        claims = db.execute("""
+        # One page of claims with deposit info
+        cursor, limit = page_args()
+        claims, next_cursor = paginate(db, """
             SELECT c.*, d.name as deposit_name
             FROM mining_claims c
             LEFT JOIN deposits d ON c.deposit_id = d.id
-            ORDER BY c.status DESC, c.claim_id ASC
-        """).fetchall()
-        claims = [dict(c) for c in claims]
+        """, [], [], ADMIN_CLAIMS_KEYSET, cursor, limit)
         
         # Get deposits for dropdown
         deposits = db.execute(
@@ -190,18 +250,20 @@ def deposit_routes(app):
         ).fetchall()
         deposits = [dict(d) for d in deposits]
         
-        # Get statistics
-        stats = {
-            'total': len(claims),
-            'active': len([c for c in claims if c['status'] == 'Active']),
-            'inactive': len([c for c in claims if c['status'] == 'Inactive']),
-            'expired': len([c for c in claims if c['status'] == 'Expired'])
-        }
+        # Get statistics (over all claims, not just this page)
+        stats = dict(db.execute("""
+            SELECT COUNT(*) as total,
+                   COALESCE(SUM(status = 'Active'), 0) as active,
+                   COALESCE(SUM(status = 'Inactive'), 0) as inactive,
+                   COALESCE(SUM(status = 'Expired'), 0) as expired
+            FROM mining_claims
+        """).fetchone())
         
         return render_template("admin_claims.html",
                              claims=claims,
                              deposits=deposits,
-                             stats=stats)
+                             stats=stats,
+                             next_cursor=next_cursor)
     
     @app.route("/admin/claims/<int:claim_id>", methods=["GET"])
     @login_required
@@ -233,14 +295,8 @@ def deposit_routes(app):
         db = get_db()
         
         if request.method == "POST":
-            # Update claim
-            db.execute("""
-                UPDATE mining_claims
-                SET company_name = ?, location_description = ?,
-                    area_hectares = ?, claim_type = ?, latitude = ?,
-                    longitude = ?, status = ?, deposit_id = ?
-                WHERE id = ?
-            """, (
+            # Form values are read here: the writer thread has no request
+            values = (
                 request.form.get('company_name'),
                 request.form.get('location_description'),
                 float(request.form.get('area_hectares', 0)) if request.form.get('area_hectares') else None,
@@ -250,8 +306,20 @@ def deposit_routes(app):
                 request.form.get('status'),
                 request.form.get('deposit_id') or None,
                 claim_id
-            ))
-            db.commit()
+            )
+
+            def update_claim(db):
+                db.execute("""
+                    UPDATE mining_claims
+                    SET company_name = ?, location_description = ?,
+                        area_hectares = ?, claim_type = ?, latitude = ?,
+                        longitude = ?, status = ?, deposit_id = ?
+                    WHERE id = ?
+                """, values)
+                # Same transaction: the edit never commits without its state
+                assign_states(db, 'claims', [claim_id])
+
+            run_write(update_claim)
             
             return redirect(f"/admin/claims/{claim_id}")
         
@@ -284,12 +352,57 @@ def deposit_routes(app):
         if not is_admin():
             return jsonify({'error': 'Not authorized'}), 403
         
-        db = get_db()
-        db.execute("DELETE FROM mining_claims WHERE id = ?", (claim_id,))
-        db.commit()
+        execute_write("DELETE FROM mining_claims WHERE id = ?", (claim_id,))
         
         return redirect("/admin/claims")
     
+    # ============================================================
+    # CLAIM CONFLICTS
+    # ============================================================
+    
+    @app.route("/admin/claims/conflicts")
+    @login_required
+    def admin_claim_conflicts():
+        """Report every pair of claims whose polygons overlap"""
+        if not is_admin():
+            return jsonify({'error': 'Not authorized'}), 403
+        
+        db = get_db()
+        pairs, checked = find_claim_conflicts(db)
+        claims = _claim_summaries(db, [i for pair in pairs for i in pair])
+        
+        return jsonify({
+            'candidates_checked': checked,
+            'count': len(pairs),
+            'conflicts': [{'claim': claims.get(a), 'overlaps': claims.get(b)} for a, b in pairs]
+        })
+    
+    @app.route("/admin/claims/<int:claim_id>/conflicts")
+    @login_required
+    def admin_claim_conflicts_for(claim_id):
+        """Claims whose polygons overlap one claim"""
+        if not is_admin():
+            return jsonify({'error': 'Not authorized'}), 403
+        
+        db = get_db()
+        claim = db.execute(
+            "SELECT id, geometry FROM mining_claims WHERE id = ?", (claim_id,)
+        ).fetchone()
+        if not claim:
+            return jsonify({'error': 'Claim not found'}), 404
+        if not claim['geometry']:
+            return jsonify({'error': 'Claim has no polygon geometry'}), 400
+        
+        pairs, checked = find_claim_conflicts(db, claim_id)
+        claims = _claim_summaries(db, [b for _, b in pairs])
+        
+        return jsonify({
+            'claim_id': claim_id,
+            'candidates_checked': checked,
+            'count': len(pairs),
+            'overlaps': [claims.get(b) for _, b in pairs]
+        })
+    
     # ============================================================
     # API ENDPOINTS FOR DATA
     # ============================================================
@@ -6,6 +6,7 @@ Includes South Sudan focus with advanced features
 import os
 import sqlite3
 from werkzeug.security import generate_password_hash
+from app.migrations import create_indexes, create_keyset_indexes
 
 def create_enhanced_db(db_path="minerals.db"):
     """Create or upgrade database with professional geology schema"""
@@ -386,6 +387,11 @@ def create_enhanced_db(db_path="minerals.db"):
         """, ore_types_data)
         print("✓ Inserted ore types")
     
+    # Lookup indexes for the tables created above
+    create_indexes(conn)
+    create_keyset_indexes(conn)
+    print("✓ Created lookup indexes")
+    
     conn.commit()
     conn.close()
     
@@ -0,0 +1,227 @@
+"""
+Streaming Data Export
+GeoJSON, newline-delimited GeoJSON and CSV downloads of deposits, claims
+and exploration sites for QGIS. Rows are read from the cursor and written
+to the response in chunks as they are produced, so memory use does not
+grow with the table.
+
+GeoPackage downloads cannot be streamed (a .gpkg is an SQLite database);
+they are written to a temporary file first and sent from disk.
+"""
+
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+from flask import Response, jsonify, request, send_file, stream_with_context
+from app.db import get_db
+from app.geopackage import write_geopackage
+from app.spatial import layers_etag, viewport_filter
+
+CHUNK_ROWS = 500
+
+# layer: (spatial layer, SELECT ... FROM ..., alias, property columns)
+# Every query also selects latitude, longitude and geometry (GeoJSON text or NULL).
+EXPORT_LAYERS = {
+    'deposits': ('deposits', """
+        SELECT d.id, d.name, mt.name AS mineral, d.location_name, d.country, d.region,
+               s.name AS state, d.status, d.estimated_reserves_tonnes, d.average_grade,
+               d.confidence_level, d.discovery_year,
+               d.latitude, d.longitude, NULL AS geometry
+        FROM deposits d
+        LEFT JOIN mineral_types mt ON d.mineral_type_id = mt.id
+        LEFT JOIN ss_states s ON d.state_id = s.id
+    """, 'd', ['id', 'name', 'mineral', 'location_name', 'country', 'region', 'state', 'status',
+               'estimated_reserves_tonnes', 'average_grade', 'confidence_level', 'discovery_year']),
+    'claims': ('claims', """
+        SELECT c.id, c.claim_id, c.company_name, c.location_description, c.area_hectares,
+               c.claim_type, c.issue_date, c.expiry_date, c.status, d.name AS deposit,
+               s.name AS state, c.latitude, c.longitude, c.geometry
+        FROM mining_claims c
+        LEFT JOIN deposits d ON c.deposit_id = d.id
+        LEFT JOIN ss_states s ON c.state_id = s.id
+    """, 'c', ['id', 'claim_id', 'company_name', 'location_description', 'area_hectares',
+               'claim_type', 'issue_date', 'expiry_date', 'status', 'deposit', 'state']),
+    'sites': ('sites', """
+        SELECT e.id, e.name, s.name AS state, d.name AS deposit, e.accessibility,
+               e.security_status, e.exploration_status, e.infrastructure_notes,
+               e.latitude, e.longitude, NULL AS geometry
+        FROM ss_exploration_sites e
+        LEFT JOIN ss_states s ON e.state_id = s.id
+        LEFT JOIN deposits d ON e.deposit_id = d.id
+    """, 'e', ['id', 'name', 'state', 'deposit', 'accessibility', 'security_status',
+               'exploration_status', 'infrastructure_notes']),
+}
+
+# Map layers each export reads: its ETag changes with any of them
+EXPORT_SOURCES = {
+    'deposits': ('deposits', 'states'),
+    'claims': ('claims', 'deposits', 'states'),
+    'sites': ('sites', 'states', 'deposits'),
+}
+
+# format: (mimetype, file extension)
+EXPORT_FORMATS = {
+    'geojson': ('application/geo+json', 'geojson'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+    'gpkg': ('application/geopackage+sqlite3', 'gpkg'),
+}
+
+# GeoPackage layer geometry types and non-text column types
+GPKG_GEOMETRY_TYPES = {'deposits': 'POINT', 'claims': 'GEOMETRY', 'sites': 'POINT'}
+GPKG_COLUMN_TYPES = {
+    'estimated_reserves_tonnes': 'REAL',
+    'average_grade': 'REAL',
+    'discovery_year': 'INTEGER',
+    'area_hectares': 'REAL',
+}
+
+# ============================================================
+# ROW ENCODERS
+# ============================================================
+
+def feature_json(row, fields):
+    """
+    One GeoJSON Feature as text. Stored polygon geometries are spliced in
+    as-is instead of being parsed and re-serialised.
+    """
+    if row['geometry']:
+        geometry = row['geometry']
+    elif row['latitude'] is not None and row['longitude'] is not None:
+        geometry = json.dumps({'type': 'Point', 'coordinates': [row['longitude'], row['latitude']]})
+    else:
+        geometry = 'null'
+    properties = json.dumps({f: row[f] for f in fields}, separators=(',', ':'))
+    return f'{{"type":"Feature","geometry":{geometry},"properties":{properties}}}'
+
+def _chunks(rows, encode):
+    """Join encoded rows into chunks of CHUNK_ROWS."""
+    chunk = []
+    for row in rows:
+        chunk.append(encode(row))
+        if len(chunk) >= CHUNK_ROWS:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+def stream_geojson(rows, fields):
+    """A FeatureCollection written feature by feature."""
+    yield '{"type":"FeatureCollection","features":[\n'
+    first = True
+
+    def encode(row):
+        nonlocal first
+        separator = '' if first else ',\n'
+        first = False
+        return separator + feature_json(row, fields)
+
+    yield from _chunks(rows, encode)
+    yield '\n]}\n'
+
+def stream_ndjson(rows, fields):
+    """One Feature per line (GeoJSONSeq without record separators)."""
+    yield from _chunks(rows, lambda row: feature_json(row, fields) + '\n')
+
+def stream_csv(rows, fields):
+    """CSV with the layer's columns plus latitude and longitude."""
+    buffer = io.StringIO()  # one line at a time, emptied after each
+    writer = csv.writer(buffer)
+
+    def encode(values):
+        writer.writerow(values)
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text
+
+    yield encode(fields + ['latitude', 'longitude'])
+    yield from _chunks(rows, lambda row: encode([row[f] for f in fields] + [row['latitude'], row['longitude']]))
+
+STREAMERS = {
+    'geojson': stream_geojson,
+    'ndjson': stream_ndjson,
+    'csv': stream_csv,
+}
+
+def gpkg_features(rows, fields):
+    """(fid, geometry, values) for write_geopackage; the row id becomes the fid."""
+    for row in rows:
+        if row['geometry']:
+            geometry = json.loads(row['geometry'])
+        elif row['latitude'] is not None and row['longitude'] is not None:
+            geometry = {'type': 'Point', 'coordinates': [row['longitude'], row['latitude']]}
+        else:
+            geometry = None
+        yield row['id'], geometry, [row[f] for f in fields if f != 'id']
+
+def send_geopackage(layer, rows, fields):
+    """Write a layer to a temporary .gpkg and send it."""
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, f"{layer}.gpkg")
+    try:
+        columns = [(f, GPKG_COLUMN_TYPES.get(f, 'TEXT')) for f in fields if f != 'id']
+        write_geopackage(path, layer, GPKG_GEOMETRY_TYPES[layer], columns, gpkg_features(rows, fields))
+        f = open(path, 'rb')
+    finally:
+        # The open handle keeps the data readable until the response is sent
+        shutil.rmtree(directory, ignore_errors=True)
+    return send_file(f, mimetype=EXPORT_FORMATS['gpkg'][0], as_attachment=True,
+                     download_name=f"{layer}.gpkg")
+
+# ============================================================
+# ROUTES
+# ============================================================
+
+def export_filters(layer, alias):
+    """(where, params) from ?bbox= and the layer's list filters."""
+    where, params = viewport_filter(EXPORT_LAYERS[layer][0], alias)
+    status = request.args.get('status')
+    if status and layer != 'sites':
+        where.append(f"{alias}.status = ?")
+        params.append(status)
+    mineral_id = request.args.get('mineral_id', type=int)
+    if mineral_id and layer == 'deposits':
+        where.append("d.mineral_type_id = ?")
+        params.append(mineral_id)
+    return where, params
+
+def export_routes(app):
+    """Register the streaming export endpoints"""
+
+    @app.route("/api/export/<layer>.<fmt>")
+    def export_layer(layer, fmt):
+        """Stream every row of a layer as GeoJSON, NDJSON, CSV or GeoPackage (?bbox=, ?status=, ?mineral_id=)"""
+        if layer not in EXPORT_LAYERS or fmt not in EXPORT_FORMATS:
+            return jsonify({'error': f'Unknown export: {layer}.{fmt}'}), 404
+
+        try:
+            where, params = export_filters(layer, EXPORT_LAYERS[layer][2])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        _, select, alias, fields = EXPORT_LAYERS[layer]
+        query = select + (f" WHERE {' AND '.join(f'({w})' for w in where)}" if where else "")
+        query += f" ORDER BY {alias}.id"
+
+        db = get_db()
+        # Downloads revalidate like the map APIs: unchanged layers answer 304
+        etag = layers_etag(db, EXPORT_SOURCES[layer], (fmt, sorted(request.args.items(multi=True))))
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            rows = db.execute(query, params)  # iterated lazily by the stream
+            if fmt == 'gpkg':
+                response = send_geopackage(layer, rows, fields)
+            else:
+                mimetype, extension = EXPORT_FORMATS[fmt]
+                response = Response(stream_with_context(STREAMERS[fmt](rows, fields)), mimetype=mimetype)
+                response.headers['Content-Disposition'] = f'attachment; filename="{layer}.{extension}"'
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    print("✓ Data export routes registered")
@@ -0,0 +1,115 @@
+"""
+Streaming GeoJSON Reader
+Yields the features of a FeatureCollection one at a time from a binary
+stream (an upload, which Werkzeug spools to a temporary file), so an
+import never holds the whole document or its parsed tree in memory.
+
+Only the text of the feature being decoded is buffered. Each feature is
+handed to json's raw_decode once it is complete, so the per-feature
+parsing is the same C decoder json.loads uses.
+"""
+
+import codecs
+import json
+
+READ_SIZE = 64 * 1024
+MAX_FEATURE_BYTES = 32 * 1024 * 1024  # one feature (e.g. a detailed polygon)
+WHITESPACE = ' \t\n\r'
+
+class InvalidGeoJSON(ValueError):
+    """The stream is not a GeoJSON FeatureCollection."""
+
+class _Reader:
+    """Text buffer over a byte stream, refilled on demand."""
+
+    def __init__(self, stream, read_size):
+        self.stream = stream
+        self.read_size = read_size
+        self.decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size=None):
+        """Read more text; False at the end of the stream."""
+        if self.eof:
+            return False
+        # Drop consumed text so the buffer only holds the current value
+        if self.pos:
+            self.text = self.text[self.pos:]
+            self.pos = 0
+        data = self.stream.read(size or self.read_size)
+        self.eof = not data
+        self.text += self.decoder.decode(data or b'', final=self.eof)
+        return True
+
+    def peek(self):
+        """Next non-whitespace character (not consumed), '' at the end."""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise InvalidGeoJSON(f"Expected {' or '.join(repr(c) for c in chars)} at "
+                                 f"{'end of file' if not char else repr(char)}")
+        self.pos += 1
+        return char
+
+    def value(self, decoder=json.JSONDecoder()):
+        """
+        Decode the next complete JSON value. A value is only accepted when
+        text follows it (or the stream has ended), so a number split across
+        reads is not cut short.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.text, self.pos)
+                if end < len(self.text) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise InvalidGeoJSON(f"Invalid JSON: {e.msg}")
+            if len(self.text) - self.pos > MAX_FEATURE_BYTES:
+                raise InvalidGeoJSON("A GeoJSON value exceeds the size limit")
+            # Grow geometrically so a large value is re-scanned O(log n) times
+            self.fill(max(self.read_size, len(self.text) - self.pos))
+
+def iter_features(stream, read_size=READ_SIZE):
+    """
+    Yield each feature dict of a GeoJSON FeatureCollection read from a
+    binary stream. Members other than "features" are skipped; raises
+    InvalidGeoJSON when the document is malformed.
+    """
+    reader = _Reader(stream, read_size)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+
+    while True:
+        key = reader.value()
+        if not isinstance(key, str):
+            raise InvalidGeoJSON("Object keys must be strings")
+        reader.expect(':')
+
+        if key == 'features':
+            reader.expect('[')
+            if reader.peek() == ']':
+                reader.pos += 1
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.expect(',]') == ']':
+                        break
+        else:
+            reader.value()
+
+        if reader.expect(',}') == '}':
+            return
@@ -0,0 +1,295 @@
+"""
+Polygon Geometry
+Pure-Python helpers for GeoJSON Polygon/MultiPolygon geometries: bounding
+boxes, centroids, areas, an exact overlap test and Douglas-Peucker
+simplification. Coordinates are treated as planar longitude/latitude,
+which is accurate enough for claim-sized shapes away from the antimeridian.
+
+A parsed shape is a list of polygons, each a list of rings (exterior
+first, then holes), each ring a list of (lon, lat) tuples without the
+repeated closing point.
+"""
+
+import json
+import math
+
+POLYGON_TYPES = ('Polygon', 'MultiPolygon')
+
+# Metres per degree of latitude (and of longitude at the equator)
+METRES_PER_DEGREE = 111320.0
+
+# ============================================================
+# PARSING
+# ============================================================
+
+def parse_polygons(geometry):
+    """Parse a GeoJSON Polygon/MultiPolygon; raises ValueError if invalid."""
+    kind = geometry.get('type')
+    if kind == 'Polygon':
+        parts = [geometry.get('coordinates') or []]
+    elif kind == 'MultiPolygon':
+        parts = geometry.get('coordinates') or []
+    else:
+        raise ValueError(f"Not a polygon geometry: {kind}")
+
+    shape = []
+    try:
+        for polygon in parts:
+            rings = []
+            for ring in polygon:
+                points = [(float(p[0]), float(p[1])) for p in ring]
+                if len(points) > 1 and points[0] == points[-1]:
+                    points.pop()
+                if len(points) < 3:
+                    raise ValueError("Polygon rings need at least three points")
+                rings.append(points)
+            if rings:
+                shape.append(rings)
+    except (TypeError, IndexError):
+        raise ValueError("Malformed polygon coordinates")
+
+    if not shape:
+        raise ValueError("Empty polygon geometry")
+    if not all(math.isfinite(v) for polygon in shape for ring in polygon for p in ring for v in p):
+        raise ValueError("Polygon coordinates must be finite")
+    return shape
+
+def to_geojson(shape):
+    """GeoJSON geometry dict for a parsed shape (rings closed again)."""
+    def closed(ring):
+        return [list(p) for p in ring] + [list(ring[0])]
+
+    if len(shape) == 1:
+        return {'type': 'Polygon', 'coordinates': [closed(r) for r in shape[0]]}
+    return {'type': 'MultiPolygon', 'coordinates': [[closed(r) for r in polygon] for polygon in shape]}
+
+# ============================================================
+# MEASURES
+# ============================================================
+
+def shape_bbox(shape):
+    """(west, south, east, north) of a shape."""
+    xs = [p[0] for polygon in shape for p in polygon[0]]
+    ys = [p[1] for polygon in shape for p in polygon[0]]
+    return min(xs), min(ys), max(xs), max(ys)
+
+def _ring_moments(ring):
+    """Signed area and first moments (area * centroid) of a ring."""
+    area = cx = cy = 0.0
+    for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+        cross = x0 * y1 - x1 * y0
+        area += cross
+        cx += (x0 + x1) * cross
+        cy += (y0 + y1) * cross
+    return area / 2, cx / 6, cy / 6
+
+def _shape_moments(shape):
+    """Total area and first moments, holes subtracted."""
+    area = mx = my = 0.0
+    for polygon in shape:
+        for i, ring in enumerate(polygon):
+            a, x, y = _ring_moments(ring)
+            # Normalise winding: exteriors add, holes subtract
+            sign = (1 if a >= 0 else -1) * (1 if i == 0 else -1)
+            area += sign * a
+            mx += sign * x
+            my += sign * y
+    return area, mx, my
+
+def shape_centroid(shape):
+    """(lon, lat) centroid of a shape; vertex mean for degenerate shapes."""
+    area, mx, my = _shape_moments(shape)
+    if abs(area) > 1e-18:
+        return mx / area, my / area
+    points = [p for polygon in shape for p in polygon[0]]
+    return sum(p[0] for p in points) / len(points), sum(p[1] for p in points) / len(points)
+
+def shape_area_hectares(shape):
+    """Approximate area in hectares (degrees scaled at the centroid latitude)."""
+    area = abs(_shape_moments(shape)[0])
+    lat = shape_centroid(shape)[1]
+    return area * METRES_PER_DEGREE ** 2 * math.cos(math.radians(lat)) / 10000
+
+def extent_columns(shape):
+    """Column values storing a shape: geometry JSON plus its bbox."""
+    west, south, east, north = shape_bbox(shape)
+    return {
+        'geometry': json.dumps(to_geojson(shape), separators=(',', ':')),
+        'min_lon': west,
+        'max_lon': east,
+        'min_lat': south,
+        'max_lat': north,
+    }
+
+# ============================================================
+# POINT LOCATION
+# ============================================================
+
+INSIDE, BOUNDARY, OUTSIDE = 1, 0, -1
+
+def _orientation(a, b, c):
+    return (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+
+def _on_segment(p, a, b):
+    return (_orientation(a, b, p) == 0
+            and min(a[0], b[0]) <= p[0] <= max(a[0], b[0])
+            and min(a[1], b[1]) <= p[1] <= max(a[1], b[1]))
+
+def locate(point, polygon):
+    """INSIDE, BOUNDARY or OUTSIDE of a polygon (even-odd over all rings)."""
+    x, y = point
+    inside = False
+    for ring in polygon:
+        for a, b in zip(ring, ring[1:] + ring[:1]):
+            if _on_segment(point, a, b):
+                return BOUNDARY
+            if (a[1] > y) != (b[1] > y):
+                if x < a[0] + (y - a[1]) * (b[0] - a[0]) / (b[1] - a[1]):
+                    inside = not inside
+    return INSIDE if inside else OUTSIDE
+
+def interior_point(polygon):
+    """
+    A point strictly inside a polygon: the middle of the widest span of a
+    horizontal line placed between two vertex latitudes, so it cannot
+    pass through a vertex.
+    """
+    ys = sorted({p[1] for ring in polygon for p in ring})
+    if len(ys) < 2:
+        return None
+    mid = len(ys) // 2
+    y = (ys[mid - 1] + ys[mid]) / 2
+
+    xs = []
+    for ring in polygon:
+        for a, b in zip(ring, ring[1:] + ring[:1]):
+            if (a[1] > y) != (b[1] > y):
+                xs.append(a[0] + (y - a[1]) * (b[0] - a[0]) / (b[1] - a[1]))
+    xs.sort()
+    spans = [(xs[i + 1] - xs[i], i) for i in range(0, len(xs) - 1, 2)]
+    if not spans or max(spans)[0] <= 0:
+        return None
+    i = max(spans)[1]
+    return (xs[i] + xs[i + 1]) / 2, y
+
+# ============================================================
+# OVERLAP
+# ============================================================
+
+def _segments_cross(p1, p2, q1, q2):
+    """True when two segments cross at a point inside both (not at an end)."""
+    d1, d2 = _orientation(q1, q2, p1), _orientation(q1, q2, p2)
+    d3, d4 = _orientation(p1, p2, q1), _orientation(p1, p2, q2)
+    return d1 * d2 < 0 and d3 * d4 < 0
+
+def _edges(polygon, bbox):
+    """Edges of a polygon whose bounds touch bbox."""
+    west, south, east, north = bbox
+    return [
+        (a, b) for ring in polygon for a, b in zip(ring, ring[1:] + ring[:1])
+        if max(a[0], b[0]) >= west and min(a[0], b[0]) <= east
+        and max(a[1], b[1]) >= south and min(a[1], b[1]) <= north
+    ]
+
+def _samples(polygon):
+    """Vertices, edge midpoints and an interior point of a polygon."""
+    for ring in polygon:
+        for a, b in zip(ring, ring[1:] + ring[:1]):
+            yield a
+            yield (a[0] + b[0]) / 2, (a[1] + b[1]) / 2
+    point = interior_point(polygon)
+    if point is not None:
+        yield point
+
+def _polygons_overlap(a, b):
+    bbox_a, bbox_b = shape_bbox([a]), shape_bbox([b])
+    if (bbox_a[0] > bbox_b[2] or bbox_b[0] > bbox_a[2]
+            or bbox_a[1] > bbox_b[3] or bbox_b[1] > bbox_a[3]):
+        return False
+
+    edges_b = _edges(b, bbox_a)
+    for p1, p2 in _edges(a, bbox_b):
+        for q1, q2 in edges_b:
+            if _segments_cross(p1, p2, q1, q2):
+                return True
+
+    # No crossing edges: they overlap only if one reaches inside the other
+    return (any(locate(p, b) == INSIDE for p in _samples(a))
+            or any(locate(p, a) == INSIDE for p in _samples(b)))
+
+def shapes_overlap(a, b):
+    """
+    True when two shapes share interior area. Shapes that only touch
+    along an edge or at a corner (adjacent claims) do not overlap.
+    """
+    return any(_polygons_overlap(pa, pb) for pa in a for pb in b)
+
+# ============================================================
+# SIMPLIFICATION & QUANTISATION
+# ============================================================
+
+def _segment_distance2(p, a, b):
+    """Squared distance from p to segment ab (to a when a == b)."""
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    if dx == 0 and dy == 0:
+        return (p[0] - a[0]) ** 2 + (p[1] - a[1]) ** 2
+    t = max(0.0, min(1.0, ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / (dx * dx + dy * dy)))
+    return (p[0] - a[0] - t * dx) ** 2 + (p[1] - a[1] - t * dy) ** 2
+
+def simplify_ring(ring, tolerance):
+    """
+    Douglas-Peucker simplification of a ring: vertices closer than
+    tolerance to the simplified outline are dropped. The ring is treated
+    as a polyline from its first vertex back to itself, so the farthest
+    vertex from the start is always kept.
+    """
+    points = ring + ring[:1]
+    keep = bytearray(len(points))
+    keep[0] = keep[-1] = 1
+    tolerance2 = tolerance * tolerance
+
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        worst, worst_d2 = None, tolerance2
+        for i in range(first + 1, last):
+            d2 = _segment_distance2(points[i], points[first], points[last])
+            if d2 > worst_d2:
+                worst, worst_d2 = i, d2
+        if worst is not None:
+            keep[worst] = 1
+            stack.append((first, worst))
+            stack.append((worst, last))
+    return [p for p, kept in zip(points[:-1], keep) if kept]
+
+def quantize_ring(ring, digits):
+    """Round a ring to `digits` decimals, dropping repeated vertices."""
+    result = []
+    for x, y in ring:
+        point = (round(x, digits), round(y, digits))
+        if not result or point != result[-1]:
+            result.append(point)
+    while len(result) > 1 and result[0] == result[-1]:
+        result.pop()
+    return result
+
+def simplify_shape(shape, tolerance, digits=None):
+    """
+    Simplified (and optionally quantised) copy of a shape. Rings that
+    collapse below three vertices are dropped, and polygons whose exterior
+    collapses go with them; returns None when nothing is left.
+    """
+    result = []
+    for polygon in shape:
+        rings = []
+        for i, ring in enumerate(polygon):
+            ring = simplify_ring(ring, tolerance)
+            if digits is not None:
+                ring = quantize_ring(ring, digits)
+            if len(ring) >= 3:
+                rings.append(ring)
+            elif i == 0:
+                break
+        if rings:
+            result.append(rings)
+    return result or None
@@ -0,0 +1,328 @@
+"""
+GeoPackage Import & Export
+Reads the first feature layer of an uploaded GeoPackage (.gpkg, an SQLite
+database) for the QGIS importer, and writes layers out as GeoPackages with
+an R-tree spatial index, so QGIS can round-trip data without GeoJSON.
+
+Geometries are GPKG blobs: a small "GP" header (SRS id, optional
+envelope) followed by standard WKB. Points and polygons are decoded to
+GeoJSON-like dicts; other types are decoded too but not imported.
+"""
+
+import math
+import sqlite3
+import struct
+from urllib.parse import quote
+
+APPLICATION_ID = 0x47504B47  # "GPKG"
+USER_VERSION = 10300         # GeoPackage 1.3
+WGS84 = 4326
+
+WKB_TYPES = {1: 'Point', 2: 'LineString', 3: 'Polygon', 4: 'MultiPoint',
+             5: 'MultiLineString', 6: 'MultiPolygon', 7: 'GeometryCollection'}
+ENVELOPE_SIZES = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+
+class InvalidGeoPackage(ValueError):
+    """The upload is not a readable GeoPackage feature layer."""
+
+# ============================================================
+# GEOMETRY DECODING
+# ============================================================
+
+def _wkb(data, offset):
+    """Decode one WKB geometry at offset; returns (GeoJSON dict, end offset)."""
+    endian = '<' if data[offset] == 1 else '>'
+    wkb_type, = struct.unpack_from(endian + 'I', data, offset + 1)
+    offset += 5
+
+    # ISO (1001, 2003, ...) and extended (high bit flags) Z/M variants
+    dims = 2 + (wkb_type & 0x80000000 != 0) + (wkb_type & 0x40000000 != 0)
+    wkb_type &= 0x0FFFFFFF
+    dims += {0: 0, 1: 1, 2: 1, 3: 2}.get(wkb_type // 1000, 0)
+    kind = WKB_TYPES.get(wkb_type % 1000)
+    if kind is None:
+        raise InvalidGeoPackage(f"Unsupported WKB geometry type {wkb_type}")
+
+    def points(count, offset):
+        values = struct.unpack_from(f'{endian}{count * dims}d', data, offset)
+        return [list(values[i:i + 2]) for i in range(0, len(values), dims)], offset + 8 * dims * count
+
+    def count_at(offset):
+        return struct.unpack_from(endian + 'I', data, offset)[0], offset + 4
+
+    if kind == 'Point':
+        coords, offset = points(1, offset)
+        # Empty points are stored as NaN coordinates
+        return (None if any(math.isnan(v) for v in coords[0]) else {'type': kind, 'coordinates': coords[0]}), offset
+    if kind == 'LineString':
+        count, offset = count_at(offset)
+        coords, offset = points(count, offset)
+        return {'type': kind, 'coordinates': coords}, offset
+    if kind == 'Polygon':
+        rings, offset = count_at(offset)
+        coords = []
+        for _ in range(rings):
+            count, offset = count_at(offset)
+            ring, offset = points(count, offset)
+            coords.append(ring)
+        return {'type': kind, 'coordinates': coords}, offset
+
+    # Multi* and collections hold complete WKB geometries
+    count, offset = count_at(offset)
+    parts = []
+    for _ in range(count):
+        part, offset = _wkb(data, offset)
+        if part is not None:
+            parts.append(part)
+    if kind == 'GeometryCollection':
+        return {'type': kind, 'geometries': parts}, offset
+    return {'type': kind, 'coordinates': [part['coordinates'] for part in parts]}, offset
+
+def gpkg_geometry(blob):
+    """GeoJSON-like geometry of a GPKG geometry blob, or None when empty."""
+    if blob is None:
+        return None
+    if len(blob) < 8 or blob[:2] != b'GP':
+        raise InvalidGeoPackage("Not a GeoPackage geometry")
+    flags = blob[3]
+    if flags & 0x10:
+        return None
+    envelope = ENVELOPE_SIZES.get((flags >> 1) & 0x07)
+    if envelope is None:
+        raise InvalidGeoPackage("Invalid GeoPackage geometry envelope")
+    try:
+        return _wkb(blob, 8 + envelope)[0]
+    except (struct.error, IndexError):
+        raise InvalidGeoPackage("Malformed GeoPackage geometry")
+
+# ============================================================
+# IMPORT
+# ============================================================
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+class GeoPackageReader:
+    """
+    Features of the first feature layer of a GeoPackage file, as dicts
+    like GeoJSON features. Opened read-only and immutable: the upload is
+    a spooled copy nobody else writes. tell() estimates the position.
+    """
+
+    def __init__(self, f):
+        self.size = max(f.seek(0, 2), 1)
+        self.read = 0
+        self.count = 0
+        try:
+            self.conn = sqlite3.connect(f"file:{quote(f.name)}?mode=ro&immutable=1", uri=True)
+            layer = self.conn.execute("""
+                SELECT g.table_name, g.column_name, g.srs_id
+                FROM gpkg_geometry_columns g
+                JOIN gpkg_contents c ON c.table_name = g.table_name
+                WHERE c.data_type = 'features'
+                ORDER BY c.table_name
+                LIMIT 1
+            """).fetchone()
+        except sqlite3.DatabaseError:
+            raise InvalidGeoPackage("Not a GeoPackage")
+        if layer is None:
+            raise InvalidGeoPackage("No feature layer found in the GeoPackage")
+
+        self.table, self.column, srs_id = layer
+        if srs_id not in (WGS84, 0, -1) and not self._is_wgs84(srs_id):
+            raise InvalidGeoPackage("The layer must use WGS 84 (EPSG:4326) coordinates")
+        self.count = self.conn.execute(f"SELECT COUNT(*) FROM {_quote(self.table)}").fetchone()[0]
+
+    def _is_wgs84(self, srs_id):
+        row = self.conn.execute("""
+            SELECT organization, organization_coordsys_id FROM gpkg_spatial_ref_sys WHERE srs_id = ?
+        """, (srs_id,)).fetchone()
+        return row is not None and row[0].upper() == 'EPSG' and row[1] == WGS84
+
+    def __iter__(self):
+        try:
+            cursor = self.conn.execute(f"SELECT * FROM {_quote(self.table)} ORDER BY rowid")
+            names = [d[0] for d in cursor.description]
+            for row in cursor:
+                self.read += 1
+                properties = dict(zip(names, row))
+                blob = properties.pop(self.column)
+                yield {'type': 'Feature', 'properties': properties, 'geometry': gpkg_geometry(blob)}
+        except sqlite3.DatabaseError as e:
+            raise InvalidGeoPackage(f"Unreadable GeoPackage: {e}")
+        finally:
+            self.conn.close()
+
+    def tell(self):
+        return self.size * self.read // self.count if self.count else 0
+
+def read_geopackage(f):
+    """Features of a GeoPackage file opened in binary mode (named, on disk)."""
+    return GeoPackageReader(f)
+
+# ============================================================
+# EXPORT
+# ============================================================
+
+def _wkb_point(x, y):
+    return struct.pack('<BI2d', 1, 1, x, y)
+
+def _wkb_rings(rings):
+    data = struct.pack('<I', len(rings))
+    for ring in rings:
+        data += struct.pack(f'<I{2 * len(ring)}d', len(ring), *(v for point in ring for v in point[:2]))
+    return data
+
+def gpkg_blob(geometry):
+    """
+    GPKG blob and (minx, maxx, miny, maxy) of a Point, Polygon or
+    MultiPolygon GeoJSON geometry. Polygons carry an envelope; points
+    are their own.
+    """
+    kind, coords = geometry['type'], geometry['coordinates']
+    if kind == 'Point':
+        x, y = coords[0], coords[1]
+        return b'GP' + struct.pack('<BBi', 0, 0x01, WGS84) + _wkb_point(x, y), (x, x, y, y)
+
+    polygons = [coords] if kind == 'Polygon' else coords
+    xs = [p[0] for polygon in polygons for p in polygon[0]]
+    ys = [p[1] for polygon in polygons for p in polygon[0]]
+    bbox = (min(xs), max(xs), min(ys), max(ys))
+    if kind == 'Polygon':
+        wkb = struct.pack('<BI', 1, 3) + _wkb_rings(coords)
+    else:
+        wkb = struct.pack('<BII', 1, 6, len(polygons))
+        wkb += b''.join(struct.pack('<BI', 1, 3) + _wkb_rings(polygon) for polygon in polygons)
+    # flags: little endian, [minx, maxx, miny, maxy] envelope
+    return b'GP' + struct.pack('<BBi4d', 0, 0x03, WGS84, *bbox) + wkb, bbox
+
+SPATIAL_REF_SYS = [
+    ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', 'undefined cartesian coordinate reference system'),
+    ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', 'undefined geographic coordinate reference system'),
+    ('WGS 84 geodetic', WGS84, 'EPSG', WGS84,
+     'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,'
+     'AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,'
+     'AUTHORITY["EPSG","8901"]],UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],'
+     'AUTHORITY["EPSG","4326"]]',
+     'longitude/latitude coordinates in decimal degrees on the WGS 84 spheroid'),
+]
+
+# R-tree maintenance triggers from the GeoPackage spec (rtree extension);
+# readers such as GDAL/QGIS provide the ST_* functions they call.
+RTREE_TRIGGERS = """
+CREATE TRIGGER "{name}_insert" AFTER INSERT ON {t}
+WHEN (new.{c} NOT NULL AND NOT ST_IsEmpty(NEW.{c}))
+BEGIN
+  INSERT OR REPLACE INTO {rtree} VALUES (
+    NEW.{i}, ST_MinX(NEW.{c}), ST_MaxX(NEW.{c}), ST_MinY(NEW.{c}), ST_MaxY(NEW.{c}));
+END;
+CREATE TRIGGER "{name}_update1" AFTER UPDATE OF {c} ON {t}
+WHEN OLD.{i} = NEW.{i} AND (NEW.{c} NOTNULL AND NOT ST_IsEmpty(NEW.{c}))
+BEGIN
+  INSERT OR REPLACE INTO {rtree} VALUES (
+    NEW.{i}, ST_MinX(NEW.{c}), ST_MaxX(NEW.{c}), ST_MinY(NEW.{c}), ST_MaxY(NEW.{c}));
+END;
+CREATE TRIGGER "{name}_update2" AFTER UPDATE OF {c} ON {t}
+WHEN OLD.{i} = NEW.{i} AND (NEW.{c} ISNULL OR ST_IsEmpty(NEW.{c}))
+BEGIN
+  DELETE FROM {rtree} WHERE id = OLD.{i};
+END;
+CREATE TRIGGER "{name}_update3" AFTER UPDATE ON {t}
+WHEN OLD.{i} != NEW.{i} AND (NEW.{c} NOTNULL AND NOT ST_IsEmpty(NEW.{c}))
+BEGIN
+  DELETE FROM {rtree} WHERE id = OLD.{i};
+  INSERT OR REPLACE INTO {rtree} VALUES (
+    NEW.{i}, ST_MinX(NEW.{c}), ST_MaxX(NEW.{c}), ST_MinY(NEW.{c}), ST_MaxY(NEW.{c}));
+END;
+CREATE TRIGGER "{name}_update4" AFTER UPDATE ON {t}
+WHEN OLD.{i} != NEW.{i} AND (NEW.{c} ISNULL OR ST_IsEmpty(NEW.{c}))
+BEGIN
+  DELETE FROM {rtree} WHERE id IN (OLD.{i}, NEW.{i});
+END;
+CREATE TRIGGER "{name}_delete" AFTER DELETE ON {t}
+WHEN old.{c} NOT NULL
+BEGIN
+  DELETE FROM {rtree} WHERE id = OLD.{i};
+END;
+"""
+
+def write_geopackage(path, table, geometry_type, columns, features):
+    """
+    Write features to a new GeoPackage at path.
+
+    Args:
+        table: Feature table (layer) name
+        geometry_type: GPKG geometry type name (POINT, GEOMETRY, ...)
+        columns: [(name, SQL type)] attribute columns
+        features: Iterable of (fid, GeoJSON geometry or None, [attribute values])
+
+    Returns:
+        Number of features written
+    """
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute(f"PRAGMA application_id = {APPLICATION_ID}")
+        conn.execute(f"PRAGMA user_version = {USER_VERSION}")
+        # A fresh scratch file: no journal needed
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+
+        conn.executescript("""
+            CREATE TABLE gpkg_spatial_ref_sys (
+                srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL,
+                organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT);
+            CREATE TABLE gpkg_contents (
+                table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE,
+                description TEXT DEFAULT '', last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+                min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER,
+                CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id));
+            CREATE TABLE gpkg_geometry_columns (
+                table_name TEXT NOT NULL, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL,
+                srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL,
+                CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name));
+            CREATE TABLE gpkg_extensions (
+                table_name TEXT, column_name TEXT, extension_name TEXT NOT NULL,
+                definition TEXT NOT NULL, scope TEXT NOT NULL,
+                CONSTRAINT ge_tce UNIQUE (table_name, column_name, extension_name));
+        """)
+        conn.executemany("INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)", SPATIAL_REF_SYS)
+
+        name = f"rtree_{table}_geom".replace('"', '""')
+        t, rtree = _quote(table), f'"{name}"'
+        conn.execute(f"""
+            CREATE TABLE {t} (fid INTEGER PRIMARY KEY AUTOINCREMENT, geom {geometry_type},
+                              {', '.join(f'{_quote(name)} {kind}' for name, kind in columns)})
+        """)
+        conn.execute(f"CREATE VIRTUAL TABLE {rtree} USING rtree(id, minx, maxx, miny, maxy)")
+
+        extent = [math.inf, -math.inf, math.inf, -math.inf]
+        count = 0
+        insert = (f"INSERT INTO {t} (fid, geom, {', '.join(_quote(name) for name, _ in columns)}) "
+                  f"VALUES ({', '.join('?' * (len(columns) + 2))})")
+        for fid, geometry, values in features:
+            blob = None
+            if geometry:
+                blob, bbox = gpkg_blob(geometry)
+                conn.execute(f"INSERT INTO {rtree} VALUES (?, ?, ?, ?, ?)", (fid,) + bbox)
+                extent = [min(extent[0], bbox[0]), max(extent[1], bbox[1]),
+                          min(extent[2], bbox[2]), max(extent[3], bbox[3])]
+            conn.execute(insert, [fid, blob] + list(values))
+            count += 1
+
+        bounds = (extent[0], extent[2], extent[1], extent[3]) if count and math.isfinite(extent[0]) else (None,) * 4
+        conn.execute("""
+            INSERT INTO gpkg_contents (table_name, data_type, identifier, min_x, min_y, max_x, max_y, srs_id)
+            VALUES (?, 'features', ?, ?, ?, ?, ?, ?)
+        """, (table, table) + bounds + (WGS84,))
+        conn.execute("INSERT INTO gpkg_geometry_columns VALUES (?, 'geom', ?, ?, 0, 0)",
+                     (table, geometry_type, WGS84))
+        conn.execute("""
+            INSERT INTO gpkg_extensions VALUES (?, 'geom', 'gpkg_rtree_index',
+                'http://www.geopackage.org/spec120/#extension_rtree', 'write-only')
+        """, (table,))
+        # Added after the bulk load: the index above is filled directly
+        conn.executescript(RTREE_TRIGGERS.format(name=name, rtree=rtree, t=t, c='geom', i='fid'))
+        conn.commit()
+    finally:
+        conn.close()
+    return count
@@ -1,32 +1,55 @@
 """
 Geospatial Data Management & QGIS Import
-Handles GeoJSON, Shapefile, and CSV data import from QGIS
+Handles GeoJSON, Shapefile, GeoPackage and CSV data import from QGIS
 """
 
-import json
 import csv
 import io
-from flask import render_template, request, jsonify, redirect, session
+from flask import render_template, request, jsonify, redirect, session, current_app
 from werkzeug.utils import secure_filename
-from app.db import get_db
+from app.db import get_db, execute_write
 from app.utils import is_admin
-from app.helpers import login_required
+from app.helpers import login_required, large_upload
+from app.geojson_stream import iter_features
+from app.shapefile import read_shapefile
+from app.geopackage import read_geopackage
+from app.import_jobs import start_import
+from app.geometry import (POLYGON_TYPES, parse_polygons, shape_centroid, shape_area_hectares,
+                          extent_columns)
+from app.states import assign_states
+from app.simplify import store_levels
 import zipfile
 
 # Allowed file types for QGIS imports
-ALLOWED_GIS_EXTENSIONS = {'json', 'geojson', 'csv', 'zip', 'shp', 'dbf', 'shx'}
+ALLOWED_GIS_EXTENSIONS = {'json', 'geojson', 'csv', 'zip', 'shp', 'dbf', 'shx', 'gpkg'}
 
 def allowed_gis_file(filename):
     """Check if file is a valid GIS format"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_GIS_EXTENSIONS
 
-def parse_geojson_features(features, data_type='deposits'):
+def field(props, *names, default=None):
+    """
+    First non-empty value among names. Imports take both the short QGIS
+    names (reserves, grade, ...) and the column names our exports write.
+    """
+    for name in names:
+        value = props.get(name)
+        if value is not None and value != '':
+            return value
+    return default
+
+def number(value, kind=float):
+    """value as kind, or None when it is missing or zero."""
+    return kind(value) if value else None
+
+def parse_geojson_features(features, data_type='deposits', offset=0):
     """
     Parse GeoJSON FeatureCollection and extract relevant data
     
     Args:
-        features: List of GeoJSON features
+        features: Iterable of GeoJSON features (e.g. iter_features over an upload)
         data_type: 'deposits' or 'claims'
+        offset: Rows already parsed from the same file (numbers default claim IDs)
     
     Returns:
         List of parsed data dicts
@@ -34,46 +57,62 @@ def parse_geojson_features(features, data_type='deposits'):
     parsed_data = []
     
     for feature in features:
-        if feature.get('type') != 'Feature':
+        if not isinstance(feature, dict) or feature.get('type') != 'Feature':
             continue
             
         props = feature.get('properties', {})
-        geom = feature.get('geometry', {})
+        geom = feature.get('geometry') or {}
         
+        # Points are stored as-is; polygons by their centroid (claims also keep the shape)
+        shape = None
         if geom.get('type') == 'Point':
             coords = geom.get('coordinates', [])
-            if len(coords) >= 2:
-                lng, lat = coords[0], coords[1]
-                
-                if data_type == 'deposits':
-                    parsed_data.append({
-                        'name': props.get('name', props.get('NAME', 'Unknown Deposit')),
-                        'mineral_type_id': 1,  # Default - user can update later
-                        'ore_type_id': 1,  # Default - user can update later
-                        'location_name': props.get('location', props.get('LOCATION', '')),
-                        'latitude': lat,
-                        'longitude': lng,
-                        'country': props.get('country', props.get('COUNTRY', '')),
-                        'region': props.get('region', props.get('REGION', '')),
-                        'estimated_reserves_tonnes': float(props.get('reserves', props.get('RESERVES', 0))) if props.get('reserves') or props.get('RESERVES') else None,
-                        'average_grade': float(props.get('grade', props.get('GRADE', 0))) if props.get('grade') or props.get('GRADE') else None,
-                        'confidence_level': props.get('confidence', props.get('CONFIDENCE', 'Unknown')),
-                        'discovery_year': int(props.get('year', props.get('YEAR', 0))) if props.get('year') or props.get('YEAR') else None,
-                        'status': props.get('status', props.get('STATUS', 'Prospect')),
-                        'notes': props.get('notes', props.get('NOTES', '')),
-                    })
-                    
-                elif data_type == 'claims':
-                    parsed_data.append({
-                        'claim_id': props.get('claim_id', props.get('CLAIM_ID', 'CLM-' + str(len(parsed_data)))),
-                        'company_name': props.get('company', props.get('COMPANY', '')),
-                        'location_description': props.get('location', props.get('LOCATION', '')),
-                        'area_hectares': float(props.get('area', props.get('AREA', 0))) if props.get('area') or props.get('AREA') else None,
-                        'claim_type': props.get('claim_type', props.get('CLAIM_TYPE', 'Exploration')),
-                        'latitude': lat,
-                        'longitude': lng,
-                        'status': props.get('status', props.get('STATUS', 'Active')),
-                    })
+            if len(coords) < 2:
+                continue
+            lng, lat = coords[0], coords[1]
+        elif geom.get('type') in POLYGON_TYPES:
+            try:
+                shape = parse_polygons(geom)
+            except ValueError:
+                continue
+            lng, lat = shape_centroid(shape)
+        else:
+            continue
+        
+        if data_type == 'deposits':
+            parsed_data.append({
+                'name': field(props, 'name', 'NAME', default='Unknown Deposit'),
+                'mineral_type_id': 1,  # Default - user can update later
+                'ore_type_id': 1,  # Default - user can update later
+                'location_name': field(props, 'location', 'LOCATION', 'location_name', default=''),
+                'latitude': lat,
+                'longitude': lng,
+                'country': field(props, 'country', 'COUNTRY', default=''),
+                'region': field(props, 'region', 'REGION', default=''),
+                'estimated_reserves_tonnes': number(field(props, 'reserves', 'RESERVES', 'estimated_reserves_tonnes')),
+                'average_grade': number(field(props, 'grade', 'GRADE', 'average_grade')),
+                'confidence_level': field(props, 'confidence', 'CONFIDENCE', 'confidence_level', default='Unknown'),
+                'discovery_year': number(field(props, 'year', 'YEAR', 'discovery_year'), int),
+                'status': field(props, 'status', 'STATUS', default='Prospect'),
+                'notes': field(props, 'notes', 'NOTES', default=''),
+            })
+            
+        elif data_type == 'claims':
+            claim = {
+                'claim_id': field(props, 'claim_id', 'CLAIM_ID', default='CLM-' + str(offset + len(parsed_data))),
+                'company_name': field(props, 'company', 'COMPANY', 'company_name', default=''),
+                'location_description': field(props, 'location', 'LOCATION', 'location_description', default=''),
+                'area_hectares': number(field(props, 'area', 'AREA', 'area_hectares')),
+                'claim_type': field(props, 'claim_type', 'CLAIM_TYPE', default='Exploration'),
+                'latitude': lat,
+                'longitude': lng,
+                'status': field(props, 'status', 'STATUS', default='Active'),
+            }
+            if shape:
+                claim.update(extent_columns(shape))
+                if claim['area_hectares'] is None:
+                    claim['area_hectares'] = round(shape_area_hectares(shape), 4)
+            parsed_data.append(claim)
     
     return parsed_data
 
@@ -89,11 +128,22 @@ def parse_csv_data(csv_content, data_type='deposits'):
     Returns:
         List of parsed data dicts
     """
+    return parse_csv_rows(csv.DictReader(io.StringIO(csv_content)), data_type)
+
+def csv_records(f):
+    """Rows of a CSV file opened in binary mode, as dicts."""
+    text = io.TextIOWrapper(f, encoding='utf-8-sig', newline='')
+    try:
+        yield from csv.DictReader(text)
+    finally:
+        # Leave the file open for its owner (and its position readable)
+        text.detach()
+
+def parse_csv_rows(rows, data_type='deposits', offset=0):
+    """Parse CSV row dicts (see parse_csv_data); offset as in parse_geojson_features."""
     parsed_data = []
-    csv_file = io.StringIO(csv_content)
-    reader = csv.DictReader(csv_file)
     
-    for row in reader:
+    for row in rows:
         try:
             lat = float(row.get('latitude', row.get('Latitude', row.get('LAT', 0))))
             lng = float(row.get('longitude', row.get('Longitude', row.get('LON', 0))))
@@ -103,38 +153,142 @@ def parse_csv_data(csv_content, data_type='deposits'):
                 
             if data_type == 'deposits':
                 parsed_data.append({
-                    'name': row.get('name', row.get('Name', row.get('NAME', 'Unknown'))),
+                    'name': field(row, 'name', 'Name', 'NAME', default='Unknown'),
                     'mineral_type_id': 1,  # Default
                     'ore_type_id': 1,  # Default
-                    'location_name': row.get('location', row.get('Location', '')),
+                    'location_name': field(row, 'location', 'Location', 'location_name', default=''),
                     'latitude': lat,
                     'longitude': lng,
-                    'country': row.get('country', row.get('Country', '')),
-                    'region': row.get('region', row.get('Region', '')),
-                    'estimated_reserves_tonnes': float(row.get('reserves', row.get('Reserves', 0))) if row.get('reserves') or row.get('Reserves') else None,
-                    'average_grade': float(row.get('grade', row.get('Grade', 0))) if row.get('grade') or row.get('Grade') else None,
-                    'confidence_level': row.get('confidence', row.get('Confidence', 'Unknown')),
-                    'discovery_year': int(row.get('year', row.get('Year', 0))) if row.get('year') or row.get('Year') else None,
-                    'status': row.get('status', row.get('Status', 'Prospect')),
-                    'notes': row.get('notes', row.get('Notes', '')),
+                    'country': field(row, 'country', 'Country', default=''),
+                    'region': field(row, 'region', 'Region', default=''),
+                    'estimated_reserves_tonnes': number(field(row, 'reserves', 'Reserves', 'estimated_reserves_tonnes')),
+                    'average_grade': number(field(row, 'grade', 'Grade', 'average_grade')),
+                    'confidence_level': field(row, 'confidence', 'Confidence', 'confidence_level', default='Unknown'),
+                    'discovery_year': number(field(row, 'year', 'Year', 'discovery_year'), int),
+                    'status': field(row, 'status', 'Status', default='Prospect'),
+                    'notes': field(row, 'notes', 'Notes', default=''),
                 })
                 
             elif data_type == 'claims':
                 parsed_data.append({
-                    'claim_id': row.get('claim_id', row.get('Claim_ID', row.get('CLAIM_ID', f'CLM-{len(parsed_data)}'))),
-                    'company_name': row.get('company', row.get('Company', '')),
-                    'location_description': row.get('location', row.get('Location', '')),
-                    'area_hectares': float(row.get('area', row.get('Area', 0))) if row.get('area') or row.get('Area') else None,
-                    'claim_type': row.get('claim_type', row.get('Claim_Type', 'Exploration')),
+                    'claim_id': field(row, 'claim_id', 'Claim_ID', 'CLAIM_ID', default=f'CLM-{offset + len(parsed_data)}'),
+                    'company_name': field(row, 'company', 'Company', 'company_name', default=''),
+                    'location_description': field(row, 'location', 'Location', 'location_description', default=''),
+                    'area_hectares': number(field(row, 'area', 'Area', 'area_hectares')),
+                    'claim_type': field(row, 'claim_type', 'Claim_Type', default='Exploration'),
                     'latitude': lat,
                     'longitude': lng,
-                    'status': row.get('status', row.get('Status', 'Active')),
+                    'status': field(row, 'status', 'Status', default='Active'),
                 })
         except (ValueError, KeyError):
             continue
     
     return parsed_data
 
+# ============================================================
+# STAGED BULK INSERT
+# ============================================================
+# Parsed rows are loaded into a temp table with executemany; a single
+# INSERT ... SELECT then adds the first occurrence of each key in the file
+# unless an existing row already has it (an indexed anti-join).
+
+DEPOSIT_COLUMNS = ('name', 'mineral_type_id', 'ore_type_id', 'location_name', 'latitude', 'longitude',
+                   'country', 'region', 'estimated_reserves_tonnes', 'average_grade', 'confidence_level',
+                   'discovery_year', 'status', 'notes')
+CLAIM_COLUMNS = ('claim_id', 'company_name', 'location_description', 'area_hectares', 'claim_type',
+                 'latitude', 'longitude', 'status', 'geometry', 'min_lon', 'max_lon', 'min_lat', 'max_lat')
+
+# kind: (table, inserted columns, duplicate key)
+IMPORT_TARGETS = {
+    'deposits': ('deposits', DEPOSIT_COLUMNS, ('name', 'latitude', 'longitude')),
+    'claims': ('mining_claims', CLAIM_COLUMNS, ('claim_id',)),
+}
+
+def stage_and_insert(db, kind, rows):
+    """
+    Insert parsed rows that are not duplicates.
+    Returns (ids of the inserted rows, number of rows staged).
+    """
+    table, columns, key = IMPORT_TARGETS[kind]
+    staging = f"temp.staged_{table}"
+    column_list = ', '.join(columns)
+
+    db.execute(f"DROP TABLE IF EXISTS {staging}")
+    # Same column affinities as the target, no constraints
+    db.execute(f"CREATE TEMP TABLE staged_{table} AS SELECT {column_list} FROM main.{table} WHERE 0")
+    try:
+        staged = db.executemany(
+            f"INSERT INTO {staging} ({column_list}) VALUES ({', '.join('?' * len(columns))})",
+            ([row.get(column) for column in columns] for row in rows)
+        ).rowcount
+
+        last_id = db.execute(f"SELECT COALESCE(MAX(id), 0) FROM main.{table}").fetchone()[0]
+        db.execute(f"""
+            INSERT INTO main.{table} ({column_list})
+            SELECT {', '.join('s.' + column for column in columns)}
+            FROM {staging} s
+            WHERE s.rowid IN (SELECT MIN(rowid) FROM {staging} GROUP BY {', '.join(key)})
+              AND NOT EXISTS (
+                  SELECT 1 FROM main.{table} t
+                  WHERE {' AND '.join(f't.{column} = s.{column}' for column in key)}
+              )
+            ORDER BY s.rowid
+        """)
+        # Ids only grow (AUTOINCREMENT) and the writer is the only writer
+        ids = [row[0] for row in db.execute(
+            f"SELECT id FROM main.{table} WHERE id > ? ORDER BY id", (last_id,)
+        )]
+    finally:
+        db.execute(f"DROP TABLE IF EXISTS {staging}")
+    return ids, staged
+
+def insert_deposits(db, deposits, mineral_type_id=None):
+    """Bulk-insert parsed deposits on the writer; returns (inserted ids, duplicates)."""
+    if mineral_type_id is not None:
+        for deposit in deposits:
+            deposit['mineral_type_id'] = mineral_type_id
+    inserted_ids, staged = stage_and_insert(db, 'deposits', deposits)
+
+    # Link the new rows to states in one pass
+    assign_states(db, 'deposits', inserted_ids)
+    return inserted_ids, staged - len(inserted_ids)
+
+def insert_claims(db, claims):
+    """Bulk-insert parsed claims on the writer; returns (inserted ids, duplicates)."""
+    inserted_ids, staged = stage_and_insert(db, 'claims', claims)
+
+    # Link the new rows to states in one pass
+    assign_states(db, 'claims', inserted_ids)
+    store_levels(db, 'claims', inserted_ids)
+    return inserted_ids, staged - len(inserted_ids)
+
+def import_rows(db, kind, rows, options):
+    """Insert one batch of an import job on the writer; returns (inserted ids, duplicates)."""
+    if kind == 'deposits':
+        return insert_deposits(db, rows, options.get('mineral_type_id'))
+    return insert_claims(db, rows)
+
+# format: (records of a file opened in binary mode, parser of a batch of records)
+IMPORT_FORMATS = {
+    'geojson': (iter_features, parse_geojson_features),
+    'csv': (csv_records, parse_csv_rows),
+    'shapefile': (read_shapefile, parse_geojson_features),
+    'geopackage': (read_geopackage, parse_geojson_features),
+}
+
+def import_format(filename):
+    """Import format of an uploaded file name, or None."""
+    filename = secure_filename(filename).lower()
+    if filename.endswith(('.geojson', '.json')):
+        return 'geojson'
+    if filename.endswith('.csv'):
+        return 'csv'
+    if filename.endswith(('.zip', '.shp')):
+        return 'shapefile'
+    if filename.endswith('.gpkg'):
+        return 'geopackage'
+    return None
+
 def geospatial_routes(app):
     """Register geospatial/QGIS import routes"""
     
@@ -164,8 +318,9 @@ def geospatial_routes(app):
     
     @app.route("/admin/geospatial/import-deposits", methods=["POST"])
     @login_required
+    @large_upload
     def import_deposits():
-        """Import mineral deposits from QGIS GeoJSON or CSV"""
+        """Import mineral deposits from QGIS GeoJSON, CSV, Shapefile or GeoPackage"""
         if not is_admin():
             return jsonify({'error': 'Not authorized'}), 403
         
@@ -178,84 +333,30 @@ def geospatial_routes(app):
             return jsonify({'error': 'No file selected'}), 400
         
         if not allowed_gis_file(file.filename):
-            return jsonify({'error': 'Invalid file type. Use GeoJSON, CSV, or Shapefile'}), 400
+            return jsonify({'error': 'Invalid file type. Use GeoJSON, CSV, Shapefile or GeoPackage'}), 400
         
-        try:
-            filename = secure_filename(file.filename).lower()
-            
-            if filename.endswith(('.geojson', '.json')):
-                # Parse GeoJSON
-                content = file.read().decode('utf-8')
-                geojson_data = json.loads(content)
-                features = geojson_data.get('features', [])
-                parsed_deposits = parse_geojson_features(features, 'deposits')
-                
-            elif filename.endswith('.csv'):
-                # Parse CSV
-                content = file.read().decode('utf-8')
-                parsed_deposits = parse_csv_data(content, 'deposits')
-                
-            else:
-                return jsonify({'error': 'Unsupported file format'}), 400
-            
-            if not parsed_deposits:
-                return jsonify({'error': 'No valid data found in file'}), 400
-            
-            # Get mineral type ID from form if provided
-            mineral_type_id = request.form.get('mineral_type_id', 1, type=int)
-            
-            # Insert deposits into database
-            db = get_db()
-            inserted = 0
-            duplicates = 0
-            
-            for deposit in parsed_deposits:
-                # Check for duplicate (same name and location)
-                existing = db.execute(
-                    "SELECT id FROM deposits WHERE name = ? AND latitude = ? AND longitude = ?",
-                    (deposit['name'], deposit['latitude'], deposit['longitude'])
-                ).fetchone()
-                
-                if existing:
-                    duplicates += 1
-                    continue
-                
-                # Update mineral type if provided
-                deposit['mineral_type_id'] = mineral_type_id
-                
-                db.execute(
-                    """INSERT INTO deposits 
-                    (name, mineral_type_id, ore_type_id, location_name, latitude, longitude, 
-                     country, region, estimated_reserves_tonnes, average_grade, confidence_level, 
-                     discovery_year, status, notes)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                    (deposit['name'], deposit['mineral_type_id'], deposit['ore_type_id'],
-                     deposit['location_name'], deposit['latitude'], deposit['longitude'],
-                     deposit['country'], deposit['region'], deposit['estimated_reserves_tonnes'],
-                     deposit['average_grade'], deposit['confidence_level'], deposit['discovery_year'],
-                     deposit['status'], deposit['notes'])
-                )
-                inserted += 1
-            
-            db.commit()
-            
-            return jsonify({
-                'success': True,
-                'message': f'Imported {inserted} deposits',
-                'inserted': inserted,
-                'duplicates': duplicates,
-                'total': len(parsed_deposits)
-            }), 200
+        fmt = import_format(file.filename)
+        if fmt is None:
+            return jsonify({'error': 'Unsupported file format. Upload a shapefile as a .zip or .shp'}), 400
+        
+        # Get mineral type ID from form if provided
+        mineral_type_id = request.form.get('mineral_type_id', 1, type=int)
         
-        except json.JSONDecodeError:
-            return jsonify({'error': 'Invalid GeoJSON format'}), 400
-        except Exception as e:
-            return jsonify({'error': f'Import failed: {str(e)}'}), 500
+        # Spool the upload and import it in the background
+        job_id = start_import(current_app.config['DATABASE'], 'deposits', fmt, file,
+                              {'mineral_type_id': mineral_type_id})
+        return jsonify({
+            'success': True,
+            'message': 'Import queued',
+            'job_id': job_id,
+            'status_url': f'/admin/geospatial/jobs/{job_id}'
+        }), 202
     
     @app.route("/admin/geospatial/import-claims", methods=["POST"])
     @login_required
+    @large_upload
     def import_claims():
-        """Import mining claims from QGIS GeoJSON or CSV"""
+        """Import mining claims from QGIS GeoJSON, CSV, Shapefile or GeoPackage"""
         if not is_admin():
             return jsonify({'error': 'Not authorized'}), 403
         
@@ -267,70 +368,20 @@ def geospatial_routes(app):
             return jsonify({'error': 'No file selected'}), 400
         
         if not allowed_gis_file(file.filename):
-            return jsonify({'error': 'Invalid file type. Use GeoJSON or CSV'}), 400
+            return jsonify({'error': 'Invalid file type. Use GeoJSON, CSV, Shapefile or GeoPackage'}), 400
         
-        try:
-            filename = secure_filename(file.filename).lower()
-            
-            if filename.endswith(('.geojson', '.json')):
-                # Parse GeoJSON
-                content = file.read().decode('utf-8')
-                geojson_data = json.loads(content)
-                features = geojson_data.get('features', [])
-                parsed_claims = parse_geojson_features(features, 'claims')
-                
-            elif filename.endswith('.csv'):
-                # Parse CSV
-                content = file.read().decode('utf-8')
-                parsed_claims = parse_csv_data(content, 'claims')
-                
-            else:
-                return jsonify({'error': 'Unsupported file format'}), 400
-            
-            if not parsed_claims:
-                return jsonify({'error': 'No valid data found in file'}), 400
-            
-            # Insert claims into database
-            db = get_db()
-            inserted = 0
-            duplicates = 0
-            
-            for claim in parsed_claims:
-                # Check for duplicate (same claim_id)
-                existing = db.execute(
-                    "SELECT id FROM mining_claims WHERE claim_id = ?",
-                    (claim['claim_id'],)
-                ).fetchone()
-                
-                if existing:
-                    duplicates += 1
-                    continue
-                
-                db.execute(
-                    """INSERT INTO mining_claims 
-                    (claim_id, company_name, location_description, area_hectares, 
-                     claim_type, latitude, longitude, status)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-                    (claim['claim_id'], claim['company_name'], claim['location_description'],
-                     claim['area_hectares'], claim['claim_type'], claim['latitude'],
-                     claim['longitude'], claim['status'])
-                )
-                inserted += 1
-            
-            db.commit()
-            
-            return jsonify({
-                'success': True,
-                'message': f'Imported {inserted} claims',
-                'inserted': inserted,
-                'duplicates': duplicates,
-                'total': len(parsed_claims)
-            }), 200
+        fmt = import_format(file.filename)
+        if fmt is None:
+            return jsonify({'error': 'Unsupported file format. Upload a shapefile as a .zip or .shp'}), 400
         
-        except json.JSONDecodeError:
-            return jsonify({'error': 'Invalid GeoJSON format'}), 400
-        except Exception as e:
-            return jsonify({'error': f'Import failed: {str(e)}'}), 500
+        # Spool the upload and import it in the background
+        job_id = start_import(current_app.config['DATABASE'], 'claims', fmt, file)
+        return jsonify({
+            'success': True,
+            'message': 'Import queued',
+            'job_id': job_id,
+            'status_url': f'/admin/geospatial/jobs/{job_id}'
+        }), 202
     
     @app.route("/admin/geospatial/clear-deposits", methods=["POST"])
     @login_required
@@ -339,9 +390,7 @@ def geospatial_routes(app):
         if not is_admin():
             return jsonify({'error': 'Not authorized'}), 403
         
-        db = get_db()
-        db.execute("DELETE FROM deposits")
-        db.commit()
+        execute_write("DELETE FROM deposits")
         
         return jsonify({'success': True, 'message': 'All deposits cleared'}), 200
     
@@ -352,8 +401,6 @@ def geospatial_routes(app):
         if not is_admin():
             return jsonify({'error': 'Not authorized'}), 403
         
-        db = get_db()
-        db.execute("DELETE FROM mining_claims")
-        db.commit()
+        execute_write("DELETE FROM mining_claims")
         
         return jsonify({'success': True, 'message': 'All claims cleared'}), 200
@@ -0,0 +1,177 @@
+"""
+Deposit Density Heatmap
+Every deposit carries grid_x/grid_y, its cell on a fixed 2^16 x 2^16
+longitude/latitude grid, as indexed generated columns. A heatmap at any
+coarser level groups on the cell numbers shifted right, so binning is a
+single GROUP BY over the index. Results are cached per filter set and
+deposits layer version.
+"""
+
+import hashlib
+from flask import current_app, jsonify, request, Response
+from app.db import get_db
+from app.helpers import map_read
+from app.spatial import layer_version, viewport_args
+
+GRID_BITS = 16
+DEFAULT_LEVEL = 6
+LEVELS_PER_ZOOM = 4  # 16 cells across a 256px tile, ~16px each
+HEATMAP_CACHE_TIMEOUT = 3600
+
+# column: (coordinate column, origin offset, span in degrees)
+GRID_COLUMNS = {
+    'grid_x': ('longitude', 180.0, 360.0),
+    'grid_y': ('latitude', 90.0, 180.0),
+}
+
+# ============================================================
+# GRID COLUMNS
+# ============================================================
+
+def cell_range(column, low, high, level):
+    """
+    Inclusive range of full-resolution cell numbers in a grid column
+    covering the level-cells that contain coordinates low..high.
+    """
+    _, origin, span = GRID_COLUMNS[column]
+    shift = GRID_BITS - level
+    n = 1 << level
+    first = min(max(int((low + origin) / span * n), 0), n - 1)
+    last = min(max(int((high + origin) / span * n), 0), n - 1)
+    return [first << shift, ((last + 1) << shift) - 1]
+
+# ============================================================
+# BINNING
+# ============================================================
+
+def heatmap_cells(db, level, mineral_type_id=None, status=None, state_id=None, bbox=None):
+    """
+    Density cells at a grid level (2^level cells around the globe): count,
+    summed reserves and mean grade of the matching deposits per cell.
+    """
+    shift = GRID_BITS - level
+    where = ["grid_x IS NOT NULL", "grid_y IS NOT NULL"]
+    params = [shift, shift]
+
+    if mineral_type_id is not None:
+        where.append("mineral_type_id = ?")
+        params.append(mineral_type_id)
+    if status:
+        where.append("status = ?")
+        params.append(status)
+    if state_id is not None:
+        where.append("state_id = ?")
+        params.append(state_id)
+
+    if bbox:
+        west, south, east, north = bbox
+        where.append("grid_y BETWEEN ? AND ?")
+        params.extend(cell_range('grid_y', south, north, level))
+        if west <= east:
+            where.append("grid_x BETWEEN ? AND ?")
+            params.extend(cell_range('grid_x', west, east, level))
+        else:
+            # Crossing the antimeridian
+            where.append("(grid_x BETWEEN ? AND ? OR grid_x BETWEEN ? AND ?)")
+            params.extend(cell_range('grid_x', west, 180.0, level) + cell_range('grid_x', -180.0, east, level))
+
+    rows = db.execute(f"""
+        SELECT grid_x >> ? AS x, grid_y >> ? AS y, COUNT(*) AS count,
+               SUM(estimated_reserves_tonnes) AS reserves, AVG(average_grade) AS mean_grade
+        FROM deposits
+        WHERE {' AND '.join(where)}
+        GROUP BY 1, 2
+    """, params).fetchall()
+
+    width, height = 360.0 / (1 << level), 180.0 / (1 << level)
+    return [{
+        'x': row['x'],
+        'y': row['y'],
+        'lon': -180.0 + (row['x'] + 0.5) * width,
+        'lat': -90.0 + (row['y'] + 0.5) * height,
+        'count': row['count'],
+        'reserves_tonnes': row['reserves'],
+        'mean_grade': round(row['mean_grade'], 4) if row['mean_grade'] is not None else None,
+    } for row in rows]
+
+# ============================================================
+# API
+# ============================================================
+
+def heatmap_cache():
+    """The app's Flask-Caching backend (configured in create_app)."""
+    return next(iter(current_app.extensions['cache'].values()))
+
+def heatmap_args(db):
+    """Read level, filters and bbox; raises ValueError on bad input."""
+    bbox, zoom = viewport_args()
+    level = request.args.get('level')
+    if level is not None:
+        try:
+            level = int(level)
+        except ValueError:
+            raise ValueError("level must be an integer")
+        if not 0 <= level <= GRID_BITS:
+            raise ValueError(f"level must be between 0 and {GRID_BITS}")
+    elif zoom is not None:
+        level = min(zoom + LEVELS_PER_ZOOM, GRID_BITS)
+    else:
+        level = DEFAULT_LEVEL
+
+    mineral = request.args.get('mineral')
+    mineral_type_id = None
+    if mineral:
+        if mineral.isdigit():
+            mineral_type_id = int(mineral)
+        else:
+            row = db.execute("SELECT id FROM mineral_types WHERE name = ?", (mineral,)).fetchone()
+            if not row:
+                raise ValueError(f"Unknown mineral: {mineral}")
+            mineral_type_id = row['id']
+
+    return {
+        'level': level,
+        'mineral_type_id': mineral_type_id,
+        'status': request.args.get('status') or None,
+        'state_id': request.args.get('state_id', type=int),
+        'bbox': bbox,
+    }
+
+def heatmap_routes(app):
+    """Register the deposit density heatmap API"""
+
+    @app.route("/api/heatmap")
+    @map_read
+    def api_heatmap():
+        """Binned deposit density (?level= or ?zoom=, mineral, status, state_id, bbox)"""
+        db = get_db()
+        try:
+            args = heatmap_args(db)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        version = layer_version(db, 'deposits')
+        key = repr((current_app.config['DATABASE'], version, sorted(args.items())))
+        etag = 'heatmap-' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            cache = heatmap_cache()
+            result = cache.get(etag)
+            if result is None:
+                cells = heatmap_cells(db, **args)
+                result = {
+                    'level': args['level'],
+                    'cell_size': [360.0 / (1 << args['level']), 180.0 / (1 << args['level'])],
+                    'version': version,
+                    'max_count': max((c['count'] for c in cells), default=0),
+                    'cells': cells,
+                }
+                cache.set(etag, result, timeout=HEATMAP_CACHE_TIMEOUT)
+            response = jsonify(result)
+        # Revalidate on every use: the ETag changes with the deposits layer
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    print("✓ Heatmap routes registered")
@@ -1,4 +1,4 @@
-from flask import redirect, session
+from flask import current_app, redirect, session, Request
 from functools import wraps
 import re
 
@@ -27,6 +27,29 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Large upload decorator: the view accepts bodies up to MAX_IMPORT_CONTENT_LENGTH
+def large_upload(f):
+    f.large_upload = True
+    return f
+
+# Map read decorator: tile, cluster and layer reads fire a request per tile or
+# pan, so create_app gives them MAP_READ_LIMIT instead of the default limits
+MAP_READ_LIMIT = "600 per minute"
+
+def map_read(f):
+    f.map_read = True
+    return f
+
+class UploadRequest(Request):
+    """Request whose size limit is raised for views marked @large_upload."""
+
+    @property
+    def max_content_length(self):
+        view = current_app.view_functions.get(self.endpoint) if current_app else None
+        if getattr(view, 'large_upload', False):
+            return current_app.config['MAX_IMPORT_CONTENT_LENGTH']
+        return super().max_content_length
+
 # Password validation function
 def validate_password(password):
     """
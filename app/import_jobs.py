@@ -0,0 +1,307 @@
+"""
+Background Import Jobs
+QGIS uploads are spooled to disk and recorded in import_jobs; a worker
+pool parses them in batches and inserts each batch on the writer, in the
+same transaction that advances the job's resume point. A job interrupted
+by a restart is picked up again from its last committed batch: on the
+first request a process serves, or when its status is polled after its
+owner stopped heartbeating.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from flask import current_app, jsonify, session
+from app.db import get_db, get_pool, get_writer
+from app.helpers import login_required
+from app.utils import is_admin
+
+IMPORT_BATCH = 5000
+IMPORT_WORKERS = 2
+STALE_SECONDS = 120  # a running job whose owner has not committed for this long is resumed
+MAX_ERRORS = 20
+IMPORT_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'import_spool')
+
+class JobLost(Exception):
+    """Another process took over the job."""
+
+# ============================================================
+# JOB RECORDS (writer functions)
+# ============================================================
+
+def _owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def create_job(conn, kind, fmt, filename, path, options=None, user_id=None):
+    return conn.execute("""
+        INSERT INTO import_jobs (kind, format, filename, path, options, total_bytes, created_by)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (kind, fmt, filename, path, json.dumps(options or {}), os.path.getsize(path), user_id)).lastrowid
+
+def _owner_gone(owner, heartbeat, now):
+    """True when a job's owner can no longer be running it."""
+    if owner is None or heartbeat is None or heartbeat < now - STALE_SECONDS:
+        return True
+    host, _, pid = owner.rpartition(':')
+    if host != socket.gethostname():
+        return False
+    if int(pid) == os.getpid():
+        # Ours, or a previous process that had our pid; submit_job keeps
+        # a job from running twice in this process.
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+def claim_job(conn, job_id, owner):
+    """Take over a queued or orphaned job; returns the job row or None."""
+    job = conn.execute("SELECT * FROM import_jobs WHERE id = ?", (job_id,)).fetchone()
+    now = time.time()
+    if not job or job['status'] not in ('queued', 'running'):
+        return None
+    if not _owner_gone(job['owner'], job['heartbeat'], now):
+        return None
+    conn.execute("""
+        UPDATE import_jobs
+        SET status = 'running', owner = ?, heartbeat = ?, started_at = ?, start_bytes = bytes_read
+        WHERE id = ?
+    """, (owner, now, now, job_id))
+    return dict(job)
+
+def commit_batch(conn, job_id, owner, kind, rows, options, progress):
+    """Insert one parsed batch and advance the job's resume point with it."""
+    from app.geospatial import import_rows
+
+    if not conn.execute("SELECT 1 FROM import_jobs WHERE id = ? AND owner = ?", (job_id, owner)).fetchone():
+        raise JobLost(job_id)
+    inserted_ids, duplicates = import_rows(conn, kind, rows, options)
+    conn.execute("""
+        UPDATE import_jobs
+        SET features_read = ?, rows_parsed = ?, bytes_read = ?, heartbeat = ?,
+            inserted = inserted + ?, duplicates = duplicates + ?
+        WHERE id = ?
+    """, (progress['features_read'], progress['rows_parsed'], progress['bytes_read'], time.time(),
+          len(inserted_ids), duplicates, job_id))
+
+def finish_job(conn, job_id, owner, status, error=None):
+    job = conn.execute("SELECT errors FROM import_jobs WHERE id = ? AND owner = ?", (job_id, owner)).fetchone()
+    if not job:
+        return
+    errors = json.loads(job['errors'] or '[]')
+    if error:
+        errors = (errors + [error])[-MAX_ERRORS:]
+    conn.execute("""
+        UPDATE import_jobs SET status = ?, owner = NULL, finished_at = ?, errors = ? WHERE id = ?
+    """, (status, time.time(), json.dumps(errors), job_id))
+
+def requeue_job(conn, job_id):
+    """Queue a failed job again (it continues from its last committed batch)."""
+    return conn.execute("""
+        UPDATE import_jobs SET status = 'queued', owner = NULL, heartbeat = NULL, finished_at = NULL
+        WHERE id = ? AND status = 'failed'
+    """, (job_id,)).rowcount
+
+# ============================================================
+# RUNNER
+# ============================================================
+
+def run_job(database, job_id, batch_size=IMPORT_BATCH):
+    """Claim a job and import the rest of its file batch by batch."""
+    from app.geospatial import IMPORT_FORMATS
+
+    writer = get_writer(database)
+    owner = _owner()
+    job = writer.submit(claim_job, job_id, owner).result()
+    if job is None:
+        return
+
+    read_records, parse_batch = IMPORT_FORMATS[job['format']]
+    options = json.loads(job['options'] or '{}')
+    progress = {key: job[key] for key in ('features_read', 'rows_parsed', 'bytes_read')}
+    try:
+        with open(job['path'], 'rb') as f:
+            source = read_records(f)
+            # Readers that decompress report their own position in the file
+            position = getattr(source, 'tell', f.tell)
+            # Resume: skip the records of batches already committed
+            records = islice(source, job['features_read'], None)
+            while True:
+                batch = list(islice(records, batch_size))
+                if not batch:
+                    break
+                rows = parse_batch(batch, job['kind'], progress['rows_parsed'])
+                progress['features_read'] += len(batch)
+                progress['rows_parsed'] += len(rows)
+                progress['bytes_read'] = position()
+                writer.submit(commit_batch, job_id, owner, job['kind'], rows, options, progress).result()
+    except JobLost:
+        return
+    except Exception as e:
+        writer.submit(finish_job, job_id, owner, 'failed', str(e)).result()
+        return
+
+    if progress['rows_parsed'] == 0:
+        writer.submit(finish_job, job_id, owner, 'failed', 'No valid data found in file').result()
+        return
+    writer.submit(finish_job, job_id, owner, 'done').result()
+    try:
+        os.remove(job['path'])
+    except OSError:
+        pass
+
+_executors = {}  # (pid, database) -> ThreadPoolExecutor
+_running = set()  # (pid, database, job id)
+_resumed = set()  # (pid, database) whose unfinished jobs were resumed
+_lock = threading.Lock()
+
+def submit_job(database, job_id, workers=IMPORT_WORKERS):
+    """Run a job on this process's worker pool unless it is already running here."""
+    key = (os.getpid(), database)
+    with _lock:
+        if key + (job_id,) in _running:
+            return False
+        _running.add(key + (job_id,))
+        executor = _executors.get(key)
+        if executor is None:
+            executor = _executors[key] = ThreadPoolExecutor(workers, thread_name_prefix='import-job')
+
+    def run():
+        try:
+            run_job(database, job_id)
+        finally:
+            with _lock:
+                _running.discard(key + (job_id,))
+
+    executor.submit(run)
+    return True
+
+def resume_jobs(database, workers=IMPORT_WORKERS):
+    """Submit every unfinished job; claim_job skips those still owned elsewhere."""
+    db = get_pool(database, readonly=True).connect()
+    try:
+        ids = [row[0] for row in db.execute(
+            "SELECT id FROM import_jobs WHERE status IN ('queued', 'running') ORDER BY id"
+        )]
+    finally:
+        db.close()
+    for job_id in ids:
+        submit_job(database, job_id, workers)
+    return ids
+
+def resume_once(database, workers=IMPORT_WORKERS):
+    """resume_jobs the first time this process calls it for a database; [] after that."""
+    key = (os.getpid(), database)
+    with _lock:
+        if key in _resumed:
+            return []
+        _resumed.add(key)
+    return resume_jobs(database, workers)
+
+# ============================================================
+# STATUS
+# ============================================================
+
+def job_status(job, now=None):
+    """JSON-ready progress of a job row, with an ETA from this run's byte rate."""
+    now = now or time.time()
+    total = job['total_bytes'] or 0
+    done = job['bytes_read'] or 0
+    eta = None
+    if job['status'] == 'running' and job['started_at'] and done > (job['start_bytes'] or 0):
+        rate = (done - (job['start_bytes'] or 0)) / max(now - job['started_at'], 1e-6)
+        eta = round(max(total - done, 0) / rate, 1)
+    return {
+        'id': job['id'],
+        'kind': job['kind'],
+        'format': job['format'],
+        'filename': job['filename'],
+        'status': job['status'],
+        'rows_processed': job['features_read'],
+        'rows_parsed': job['rows_parsed'],
+        'skipped': job['features_read'] - job['rows_parsed'],
+        'inserted': job['inserted'],
+        'duplicates': job['duplicates'],
+        'errors': json.loads(job['errors'] or '[]'),
+        'bytes_read': done,
+        'total_bytes': total,
+        'percent': 100.0 if job['status'] == 'done' else round(100.0 * done / total, 1) if total else 0.0,
+        'eta_seconds': eta,
+        'created_at': job['created_at'],
+        'finished_at': job['finished_at'],
+    }
+
+def start_import(database, kind, fmt, file, options=None):
+    """Spool an uploaded file to disk, record the job and queue it; returns the job id."""
+    spool_dir = current_app.config['IMPORT_DIR']
+    os.makedirs(spool_dir, exist_ok=True)
+    path = os.path.join(spool_dir, f"{int(time.time() * 1000)}-{os.getpid()}-{threading.get_ident()}.{fmt}")
+    file.save(path)
+
+    job_id = get_writer(database).submit(
+        create_job, kind, fmt, file.filename, path, options, session.get('user_id')
+    ).result()
+    submit_job(database, job_id, current_app.config['IMPORT_WORKERS'])
+    return job_id
+
+def import_job_routes(app):
+    """Register import job status routes and the resume-on-first-request hook"""
+    app.config.setdefault('IMPORT_DIR', IMPORT_DIR)
+    app.config.setdefault('IMPORT_WORKERS', IMPORT_WORKERS)
+
+    @app.route("/admin/geospatial/jobs")
+    @login_required
+    def import_jobs():
+        """Most recent import jobs"""
+        if not is_admin():
+            return jsonify({'error': 'Not authorized'}), 403
+        jobs = get_db().execute("SELECT * FROM import_jobs ORDER BY id DESC LIMIT 20").fetchall()
+        return jsonify([job_status(job) for job in jobs])
+
+    @app.route("/admin/geospatial/jobs/<int:job_id>")
+    @login_required
+    def import_job(job_id):
+        """Progress of one import job (polled by the admin page)"""
+        if not is_admin():
+            return jsonify({'error': 'Not authorized'}), 403
+        database = current_app.config['DATABASE']
+        job = get_db().execute("SELECT * FROM import_jobs WHERE id = ?", (job_id,)).fetchone()
+        if not job:
+            return jsonify({'error': 'Import job not found'}), 404
+
+        # Orphaned by a restart: pick it up here
+        if job['status'] in ('queued', 'running') and _owner_gone(job['owner'], job['heartbeat'], time.time()):
+            submit_job(database, job_id, current_app.config['IMPORT_WORKERS'])
+        return jsonify(job_status(job))
+
+    @app.route("/admin/geospatial/jobs/<int:job_id>/resume", methods=["POST"])
+    @login_required
+    def resume_import_job(job_id):
+        """Retry a failed job from its last committed batch"""
+        if not is_admin():
+            return jsonify({'error': 'Not authorized'}), 403
+        database = current_app.config['DATABASE']
+        if not get_writer(database).submit(requeue_job, job_id).result():
+            return jsonify({'error': 'Only failed jobs can be resumed'}), 409
+        submit_job(database, job_id, current_app.config['IMPORT_WORKERS'])
+        return jsonify({'success': True, 'job_id': job_id}), 202
+
+    @app.before_request
+    def resume_import_jobs():
+        """
+        Resume jobs interrupted by a restart once this process serves a
+        request, not at app creation: CLI commands, tests and a preloading
+        master never start workers.
+        """
+        resumed = resume_once(current_app.config['DATABASE'], current_app.config['IMPORT_WORKERS'])
+        if resumed:
+            print(f"  Resuming import jobs: {resumed}")
+
+    print("✓ Import job routes registered")
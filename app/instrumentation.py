@@ -0,0 +1,244 @@
+"""
+Query Instrumentation
+Records query count, timing and rows returned for every request on the
+get_db() connection, flags repeated statements (N+1 patterns) and keeps
+per-endpoint aggregates for the admin performance page.
+"""
+
+import os
+import re
+import threading
+import time
+from flask import current_app, g, request, render_template, redirect, jsonify
+from app.helpers import login_required
+
+# A statement executed this many times in one request is flagged as N+1
+N_PLUS_ONE_THRESHOLD = 3
+
+# Slowest statements kept per endpoint
+TOP_STATEMENTS = 10
+
+_WHITESPACE = re.compile(r"\s+")
+
+# ============================================================
+# CONNECTION WRAPPERS
+# ============================================================
+
+class InstrumentedCursor:
+    """Cursor proxy that counts fetched rows and fetch time."""
+
+    def __init__(self, cursor, record):
+        self._cursor = cursor
+        self._record = record
+
+    def _timed(self, fetch, *args):
+        start = time.perf_counter()
+        result = fetch(*args)
+        self._record['seconds'] += time.perf_counter() - start
+        return result
+
+    def fetchone(self):
+        row = self._timed(self._cursor.fetchone)
+        if row is not None:
+            self._record['rows'] += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._timed(self._cursor.fetchmany, *args)
+        self._record['rows'] += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(self._cursor.fetchall)
+        self._record['rows'] += len(rows)
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class InstrumentedConnection:
+    """
+    Connection proxy that records every statement in the request stats.
+    Everything other than execute/executemany is delegated unchanged.
+    """
+
+    def __init__(self, connection, stats):
+        object.__setattr__(self, 'wrapped', connection)
+        object.__setattr__(self, 'stats', stats)
+
+    def _run(self, method, sql, params):
+        record = {'sql': _WHITESPACE.sub(' ', sql).strip(), 'seconds': 0.0, 'rows': 0}
+        start = time.perf_counter()
+        try:
+            cursor = method(sql, params)
+        finally:
+            record['seconds'] += time.perf_counter() - start
+            self.stats.append(record)
+        return InstrumentedCursor(cursor, record)
+
+    def execute(self, sql, params=()):
+        return self._run(self.wrapped.execute, sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self._run(self.wrapped.executemany, sql, seq_of_params)
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.wrapped, name, value)
+
+def instrument(connection):
+    """Wrap a connection so its statements are recorded for this request."""
+    if 'query_stats' not in g:
+        g.query_stats = []
+    return InstrumentedConnection(connection, g.query_stats)
+
+# ============================================================
+# REQUEST SUMMARY & AGGREGATES
+# ============================================================
+
+def summarize(stats):
+    """Summarize one request's statements, flagging repeated ones."""
+    by_sql = {}
+    for record in stats:
+        entry = by_sql.setdefault(record['sql'], {'count': 0, 'seconds': 0.0, 'rows': 0})
+        entry['count'] += 1
+        entry['seconds'] += record['seconds']
+        entry['rows'] += record['rows']
+
+    return {
+        'queries': len(stats),
+        'seconds': sum(r['seconds'] for r in stats),
+        'rows': sum(r['rows'] for r in stats),
+        'repeated': {
+            sql: entry for sql, entry in by_sql.items()
+            if entry['count'] >= N_PLUS_ONE_THRESHOLD
+        },
+        'statements': by_sql,
+    }
+
+_aggregates = {}
+_aggregates_lock = threading.Lock()
+
+def record_request(endpoint, summary):
+    """Fold one request summary into the per-endpoint aggregates."""
+    with _aggregates_lock:
+        agg = _aggregates.setdefault(endpoint, {
+            'endpoint': endpoint,
+            'requests': 0,
+            'queries': 0,
+            'max_queries': 0,
+            'seconds': 0.0,
+            'rows': 0,
+            'n_plus_one_requests': 0,
+            'repeated': {},
+            'statements': {},
+        })
+        agg['requests'] += 1
+        agg['queries'] += summary['queries']
+        agg['max_queries'] = max(agg['max_queries'], summary['queries'])
+        agg['seconds'] += summary['seconds']
+        agg['rows'] += summary['rows']
+        if summary['repeated']:
+            agg['n_plus_one_requests'] += 1
+            for sql, entry in summary['repeated'].items():
+                agg['repeated'][sql] = max(agg['repeated'].get(sql, 0), entry['count'])
+
+        for sql, entry in summary['statements'].items():
+            stmt = agg['statements'].setdefault(sql, {'sql': sql, 'count': 0, 'seconds': 0.0, 'rows': 0})
+            stmt['count'] += entry['count']
+            stmt['seconds'] += entry['seconds']
+            stmt['rows'] += entry['rows']
+
+def get_aggregates():
+    """Per-endpoint aggregates, slowest total database time first."""
+    with _aggregates_lock:
+        rows = []
+        for agg in _aggregates.values():
+            row = dict(agg)
+            row['avg_queries'] = agg['queries'] / agg['requests']
+            row['avg_ms'] = agg['seconds'] * 1000 / agg['requests']
+            row['repeated'] = sorted(agg['repeated'].items(), key=lambda x: -x[1])
+            row['statements'] = sorted(
+                (dict(s) for s in agg['statements'].values()),
+                key=lambda s: -s['seconds']
+            )[:TOP_STATEMENTS]
+            rows.append(row)
+    return sorted(rows, key=lambda r: -r['seconds'])
+
+def reset_aggregates():
+    with _aggregates_lock:
+        _aggregates.clear()
+
+# ============================================================
+# APP INTEGRATION
+# ============================================================
+
+def instrumentation_enabled():
+    """
+    Whether get_db() connections are instrumented: DB_INSTRUMENTATION when
+    configured, otherwise only in debug mode.
+    """
+    return current_app.config.get('DB_INSTRUMENTATION', current_app.debug)
+
+def init_instrumentation(app):
+    """Register request hooks and the admin-only /admin/perf view."""
+    if 'DB_INSTRUMENTATION' in os.environ:
+        app.config.setdefault('DB_INSTRUMENTATION', os.environ['DB_INSTRUMENTATION'] == 'True')
+
+    @app.after_request
+    def add_query_headers(response):
+        # Per-request query headers are only exposed in debug mode
+        if app.debug and 'query_stats' in g:
+            summary = summarize(g.query_stats)
+            response.headers['X-DB-Queries'] = str(summary['queries'])
+            response.headers['Server-Timing'] = (
+                f'db;dur={summary["seconds"] * 1000:.2f};desc="{summary["queries"]} queries"'
+            )
+            if summary['repeated']:
+                response.headers['X-DB-Repeated-Queries'] = str(len(summary['repeated']))
+        return response
+
+    @app.teardown_request
+    def record_query_stats(exc=None):
+        stats = g.pop('query_stats', None)
+        if stats:
+            record_request(request.endpoint or request.path, summarize(stats))
+
+    @app.route("/admin/perf")
+    @login_required
+    def admin_perf():
+        """Per-endpoint query statistics (this worker process only)"""
+        from app.utils import is_admin
+        if not is_admin():
+            return redirect("/")
+
+        endpoints = get_aggregates()
+        if request.args.get('format') == 'json':
+            return jsonify(endpoints)
+
+        return render_template("admin_perf.html",
+                             endpoints=endpoints,
+                             enabled=instrumentation_enabled(),
+                             threshold=N_PLUS_ONE_THRESHOLD)
+
+    @app.route("/admin/perf/reset", methods=["POST"])
+    @login_required
+    def admin_perf_reset():
+        """Clear the collected query statistics"""
+        from app.utils import is_admin
+        if not is_admin():
+            return redirect("/")
+
+        reset_aggregates()
+        return redirect("/admin/perf")
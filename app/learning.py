@@ -4,7 +4,7 @@ Handles public learning pages and admin content management
 """
 
 from flask import render_template, request, jsonify, redirect, session
-from app.db import get_db
+from app.db import get_db, execute_write
 from app.helpers import login_required
 from app.utils import is_admin
 
@@ -163,12 +163,11 @@ def learning_routes(app):
             # Clean up related minerals (remove whitespace)
             related_minerals = ','.join([m.strip() for m in related_minerals.split(',') if m.strip()])
             
-            db.execute("""
+            execute_write("""
                 INSERT INTO learning_content (created_by, title, category, summary, content, image, difficulty_level, related_minerals)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)
             """, (session.get('user_id'), title, category, summary, content, image, difficulty_level, related_minerals))
             
-            db.commit()
             return redirect("/admin/learning")
         
         # GET request - show form
@@ -240,7 +239,7 @@ def learning_routes(app):
             # Clean up related minerals
             related_minerals = ','.join([m.strip() for m in related_minerals.split(',') if m.strip()])
             
-            db.execute("""
+            execute_write("""
                 UPDATE learning_content 
                 SET title = ?, category = ?, summary = ?, content = ?, 
                     image = ?, difficulty_level = ?, related_minerals = ?,
@@ -248,7 +247,6 @@ def learning_routes(app):
                 WHERE id = ?
             """, (title, category, summary, content, image, difficulty_level, related_minerals, lesson_id))
             
-            db.commit()
             return redirect("/admin/learning")
         
         # GET request - show form with current data
@@ -278,8 +276,7 @@ def learning_routes(app):
         if not lesson:
             return jsonify({'error': 'Lesson not found'}), 404
         
-        db.execute("DELETE FROM learning_content WHERE id = ?", (lesson_id,))
-        db.commit()
+        execute_write("DELETE FROM learning_content WHERE id = ?", (lesson_id,))
         
         return jsonify({'success': True})
     
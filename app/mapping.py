@@ -3,9 +3,63 @@ Enhanced Mapping and Visualization
 Advanced Leaflet.js features for geology and South Sudan data
 """
 
-from flask import render_template, jsonify, request
+from functools import wraps
+from flask import render_template, jsonify, request, make_response, Response
 from app.db import get_db
-from app.helpers import login_required
+from app.helpers import login_required, map_read
+from app.packed import packed_response, wants_packed
+from app.pagination import Keyset, approximate_count, page_args, paginate, set_page_headers
+from app.spatial import bbox_condition, layers_etag, viewport_args, viewport_filter
+from app.simplify import geometries_for_zoom
+
+# JSON list APIs page through stable (name/id) orders
+API_PAGE_SIZE = 500
+API_DEPOSITS_KEYSET = Keyset(("d.name", 'asc'), ("d.id", 'asc'))
+API_CLAIMS_KEYSET = Keyset(("c.id", 'asc'))
+API_SITES_KEYSET = Keyset(("e.id", 'asc'))
+API_INFRA_KEYSET = Keyset(("i.id", 'asc'))
+
+def page_response(db, rows, next_cursor, table):
+    """
+    List body for one page (JSON, or packed columns with ?format=bin); the
+    next page is advertised in headers. ?count=approx adds a cheap
+    estimate of the table size.
+    """
+    total = approximate_count(db, table) if request.args.get('count') == 'approx' else None
+    response = packed_response(rows) if wants_packed() else jsonify(rows)
+    return set_page_headers(response, next_cursor, total)
+
+def layer_etag(*layers):
+    """
+    Revalidate a GET API by ETag: 304 while the map layers it reads and the
+    query string are unchanged, without running the view.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = layers_etag(get_db(), layers, sorted(request.args.items(multi=True)))
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+def shell_response(html):
+    """
+    Map pages ship without layer data, so their HTML only changes with the
+    template and the signed-in user's nav: let browsers keep it and
+    revalidate by ETag.
+    """
+    response = make_response(html)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
 
 def mapping_routes(app):
     
@@ -15,47 +69,8 @@ def mapping_routes(app):
     
     @app.route("/map/sudan")
     def map_sudan():
-        """Interactive South Sudan geological map"""
-        db = get_db()
-        
-        # Get states
-        states = db.execute(
-            "SELECT id, name, latitude, longitude, primary_minerals FROM ss_states ORDER BY name"
-        ).fetchall()
-        states = [dict(s) for s in states]  # Convert Row objects to dicts
-        
-        # Get deposits for markers
-        deposits = db.execute("""
-            SELECT d.id, d.name, d.latitude, d.longitude, d.region, 
-                   mt.name as mineral, d.status
-            FROM deposits d
-            JOIN mineral_types mt ON d.mineral_type_id = mt.id
-            WHERE d.country = 'South Sudan'
-            ORDER BY d.status DESC
-        """).fetchall()
-        deposits = [dict(d) for d in deposits]  # Convert to dicts
-        
-        # Get exploration sites
-        sites = db.execute("""
-            SELECT id, name, latitude, longitude, state_id, accessibility, security_status
-            FROM ss_exploration_sites
-            ORDER BY exploration_status
-        """).fetchall()
-        sites = [dict(s) for s in sites]  # Convert to dicts
-        
-        # Get infrastructure
-        infra = db.execute("""
-            SELECT i.id, i.name, i.type, s.latitude, s.longitude, i.status
-            FROM ss_infrastructure i
-            JOIN ss_states s ON i.state_id = s.id
-        """).fetchall()
-        infra = [dict(i) for i in infra]  # Convert to dicts
-        
-        return render_template("map_sudan.html",
-                             states=states,
-                             deposits=deposits,
-                             sites=sites,
-                             infrastructure=infra)
+        """Interactive South Sudan geological map (layers load per viewport)"""
+        return shell_response(render_template("map_sudan.html"))
     
     # ============================================================
     # DEPOSITS MAP
@@ -63,7 +78,7 @@ def mapping_routes(app):
     
     @app.route("/map/deposits")
     def map_deposits():
-        """Map view of mineral deposits"""
+        """Map view of mineral deposits (markers load per viewport)"""
         db = get_db()
         
         # Get mineral types for filters
@@ -72,22 +87,7 @@ def mapping_routes(app):
         ).fetchall()
         minerals = [dict(m) for m in minerals]  # Convert to dicts
         
-        # Get deposits with icons based on mineral type
-        # Handle deposits with or without mineral_type_id
-        deposits = db.execute("""
-            SELECT d.id, d.name, d.latitude, d.longitude, d.region,
-                   mt.id as mineral_id, mt.name as mineral, mt.category,
-                   d.estimated_reserves_tonnes, d.average_grade, d.status, d.confidence_level
-            FROM deposits d
-            LEFT JOIN mineral_types mt ON d.mineral_type_id = mt.id
-            WHERE d.latitude IS NOT NULL AND d.longitude IS NOT NULL
-            ORDER BY d.status DESC
-        """).fetchall()
-        deposits = [dict(d) for d in deposits]  # Convert to dicts
-        
-        return render_template("map_deposits.html", 
-                             deposits=deposits, 
-                             minerals=minerals)
+        return shell_response(render_template("map_deposits.html", minerals=minerals))
     
     # ============================================================
     # MINING CLAIMS MAP
@@ -95,19 +95,8 @@ def mapping_routes(app):
     
     @app.route("/map/claims")
     def map_claims():
-        """Map view of mining claims"""
-        db = get_db()
-        
-        # Get claims with boundaries (approximate circles based on hectares)
-        claims = db.execute("""
-            SELECT id, claim_id, company_name, latitude, longitude,
-                   area_hectares, status, claim_type
-            FROM mining_claims
-            WHERE latitude IS NOT NULL AND longitude IS NOT NULL
-        """).fetchall()
-        claims = [dict(c) for c in claims]  # Convert to dicts
-        
-        return render_template("map_claims.html", claims=claims)
+        """Map view of mining claims (claims load per viewport)"""
+        return shell_response(render_template("map_claims.html"))
     
     # ============================================================
     # INFRASTRUCTURE MAP
@@ -115,115 +104,165 @@ def mapping_routes(app):
     
     @app.route("/map/infrastructure")
     def map_infrastructure():
-        """Map of South Sudan infrastructure"""
-        db = get_db()
-        
-        # Group infrastructure by type
-        infra = db.execute("""
-            SELECT i.id, i.name, i.type, i.status, s.name as state,
-                   s.latitude, s.longitude
-            FROM ss_infrastructure i
-            JOIN ss_states s ON i.state_id = s.id
-            ORDER BY i.type, i.status
-        """).fetchall()
-        infra = [dict(i) for i in infra]  # Convert to dicts
-        
-        return render_template("map_infrastructure.html", infrastructure=infra)
+        """Map of South Sudan infrastructure (loads per viewport)"""
+        return shell_response(render_template("map_infrastructure.html"))
     
     # ============================================================
     # API ENDPOINTS FOR DYNAMIC DATA
     # ============================================================
     
     @app.route("/api/deposits")
+    @map_read
+    @layer_etag('deposits')
     def api_deposits():
-        """API endpoint for deposit data (JSON)"""
+        """API endpoint for deposit data (JSON), optionally limited to ?bbox=&zoom="""
         db = get_db()
         
         # Optional filters
         mineral_id = request.args.get('mineral_id')
         status = request.args.get('status')
         
-        query = """
-            SELECT d.id, d.name, d.latitude, d.longitude, d.region,
-                   mt.name as mineral, d.status, d.estimated_reserves_tonnes,
-                   d.average_grade, d.confidence_level
-            FROM deposits d
-            JOIN mineral_types mt ON d.mineral_type_id = mt.id
-            WHERE 1=1
-        """
-        params = []
+        try:
+            where, params = viewport_filter('deposits', 'd')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         if mineral_id:
-            query += " AND mt.id = ?"
+            where.append("mt.id = ?")
             params.append(int(mineral_id))
         
         if status:
-            query += " AND d.status = ?"
+            where.append("d.status = ?")
             params.append(status)
         
-        query += " ORDER BY d.name"
-        
-        deposits = db.execute(query, params).fetchall()
+        cursor, limit = page_args(API_PAGE_SIZE)
+        deposits, next_cursor = paginate(db, """
+            SELECT d.id, d.name, d.latitude, d.longitude, d.region,
+                   mt.id as mineral_id, mt.name as mineral, mt.category,
+                   d.status, d.estimated_reserves_tonnes,
+                   d.average_grade, d.confidence_level
+            FROM deposits d
+            JOIN mineral_types mt ON d.mineral_type_id = mt.id
+        """, where, params, API_DEPOSITS_KEYSET, cursor, limit)
         
-        return jsonify([dict(d) for d in deposits])
+        return page_response(db, deposits, next_cursor, 'deposits')
     
     @app.route("/api/ss-states")
+    @map_read
+    @layer_etag('states', 'deposits', 'sites')
     def api_ss_states():
         """API endpoint for South Sudan states data"""
         db = get_db()
         
         states = db.execute("""
             SELECT s.*, 
-                   COUNT(DISTINCT d.id) as deposit_count,
-                   COUNT(DISTINCT e.id) as site_count
+                   (SELECT COUNT(*) FROM deposits d WHERE d.state_id = s.id) as deposit_count,
+                   (SELECT COUNT(*) FROM ss_exploration_sites e WHERE e.state_id = s.id) as site_count
             FROM ss_states s
-            LEFT JOIN deposits d ON d.region = s.name
-            LEFT JOIN ss_exploration_sites e ON e.state_id = s.id
-            GROUP BY s.id
             ORDER BY s.name
         """).fetchall()
-        
-        return jsonify([dict(s) for s in states])
+        states = [dict(s) for s in states]
+        
+        # Boundaries simplified for ?zoom= (full detail without it)
+        try:
+            _, zoom = viewport_args()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        geometries = geometries_for_zoom(db, 'states', [s['id'] for s in states], zoom)
+        for state in states:
+            state['geometry'] = geometries.get(state['id'])
+        
+        if wants_packed():
+            return packed_response(states)
+        return jsonify(states)
     
     @app.route("/api/mining-claims")
+    @map_read
+    @layer_etag('claims', 'deposits')
     def api_mining_claims():
-        """API endpoint for mining claims data"""
+        """API endpoint for mining claims data, optionally limited to ?bbox=&zoom="""
         db = get_db()
         
         # Optional filters
         status = request.args.get('status')
         
-        query = """
+        try:
+            where, params = viewport_filter('claims', 'c')
+            _, zoom = viewport_args()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        where.append("c.latitude IS NOT NULL")
+        
+        if status:
+            where.append("c.status = ?")
+            params.append(status)
+        
+        cursor, limit = page_args(API_PAGE_SIZE)
+        claims, next_cursor = paginate(db, """
             SELECT c.id, c.claim_id, c.company_name, c.latitude, c.longitude,
                    c.area_hectares, c.status, c.claim_type, d.name as deposit_name
             FROM mining_claims c
             LEFT JOIN deposits d ON c.deposit_id = d.id
-            WHERE c.latitude IS NOT NULL
-        """
-        params = []
-        
-        if status:
-            query += " AND c.status = ?"
-            params.append(status)
+        """, where, params, API_CLAIMS_KEYSET, cursor, limit)
         
-        claims = db.execute(query, params).fetchall()
+        # Claim polygons at the detail the zoom needs (None for point-only claims)
+        geometries = geometries_for_zoom(db, 'claims', [c['id'] for c in claims], zoom)
+        for claim in claims:
+            claim['geometry'] = geometries.get(claim['id'])
         
-        return jsonify([dict(c) for c in claims])
+        return page_response(db, claims, next_cursor, 'mining_claims')
     
     @app.route("/api/exploration-sites")
+    @map_read
+    @layer_etag('sites', 'states')
     def api_exploration_sites():
-        """API endpoint for exploration sites"""
+        """API endpoint for exploration sites, optionally limited to ?bbox=&zoom="""
         db = get_db()
         
-        sites = db.execute("""
+        try:
+            where, params = viewport_filter('sites', 'e')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        where.append("e.latitude IS NOT NULL")
+        
+        cursor, limit = page_args(API_PAGE_SIZE)
+        sites, next_cursor = paginate(db, """
             SELECT e.id, e.name, e.latitude, e.longitude, e.accessibility,
                    e.security_status, e.exploration_status, s.name as state
             FROM ss_exploration_sites e
             JOIN ss_states s ON e.state_id = s.id
-            WHERE e.latitude IS NOT NULL
-        """).fetchall()
+        """, where, params, API_SITES_KEYSET, cursor, limit)
+        
+        return page_response(db, sites, next_cursor, 'ss_exploration_sites')
+    
+    @app.route("/api/infrastructure")
+    @map_read
+    def api_infrastructure():
+        """API endpoint for infrastructure, placed at its state; optionally limited to ?bbox="""
+        db = get_db()
+        
+        try:
+            bbox, _ = viewport_args()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        where, params = [], []
+        if bbox:
+            condition, params = bbox_condition('states', 's', bbox)
+            where.append(condition)
+        
+        cursor, limit = page_args(API_PAGE_SIZE)
+        infra, next_cursor = paginate(db, """
+            SELECT i.id, i.name, i.type, i.status, s.name as state,
+                   s.latitude, s.longitude
+            FROM ss_infrastructure i
+            JOIN ss_states s ON i.state_id = s.id
+        """, where, params, API_INFRA_KEYSET, cursor, limit)
         
-        return jsonify([dict(s) for s in sites])
+        # Not a versioned layer: revalidate on the body instead
+        response = page_response(db, infra, next_cursor, 'ss_infrastructure')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.add_etag()
+        return response.make_conditional(request)
     
     # ============================================================
     # STATISTICS & ANALYTICS
@@ -260,7 +299,7 @@ def mapping_routes(app):
                    GROUP_CONCAT(DISTINCT mt.name) as minerals,
                    COUNT(DISTINCT d.id) as deposit_count
             FROM ss_states s
-            LEFT JOIN deposits d ON d.region = s.name
+            LEFT JOIN deposits d ON d.state_id = s.id
             LEFT JOIN mineral_types mt ON d.mineral_type_id = mt.id
             GROUP BY s.id, s.name
             ORDER BY deposit_count DESC
@@ -0,0 +1,664 @@
+"""
+Versioned Schema Migrations
+Applies numbered schema changes on top of the enhanced schema and
+records each applied version in the schema_migrations table.
+
+Usage:
+    python -m app.migrations [db_path]           # apply pending migrations
+    python -m app.migrations --check [db_path]   # also verify query plans
+"""
+
+import sqlite3
+import sys
+from app.clustering import rebuild_clusters
+from app.simplify import store_levels
+
+# ============================================================
+# MIGRATIONS
+# ============================================================
+# Append only: never edit or renumber a migration once it has shipped.
+# Migrations carry their own DDL (see FROZEN SCHEMA below) and only call
+# into app modules to fill derived data, so later changes to those modules
+# cannot change what an old migration creates. Schema changes need a new
+# migration.
+
+# (index name, table, columns)
+INDEXES = [
+    ("idx_deposits_mineral_type", "deposits", "mineral_type_id"),
+    ("idx_deposits_status_year", "deposits", "status, discovery_year"),
+    ("idx_deposits_region", "deposits", "region"),
+    ("idx_deposits_country", "deposits", "country"),
+    ("idx_mining_claims_deposit", "mining_claims", "deposit_id"),
+    ("idx_mining_claims_status_issue", "mining_claims", "status, issue_date"),
+    ("idx_mining_claims_issue_date", "mining_claims", "issue_date"),
+    ("idx_assay_results_deposit", "assay_results", "deposit_id, depth_from"),
+    ("idx_drilling_logs_deposit", "drilling_logs", "deposit_id, total_depth"),
+    ("idx_resource_estimates_deposit", "resource_estimates", "deposit_id, estimate_date"),
+    ("idx_geological_reports_deposit", "geological_reports", "deposit_id, report_date"),
+    ("idx_licenses_claim", "licenses", "claim_id, issue_date"),
+    ("idx_learning_content_category", "learning_content", "category"),
+    ("idx_exploration_sites_state", "ss_exploration_sites", "state_id"),
+    ("idx_exploration_sites_deposit", "ss_exploration_sites", "deposit_id"),
+]
+
+# Expression indexes matching the keyset pagination orders (app.pagination)
+KEYSET_INDEXES = [
+    ("idx_deposits_keyset", "deposits", "COALESCE(status, ''), COALESCE(discovery_year, -1), id"),
+    ("idx_deposits_admin_keyset", "deposits", "COALESCE(status, ''), name, id"),
+    ("idx_deposits_name", "deposits", "name, id"),
+    ("idx_mining_claims_keyset", "mining_claims", "COALESCE(issue_date, ''), id"),
+    ("idx_mining_claims_admin_keyset", "mining_claims", "COALESCE(status, ''), claim_id, id"),
+    ("idx_exploration_sites_keyset", "ss_exploration_sites", "COALESCE(exploration_status, ''), id"),
+    ("idx_geological_reports_keyset", "geological_reports", "COALESCE(report_date, ''), id"),
+]
+
+# Integer state links (app.states) replacing region-name joins
+STATE_INDEXES = [
+    ("idx_deposits_state", "deposits", "state_id"),
+    ("idx_mining_claims_state", "mining_claims", "state_id"),
+]
+
+# Duplicate checks of the bulk import path (app.geospatial)
+IMPORT_INDEXES = [
+    ("idx_deposits_name_location", "deposits", "name, latitude, longitude"),
+]
+
+def create_indexes(conn, indexes=None):
+    """
+    Create the lookup indexes for every table that exists.
+    Older databases lack some child tables; create_enhanced_db() calls
+    this again after creating them.
+    """
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    for name, table, columns in (INDEXES if indexes is None else indexes):
+        if table in tables:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})")
+
+def create_keyset_indexes(conn):
+    create_indexes(conn, KEYSET_INDEXES)
+
+def create_import_indexes(conn):
+    create_indexes(conn, IMPORT_INDEXES)
+
+def add_user_role_columns(conn):
+    """
+    Bring pre-roles users tables up to the enhanced schema.
+    Existing admins (is_admin = 1) get the 'admin' role.
+    """
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+    if "role" not in columns:
+        conn.execute("ALTER TABLE users ADD COLUMN role TEXT DEFAULT 'viewer'")
+        conn.execute("UPDATE users SET role = CASE WHEN is_admin = 1 THEN 'admin' ELSE 'viewer' END")
+    if "organization" not in columns:
+        conn.execute("ALTER TABLE users ADD COLUMN organization TEXT")
+    if "expertise" not in columns:
+        conn.execute("ALTER TABLE users ADD COLUMN expertise TEXT")
+
+# ============================================================
+# FROZEN SCHEMA
+# ============================================================
+# The DDL of each migration exactly as it shipped. Never edit these;
+# add a migration that changes the schema instead.
+
+def _tables(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+# --- 4: unified search index ---------------------------------
+
+# type: (code, table, title expression, body expression, url expression)
+SEARCH_SOURCES_V4 = {
+    'mineral': (1, 'minerals',
+                "{r}.name",
+                "coalesce({r}.formula, '') || ' ' || coalesce({r}.properties, '') || ' ' || "
+                "coalesce({r}.uses, '') || ' ' || coalesce({r}.countries, '')",
+                "'/mineral/' || {r}.id"),
+    'deposit': (2, 'deposits',
+                "{r}.name",
+                "coalesce({r}.location_name, '') || ' ' || coalesce({r}.region, '') || ' ' || "
+                "coalesce({r}.country, '') || ' ' || coalesce({r}.status, '') || ' ' || coalesce({r}.notes, '')",
+                "'/deposits/' || {r}.id"),
+    'claim': (3, 'mining_claims',
+              "{r}.claim_id || ' ' || coalesce({r}.company_name, '')",
+              "coalesce({r}.location_description, '') || ' ' || coalesce({r}.claim_type, '') || ' ' || "
+              "coalesce({r}.status, '')",
+              "'/claims/' || {r}.claim_id"),
+    'lesson': (4, 'learning_content',
+               "{r}.title",
+               "coalesce({r}.category, '') || ' ' || coalesce({r}.summary, '') || ' ' || coalesce({r}.content, '')",
+               "'/learn/' || {r}.id"),
+    'regulation': (5, 'ss_regulations',
+                   "{r}.title",
+                   "coalesce({r}.description, '') || ' ' || coalesce({r}.requirements, '') || ' ' || "
+                   "coalesce({r}.applicable_states, '')",
+                   "'/regulations/' || {r}.id"),
+}
+
+def create_search_index(conn):
+    """search_index over every source table, with sync triggers, filled from the data."""
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+            title, body, type UNINDEXED, url UNINDEXED,
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    """)
+    tables = _tables(conn)
+
+    for kind, (code, table, title, body, url) in SEARCH_SOURCES_V4.items():
+        if table not in tables:
+            continue
+
+        def insert_from(ref):
+            return (f"INSERT INTO search_index (rowid, title, body, type, url) "
+                    f"SELECT ({ref}.id << 3) | {code}, {title.format(r=ref)}, {body.format(r=ref)}, "
+                    f"'{kind}', {url.format(r=ref)}")
+
+        delete_old = f"DELETE FROM search_index WHERE rowid = (old.id << 3) | {code};"
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS search_{table}_ai AFTER INSERT ON {table} BEGIN
+                {insert_from('new')};
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS search_{table}_ad AFTER DELETE ON {table} BEGIN
+                {delete_old}
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS search_{table}_au AFTER UPDATE ON {table} BEGIN
+                {delete_old}
+                {insert_from('new')};
+            END
+        """)
+        conn.execute("DELETE FROM search_index WHERE type = ?", (kind,))
+        conn.execute(insert_from(table) + f" FROM {table}")
+
+# --- 6, 9, 10, 11: R*Tree indexes ----------------------------
+
+# R*Tree bounds (min_lon, max_lon, min_lat, max_lat) of a point row, and of
+# a row with geometry extent columns (migrations 10 and 11)
+POINT_BOUNDS = ("{r}.longitude", "{r}.longitude", "{r}.latitude", "{r}.latitude")
+POINT_COLUMNS = "latitude, longitude"
+EXTENT_BOUNDS = ("COALESCE({r}.min_lon, {r}.longitude)", "COALESCE({r}.max_lon, {r}.longitude)",
+                 "COALESCE({r}.min_lat, {r}.latitude)", "COALESCE({r}.max_lat, {r}.latitude)")
+EXTENT_COLUMNS = "latitude, longitude, min_lon, max_lon, min_lat, max_lat"
+
+def _rtree_insert(rtree, bounds, ref, table=None):
+    """INSERT of ref's bounds into the R*Tree (from `table AS ref` when given)."""
+    values = ', '.join(b.format(r=ref) for b in bounds)
+    not_null = ' AND '.join(f"{b.format(r=ref)} IS NOT NULL" for b in bounds)
+    source = f" FROM {table} {ref}" if table else ""
+    return (f"INSERT OR REPLACE INTO {rtree} (id, min_lon, max_lon, min_lat, max_lat) "
+            f"SELECT {ref}.id, {values}{source} WHERE {not_null}")
+
+def _create_rtree(conn, table, rtree, bounds, columns):
+    """R*Tree with sync triggers over a table, filled from its rows."""
+    conn.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {rtree} USING rtree(
+            id, min_lon, max_lon, min_lat, max_lat
+        )
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {rtree}_ai AFTER INSERT ON {table} BEGIN
+            {_rtree_insert(rtree, bounds, 'new')};
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {rtree}_ad AFTER DELETE ON {table} BEGIN
+            DELETE FROM {rtree} WHERE id = old.id;
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {rtree}_au AFTER UPDATE OF id, {columns} ON {table} BEGIN
+            DELETE FROM {rtree} WHERE id = old.id;
+            {_rtree_insert(rtree, bounds, 'new')};
+        END
+    """)
+    conn.execute(f"DELETE FROM {rtree}")
+    conn.execute(_rtree_insert(rtree, bounds, 'src', table))
+
+def _recreate_rtree(conn, table, rtree, bounds, columns):
+    for suffix in ('ai', 'ad', 'au'):
+        conn.execute(f"DROP TRIGGER IF EXISTS {rtree}_{suffix}")
+    _create_rtree(conn, table, rtree, bounds, columns)
+
+def create_spatial_index(conn):
+    """Point R*Trees over deposits, claims and exploration sites."""
+    tables = _tables(conn)
+    for table, rtree in (('deposits', 'deposits_rtree'),
+                         ('mining_claims', 'mining_claims_rtree'),
+                         ('ss_exploration_sites', 'exploration_sites_rtree')):
+        if table in tables:
+            _create_rtree(conn, table, rtree, POINT_BOUNDS, POINT_COLUMNS)
+
+# --- 7, 9: change log ----------------------------------------
+
+def _log_changes(conn, layer, table):
+    for suffix, event, ref in (('ai', 'INSERT', 'new'), ('au', 'UPDATE', 'new'), ('ad', 'DELETE', 'old')):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS spatial_changes_{layer}_{suffix} AFTER {event} ON {table} BEGIN
+                INSERT INTO spatial_changes (layer, row_id) VALUES ('{layer}', {ref}.id);
+            END
+        """)
+
+def create_change_log(conn):
+    """spatial_changes plus the triggers logging deposits, claims and sites."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS spatial_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            layer TEXT NOT NULL,
+            row_id INTEGER NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_spatial_changes_layer ON spatial_changes(layer, seq)")
+    tables = _tables(conn)
+    for layer, table in (('deposits', 'deposits'), ('claims', 'mining_claims'),
+                         ('sites', 'ss_exploration_sites')):
+        if table in tables:
+            _log_changes(conn, layer, table)
+
+# --- 8: map clusters -----------------------------------------
+
+def create_cluster_tables(conn):
+    """Cluster tables, built for deposits, claims and sites (app.clustering)."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS map_clusters (
+            layer TEXT NOT NULL,
+            zoom INTEGER NOT NULL,
+            cell_x INTEGER NOT NULL,
+            cell_y INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            sum_lon REAL NOT NULL,
+            sum_lat REAL NOT NULL,
+            sum_id INTEGER NOT NULL,  -- equals the point id when count = 1
+            PRIMARY KEY (layer, zoom, cell_x, cell_y)
+        ) WITHOUT ROWID
+    """)
+    # Coordinates each point was last clustered at, so it can be removed again
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS map_cluster_points (
+            layer TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            lon REAL NOT NULL,
+            lat REAL NOT NULL,
+            PRIMARY KEY (layer, id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS map_cluster_state (
+            layer TEXT PRIMARY KEY,
+            seq INTEGER NOT NULL
+        )
+    """)
+
+    tables = _tables(conn)
+    for layer, table in (('deposits', 'deposits'), ('claims', 'mining_claims'),
+                         ('sites', 'ss_exploration_sites')):
+        if table in tables:
+            rebuild_clusters(conn, layer)
+
+# --- 9: states layer -----------------------------------------
+
+def add_states_layer(conn):
+    """Index, log and cluster ss_states like the other map layers."""
+    if 'ss_states' in _tables(conn):
+        _create_rtree(conn, 'ss_states', 'ss_states_rtree', POINT_BOUNDS, POINT_COLUMNS)
+        _log_changes(conn, 'states', 'ss_states')
+        rebuild_clusters(conn, 'states')
+
+# --- 10, 11: polygon geometry and state links ----------------
+
+def add_extent_columns(conn, table):
+    """Add GeoJSON geometry and bbox columns; False if the table is missing."""
+    columns = _columns(conn, table)
+    if not columns:
+        return False
+    for name, kind in (("geometry", "TEXT"), ("min_lon", "REAL"), ("max_lon", "REAL"),
+                       ("min_lat", "REAL"), ("max_lat", "REAL")):
+        if name not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {kind}")
+    return True
+
+def add_claim_geometry(conn):
+    """
+    Polygon geometry (GeoJSON) and bbox columns on mining_claims; the
+    claims R*Tree is rebuilt to index each claim by its polygon bbox.
+    """
+    if add_extent_columns(conn, "mining_claims"):
+        _recreate_rtree(conn, 'mining_claims', 'mining_claims_rtree', EXTENT_BOUNDS, EXTENT_COLUMNS)
+
+def add_state_links(conn):
+    """
+    Boundary polygons on ss_states and an indexed state_id on deposits
+    and claims. Deposits are linked by their region name until boundaries
+    are imported (app.states assigns by polygon from then on).
+    """
+    if add_extent_columns(conn, "ss_states"):
+        _recreate_rtree(conn, 'ss_states', 'ss_states_rtree', EXTENT_BOUNDS, EXTENT_COLUMNS)
+
+    for table in ("deposits", "mining_claims"):
+        columns = _columns(conn, table)
+        if columns and "state_id" not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN state_id INTEGER REFERENCES ss_states(id)")
+    create_indexes(conn, STATE_INDEXES)
+
+    if {"deposits", "ss_states"} <= _tables(conn):
+        conn.execute("""
+            UPDATE deposits
+            SET state_id = (SELECT s.id FROM ss_states s WHERE s.name = deposits.region)
+            WHERE state_id IS NULL
+        """)
+
+# --- 12: simplification levels -------------------------------
+
+def create_geometry_levels(conn):
+    """geometry_levels with its invalidation triggers, filled by app.simplify."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS geometry_levels (
+            layer TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            zoom INTEGER NOT NULL,
+            geometry TEXT,  -- NULL when the shape is smaller than a pixel
+            PRIMARY KEY (layer, id, zoom)
+        ) WITHOUT ROWID
+    """)
+
+    for layer, table in (('claims', 'mining_claims'), ('states', 'ss_states')):
+        if "geometry" not in _columns(conn, table):
+            continue
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS geometry_levels_{layer}_au
+            AFTER UPDATE OF geometry ON {table} BEGIN
+                DELETE FROM geometry_levels WHERE layer = '{layer}' AND id = old.id;
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS geometry_levels_{layer}_ad
+            AFTER DELETE ON {table} BEGIN
+                DELETE FROM geometry_levels WHERE layer = '{layer}' AND id = old.id;
+            END
+        """)
+        store_levels(conn, layer)
+
+# --- 13: heatmap grid ----------------------------------------
+
+def create_grid_columns(conn):
+    """Generated 2^16 grid cell columns on deposits plus a covering index for binning."""
+    # table_xinfo also lists generated columns
+    columns = {row[1] for row in conn.execute("PRAGMA table_xinfo(deposits)")}
+    if not columns:
+        return
+    if "grid_x" not in columns:
+        conn.execute("""
+            ALTER TABLE deposits ADD COLUMN grid_x INTEGER
+            GENERATED ALWAYS AS (MIN(CAST((longitude + 180.0) / 360.0 * 65536 AS INTEGER), 65535)) VIRTUAL
+        """)
+    if "grid_y" not in columns:
+        conn.execute("""
+            ALTER TABLE deposits ADD COLUMN grid_y INTEGER
+            GENERATED ALWAYS AS (MIN(CAST((latitude + 90.0) / 180.0 * 65536 AS INTEGER), 65535)) VIRTUAL
+        """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_deposits_grid ON deposits(
+            grid_x, grid_y, mineral_type_id, status, estimated_reserves_tonnes, average_grade
+        )
+    """)
+
+MIGRATIONS = [
+    (1, "Add lookup indexes for list filters and child tables", create_indexes),
+    (2, "Add role, organization and expertise columns to users", add_user_role_columns),
+    (3, "Add FTS5 full-text index over minerals", """
+        CREATE VIRTUAL TABLE IF NOT EXISTS minerals_fts USING fts5(
+            name, formula, properties, uses, countries,
+            content='minerals', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        );
+
+        CREATE TRIGGER IF NOT EXISTS minerals_fts_ai AFTER INSERT ON minerals BEGIN
+            INSERT INTO minerals_fts (rowid, name, formula, properties, uses, countries)
+            VALUES (new.id, new.name, new.formula, new.properties, new.uses, new.countries);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS minerals_fts_ad AFTER DELETE ON minerals BEGIN
+            INSERT INTO minerals_fts (minerals_fts, rowid, name, formula, properties, uses, countries)
+            VALUES ('delete', old.id, old.name, old.formula, old.properties, old.uses, old.countries);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS minerals_fts_au AFTER UPDATE ON minerals BEGIN
+            INSERT INTO minerals_fts (minerals_fts, rowid, name, formula, properties, uses, countries)
+            VALUES ('delete', old.id, old.name, old.formula, old.properties, old.uses, old.countries);
+            INSERT INTO minerals_fts (rowid, name, formula, properties, uses, countries)
+            VALUES (new.id, new.name, new.formula, new.properties, new.uses, new.countries);
+        END;
+
+        INSERT INTO minerals_fts (minerals_fts) VALUES ('rebuild');
+    """),
+    (4, "Add unified search index over minerals, deposits, claims, lessons and regulations",
+     create_search_index),
+    (5, "Add expression indexes for keyset pagination orders", create_keyset_indexes),
+    (6, "Add R*Tree spatial indexes over deposits, claims and exploration sites",
+     create_spatial_index),
+    (7, "Add spatial_changes log for map layer versions", create_change_log),
+    (8, "Add precomputed map clusters per zoom level", create_cluster_tables),
+    (9, "Add ss_states as a spatial map layer", add_states_layer),
+    (10, "Add polygon geometry to mining claims and index claims by extent", add_claim_geometry),
+    (11, "Add state boundaries and state_id links on deposits and claims", add_state_links),
+    (12, "Add precomputed simplification levels for claim and state polygons", create_geometry_levels),
+    (13, "Add indexed grid cell columns to deposits for density heatmaps", create_grid_columns),
+    (14, "Add a (name, latitude, longitude) index for import duplicate checks", create_import_indexes),
+    (15, "Add the import_jobs table for background QGIS imports", """
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,               -- deposits, claims
+            format TEXT NOT NULL,             -- geojson, csv, ...
+            filename TEXT,
+            path TEXT NOT NULL,               -- spooled upload
+            options TEXT,                     -- JSON, e.g. mineral_type_id
+            status TEXT NOT NULL DEFAULT 'queued',  -- queued, running, done, failed
+            owner TEXT,                       -- host:pid running the job
+            heartbeat REAL,                   -- last commit by the owner (epoch seconds)
+            started_at REAL,
+            start_bytes INTEGER,              -- bytes_read when this run started
+            finished_at REAL,
+            total_bytes INTEGER,
+            bytes_read INTEGER NOT NULL DEFAULT 0,
+            features_read INTEGER NOT NULL DEFAULT 0,  -- resume point
+            rows_parsed INTEGER NOT NULL DEFAULT 0,
+            inserted INTEGER NOT NULL DEFAULT 0,
+            duplicates INTEGER NOT NULL DEFAULT 0,
+            errors TEXT,                      -- JSON list of messages
+            created_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """),
+]
+
+# ============================================================
+# EXPECTED QUERY PLANS
+# ============================================================
+# (description, query, params, index the planner must pick)
+
+EXPECTED_PLANS = [
+    ("deposits filtered by mineral",
+     "SELECT * FROM deposits WHERE mineral_type_id = ?", (1,),
+     "idx_deposits_mineral_type"),
+    ("deposits filtered by status",
+     "SELECT * FROM deposits WHERE status = ? ORDER BY discovery_year DESC", ('Active',),
+     "idx_deposits_status_year"),
+    ("deposits in a state (sudan_state)",
+     "SELECT * FROM deposits d WHERE d.state_id = ?", (1,),
+     "idx_deposits_state"),
+    ("claims in a state",
+     "SELECT * FROM mining_claims c WHERE c.state_id = ?", (1,),
+     "idx_mining_claims_state"),
+    ("deposits filtered by country",
+     "SELECT * FROM deposits WHERE country = ?", ('South Sudan',),
+     "idx_deposits_country"),
+    ("claims of a deposit",
+     "SELECT * FROM mining_claims WHERE deposit_id = ?", (1,),
+     "idx_mining_claims_deposit"),
+    ("claims filtered by status",
+     "SELECT * FROM mining_claims WHERE status = ? ORDER BY issue_date DESC", ('Active',),
+     "idx_mining_claims_status_issue"),
+    ("assays of a deposit",
+     "SELECT * FROM assay_results WHERE deposit_id = ? ORDER BY depth_from", (1,),
+     "idx_assay_results_deposit"),
+    ("drilling logs of a deposit",
+     "SELECT * FROM drilling_logs WHERE deposit_id = ? ORDER BY total_depth", (1,),
+     "idx_drilling_logs_deposit"),
+    ("resource estimates of a deposit",
+     "SELECT * FROM resource_estimates WHERE deposit_id = ? ORDER BY estimate_date DESC", (1,),
+     "idx_resource_estimates_deposit"),
+    ("reports of a deposit",
+     "SELECT * FROM geological_reports WHERE deposit_id = ? ORDER BY report_date DESC", (1,),
+     "idx_geological_reports_deposit"),
+    ("licenses of a claim",
+     "SELECT * FROM licenses WHERE claim_id = ? ORDER BY issue_date DESC", (1,),
+     "idx_licenses_claim"),
+    ("lessons in a category",
+     "SELECT id FROM learning_content WHERE category = ?", ('Basics',),
+     "idx_learning_content_category"),
+    ("exploration sites of a deposit",
+     "SELECT * FROM ss_exploration_sites WHERE deposit_id = ?", (1,),
+     "idx_exploration_sites_deposit"),
+    ("deposits page after a cursor",
+     "SELECT id FROM deposits d WHERE (COALESCE(d.status, ''), COALESCE(d.discovery_year, -1), d.id)"
+     " < (?, ?, ?) ORDER BY COALESCE(d.status, '') DESC, COALESCE(d.discovery_year, -1) DESC, d.id DESC",
+     ('Active', 2000, 10), "idx_deposits_keyset"),
+    ("import duplicate check of a deposit",
+     "SELECT 1 FROM deposits d WHERE d.name = ? AND d.latitude = ? AND d.longitude = ?",
+     ('Kapoeta Gold', 4.77, 33.59), "idx_deposits_name_location"),
+    ("claims page after a cursor",
+     "SELECT id FROM mining_claims c WHERE (COALESCE(c.issue_date, ''), c.id) < (?, ?)"
+     " ORDER BY COALESCE(c.issue_date, '') DESC, c.id DESC",
+     ('2024-01-01', 10), "idx_mining_claims_keyset"),
+]
+
+# ============================================================
+# RUNNER
+# ============================================================
+
+def split_statements(sql):
+    """Split a migration script into complete statements (trigger-safe)."""
+    statements = []
+    buffer = ""
+    for line in sql.splitlines(keepends=True):
+        buffer += line
+        if sqlite3.complete_statement(buffer):
+            if buffer.strip():
+                statements.append(buffer.strip())
+            buffer = ""
+    if buffer.strip():
+        statements.append(buffer.strip())
+    return statements
+
+def applied_versions(conn):
+    """Return the set of migration versions already applied."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    return {row[0] for row in conn.execute("SELECT version FROM schema_migrations")}
+
+def run_migrations(conn, migrations=None):
+    """
+    Apply pending migrations in version order.
+    Each migration runs in its own transaction together with its
+    schema_migrations row, so a failed migration leaves nothing behind.
+    Returns the list of versions applied.
+    """
+    migrations = MIGRATIONS if migrations is None else migrations
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None  # transactions are managed explicitly
+    applied = []
+
+    try:
+        for version, description, script in sorted(migrations, key=lambda m: m[0]):
+            # BEGIN IMMEDIATE serializes concurrent workers starting up
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if version in applied_versions(conn):
+                    conn.execute("ROLLBACK")
+                    continue
+
+                if callable(script):
+                    script(conn)
+                else:
+                    for statement in split_statements(script):
+                        conn.execute(statement)
+
+                conn.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES (?, ?)",
+                    (version, description)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            applied.append(version)
+
+        if applied:
+            conn.execute("PRAGMA optimize")
+    finally:
+        conn.isolation_level = isolation_level
+
+    return applied
+
+def verify_query_plans(conn, expected=None):
+    """
+    Run EXPLAIN QUERY PLAN for the hot queries and check each uses its index.
+    Returns a list of (description, plan) for queries that do not.
+    """
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    failures = []
+    for description, query, params, index_name in (expected or EXPECTED_PLANS):
+        table = next(name for idx, name, _ in INDEXES + KEYSET_INDEXES + STATE_INDEXES + IMPORT_INDEXES
+                     if idx == index_name)
+        if table not in tables:
+            continue
+        plan = " | ".join(
+            row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)
+        )
+        if index_name not in plan:
+            failures.append((description, plan))
+    return failures
+
+def migrate(app):
+    """Apply pending migrations to the app database at startup."""
+    from app.db import get_pool
+
+    with app.app_context():
+        conn = get_pool().connect()
+        try:
+            applied = run_migrations(conn)
+        finally:
+            conn.close()
+
+    if applied:
+        print(f"✓ Applied schema migrations: {', '.join(map(str, applied))}")
+    return applied
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    db_path = args[0] if args else "minerals.db"
+
+    conn = sqlite3.connect(db_path)
+    applied = run_migrations(conn)
+    print(f"Applied migrations: {applied or 'none (up to date)'}")
+
+    if "--check" in sys.argv:
+        failures = verify_query_plans(conn)
+        for description, plan in failures:
+            print(f"✗ {description}: {plan}")
+        print(f"{len(failures)} query plan(s) not using their index")
+        conn.close()
+        sys.exit(1 if failures else 0)
+
+    conn.close()
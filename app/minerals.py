@@ -1,9 +1,15 @@
 from flask import render_template, request, redirect, session
 from app.db import get_db
 from app.helpers import login_required
+from app.search import MINERAL_RANK, fts_query, search_minerals, count_minerals
+from app.pagination import Keyset, approximate_count, page_args, paginate
 
 PER_PAGE = 8
 
+MINERALS_KEYSET = Keyset(("m.id", 'asc'))
+# Searches page through the BM25 order (lower is better), id breaking ties
+SEARCH_KEYSET = Keyset((MINERAL_RANK, 'asc'), ("m.id", 'asc'))
+
 def mineral_routes(app):
 
     @app.route("/")
@@ -17,26 +23,31 @@ def mineral_routes(app):
     @login_required
     def minerals():
         db = get_db()
-        page = int(request.args.get('page', 1))
         q = request.args.get('q')
         group = request.args.get('group')
+        cursor, limit = page_args(PER_PAGE)
 
-        params = []
-        where = []
-        if q:
-            where.append('name LIKE ?')
-            params.append('%'+q+'%')
-        if group:
-            where.append('properties LIKE ?')
-            params.append('%'+group+'%')
-        where_sql = ('WHERE ' + ' AND '.join(where)) if where else ''
+        # Full-text filters: q matches names, group matches properties
+        terms = [t for t in (fts_query(q, 'name'), fts_query(group, 'properties')) if t]
 
-        total = db.execute(f'SELECT COUNT(*) as cnt FROM minerals {where_sql}', params).fetchone()['cnt']
-        offset = (page - 1) * PER_PAGE
-        rows = db.execute(f'SELECT * FROM minerals {where_sql} LIMIT ? OFFSET ?', params + [PER_PAGE, offset]).fetchall()
-        pages = (total + PER_PAGE - 1) // PER_PAGE
+        if terms:
+            match = ' AND '.join(terms)
+            total = count_minerals(db, match)
+            rows, next_cursor = paginate(
+                db, "SELECT m.* FROM minerals_fts JOIN minerals m ON m.id = minerals_fts.rowid",
+                ["minerals_fts MATCH ?"], [match],
+                SEARCH_KEYSET, cursor, limit
+            )
+        elif q or group:
+            # Input without any searchable words matches nothing
+            total, rows, next_cursor = 0, [], None
+        else:
+            total = approximate_count(db, 'minerals')
+            rows, next_cursor = paginate(db, "SELECT m.* FROM minerals m", [], [],
+                                         MINERALS_KEYSET, cursor, limit)
 
-        return render_template("minerals.html", minerals=rows, page=page, pages=pages)
+        return render_template("minerals.html", minerals=rows, total=total,
+                               next_cursor=next_cursor)
 
     @app.route("/mineral/<int:id>")
     @login_required
@@ -65,9 +76,9 @@ def mineral_routes(app):
         db = get_db()
         q = request.args.get("q")
         results = []
-        if q:
-            results = db.execute("SELECT * FROM minerals WHERE name LIKE ? OR countries LIKE ? OR properties LIKE ?", 
-                                 (f"%{q}%", f"%{q}%", f"%{q}%")).fetchall()
+        match = fts_query(q)
+        if match:
+            results = search_minerals(db, match)
         return render_template("search.html", results=results, q=q)
 
     @app.route("/favorites")
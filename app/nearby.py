@@ -0,0 +1,307 @@
+"""
+Nearby Search
+k-nearest-neighbour and radius queries over deposits and mining claims.
+Points are held in an in-memory KD-tree on 3D unit vectors, where the
+straight-line (chord) distance orders points exactly like great-circle
+distance. Each worker process keeps one tree per layer and rebuilds it
+when the layer version (spatial_changes) moves.
+"""
+
+import heapq
+import json
+import math
+import threading
+from array import array
+from flask import current_app, jsonify, request
+from app.db import get_db, get_pool
+from app.helpers import map_read
+from app.pagination import approximate_count
+from app.spatial import layer_version
+
+EARTH_RADIUS_KM = 6371.0088
+MAX_K = 1000
+DEFAULT_K = 10
+INDEX_RETRY_AFTER = 5  # seconds, while a first index is being built
+
+# layer: (table, details query selecting the rows whose ids are in json_each(?))
+NEARBY_LAYERS = {
+    'deposits': ('deposits', """
+        SELECT d.id, d.name, d.latitude, d.longitude, d.region, d.status,
+               mt.name as mineral
+        FROM deposits d
+        LEFT JOIN mineral_types mt ON d.mineral_type_id = mt.id
+        WHERE d.id IN (SELECT value FROM json_each(?))
+    """),
+    'claims': ('mining_claims', """
+        SELECT c.id, c.claim_id, c.company_name, c.latitude, c.longitude,
+               c.status, c.claim_type
+        FROM mining_claims c
+        WHERE c.id IN (SELECT value FROM json_each(?))
+    """),
+}
+
+# ============================================================
+# GEOMETRY
+# ============================================================
+
+def unit_vector(lat, lon):
+    """Point on the unit sphere for a latitude/longitude in degrees."""
+    phi, lam = math.radians(lat), math.radians(lon)
+    return math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi)
+
+def km_to_chord2(km):
+    """Squared chord length on the unit sphere for a surface distance."""
+    theta = min(km / EARTH_RADIUS_KM, math.pi)
+    return (2 * math.sin(theta / 2)) ** 2
+
+def chord2_to_km(chord2):
+    return 2 * math.asin(min(math.sqrt(chord2) / 2, 1.0)) * EARTH_RADIUS_KM
+
+# ============================================================
+# KD-TREE
+# ============================================================
+
+class KDTree:
+    """
+    Static KD-tree over 3D points stored in flat arrays.
+    Points are reordered so every node covers a contiguous slice; node i
+    has children 2i+1 and 2i+2 and splits its slice at the middle along
+    the axis of largest spread. Slices of LEAF_SIZE or fewer are scanned.
+    """
+
+    LEAF_SIZE = 16
+    SPREAD_SAMPLE = 256
+
+    def __init__(self, ids, points):
+        columns = [list(axis) for axis in zip(*points)] if points else [[], [], []]
+        order = list(range(len(ids)))
+        self._splits = {}  # node -> (axis, split value)
+
+        stack = [(0, 0, len(order))]
+        while stack:
+            node, lo, hi = stack.pop()
+            if hi - lo <= self.LEAF_SIZE:
+                continue
+            chunk = order[lo:hi]
+            # Spread estimated from an even sample keeps the build O(n log n)
+            sample = chunk[::max(1, len(chunk) // self.SPREAD_SAMPLE)]
+            spreads = []
+            for column in columns:
+                values = list(map(column.__getitem__, sample))
+                spreads.append(max(values) - min(values))
+            axis = spreads.index(max(spreads))
+            chunk.sort(key=columns[axis].__getitem__)
+            order[lo:hi] = chunk
+            mid = (lo + hi) // 2
+            self._splits[node] = (axis, columns[axis][order[mid]])
+            stack.append((2 * node + 1, lo, mid))
+            stack.append((2 * node + 2, mid, hi))
+
+        self.ids = array('q', map(ids.__getitem__, order))
+        self._coords = tuple(array('d', map(column.__getitem__, order)) for column in columns)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def query(self, point, k=None, max_chord2=math.inf):
+        """
+        Nearest points to `point`, closest first, as (chord², id) pairs.
+        Returns at most k points (all if k is None) within max_chord2.
+        """
+        if k is not None and k <= 0:
+            return []
+        xs, ys, zs = self._coords
+        qx, qy, qz = point
+        best = []  # max-heap of (-chord², position) when k is set
+
+        def bound():
+            if k is not None and len(best) == k:
+                return -best[0][0]
+            return max_chord2
+
+        def visit(node, lo, hi):
+            split = self._splits.get(node)
+            if split is None:
+                for i in range(lo, hi):
+                    d2 = (xs[i] - qx) ** 2 + (ys[i] - qy) ** 2 + (zs[i] - qz) ** 2
+                    if d2 > bound():
+                        continue
+                    if k is None:
+                        best.append((-d2, i))
+                    elif len(best) < k:
+                        heapq.heappush(best, (-d2, i))
+                    else:
+                        heapq.heapreplace(best, (-d2, i))
+                return
+
+            axis, value = split
+            diff = point[axis] - value
+            mid = (lo + hi) // 2
+            near, far = ((2 * node + 1, lo, mid), (2 * node + 2, mid, hi))
+            if diff >= 0:
+                near, far = far, near
+            visit(*near)
+            if diff * diff <= bound():
+                visit(*far)
+
+        visit(0, 0, len(self.ids))
+        return sorted((-d2, self.ids[i]) for d2, i in best)
+
+# ============================================================
+# PER-PROCESS INDEXES
+# ============================================================
+
+# Trees up to this size are built inline; larger ones are built on a
+# background thread while queries keep using the previous tree (or get
+# IndexNotReady until the first one is done)
+INLINE_REBUILD_LIMIT = 100000
+
+class IndexNotReady(Exception):
+    """A layer's first KD-tree is still being built in the background."""
+
+_indexes = {}
+_rebuilding = set()
+_indexes_lock = threading.Lock()
+
+def build_index(db, layer):
+    """KD-tree over every located row of a layer."""
+    table = NEARBY_LAYERS[layer][0]
+    rows = db.execute(f"""
+        SELECT id, latitude, longitude FROM {table}
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    """).fetchall()
+    return KDTree([row[0] for row in rows], [unit_vector(row[1], row[2]) for row in rows])
+
+def _rebuild_in_background(database, layer, version):
+    def rebuild():
+        conn = get_pool(database, readonly=True).connect()
+        try:
+            tree = build_index(conn, layer)
+            with _indexes_lock:
+                _indexes[(database, layer)] = (version, tree)
+        finally:
+            conn.close()
+            with _indexes_lock:
+                _rebuilding.discard((database, layer))
+
+    with _indexes_lock:
+        if (database, layer) in _rebuilding:
+            return
+        _rebuilding.add((database, layer))
+    threading.Thread(target=rebuild, name=f'kdtree-{layer}', daemon=True).start()
+
+def get_index(db, layer):
+    """
+    This process's KD-tree for a layer, refreshed when the layer changed.
+    Raises IndexNotReady while a large layer's first tree is being built.
+    """
+    database = current_app.config['DATABASE']
+    key = (database, layer)
+    version = layer_version(db, layer)
+
+    entry = _indexes.get(key)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+
+    size = len(entry[1]) if entry is not None else approximate_count(db, NEARBY_LAYERS[layer][0])
+    if size > INLINE_REBUILD_LIMIT:
+        _rebuild_in_background(database, layer, version)
+        if entry is None:
+            raise IndexNotReady(layer)
+        return entry[1]
+
+    tree = build_index(db, layer)
+    with _indexes_lock:
+        _indexes[key] = (version, tree)
+    return tree
+
+def find_nearby(db, layer, lat, lon, k=DEFAULT_K, radius_km=None):
+    """
+    Rows of a layer nearest to a point, closest first, each with a
+    distance_km: at most k (capped at MAX_K), within radius_km if given.
+    Returns (rows, truncated) where truncated means more rows matched.
+    """
+    k = min(k, MAX_K)
+    max_chord2 = km_to_chord2(radius_km) if radius_km is not None else math.inf
+    hits = get_index(db, layer).query(unit_vector(lat, lon), k + 1, max_chord2)
+    truncated = len(hits) > k
+    hits = hits[:k]
+    if not hits:
+        return [], truncated
+
+    rows = db.execute(NEARBY_LAYERS[layer][1], (json.dumps([i for _, i in hits]),)).fetchall()
+    by_id = {row['id']: dict(row) for row in rows}
+
+    results = []
+    for chord2, row_id in hits:
+        row = by_id.get(row_id)
+        if row is not None:  # deleted since the index was built
+            row['distance_km'] = round(chord2_to_km(chord2), 3)
+            results.append(row)
+    return results, truncated
+
+# ============================================================
+# API
+# ============================================================
+
+def nearby_args():
+    """
+    Read lat, lng, k and radius_km; raises ValueError on bad input.
+    k defaults to DEFAULT_K, or to MAX_K for radius queries.
+    """
+    try:
+        lat = float(request.args['lat'])
+        lon = float(request.args.get('lng', request.args.get('lon')))
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("lat and lng are required numbers")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError("lat must be in [-90, 90] and lng in [-180, 180]")
+
+    k = request.args.get('k', type=int)
+    radius_km = request.args.get('radius_km', type=float)
+    if k is None:
+        k = DEFAULT_K if radius_km is None else MAX_K
+    if not 1 <= k <= MAX_K:
+        raise ValueError(f"k must be between 1 and {MAX_K}")
+    if radius_km is not None and not 0 <= radius_km <= math.pi * EARTH_RADIUS_KM:
+        raise ValueError("radius_km must be between 0 and half the Earth's circumference")
+    return lat, lon, k, radius_km
+
+def nearby_routes(app):
+    """Register the nearest-neighbour APIs"""
+
+    def nearby_response(layer):
+        try:
+            lat, lon, k, radius_km = nearby_args()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        try:
+            results, truncated = find_nearby(get_db(), layer, lat, lon, k, radius_km)
+        except IndexNotReady:
+            return (jsonify({'error': 'The nearby index is being built, retry shortly'}), 503,
+                    {'Retry-After': str(INDEX_RETRY_AFTER)})
+
+        return jsonify({
+            'lat': lat,
+            'lng': lon,
+            'k': k,
+            'radius_km': radius_km,
+            'count': len(results),
+            'truncated': truncated,
+            'results': results,
+        })
+
+    @app.route("/api/deposits/nearby")
+    @map_read
+    def api_deposits_nearby():
+        """Deposits nearest to ?lat=&lng= (k nearest and/or within radius_km)"""
+        return nearby_response('deposits')
+
+    @app.route("/api/mining-claims/nearby")
+    @map_read
+    def api_mining_claims_nearby():
+        """Mining claims nearest to ?lat=&lng= (k nearest and/or within radius_km)"""
+        return nearby_response('claims')
+
+    print("✓ Nearby search routes registered")
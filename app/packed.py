@@ -0,0 +1,156 @@
+"""
+Packed Columnar Responses
+A compact binary alternative to the JSON list APIs (?format=bin). Rows are
+turned into columns: numbers become little-endian typed arrays the browser
+can wrap with Float32Array/Int32Array without parsing, and text columns
+are dictionary-encoded as small integer codes into a list in the header.
+Polygon geometries are flattened into offset arrays plus one coordinate
+array. static/js/packed.js decodes the layout.
+
+Layout:
+    b"GRC1"  uint32 header length  header JSON (padded to 8 bytes)  column blocks
+Each block starts on an 8-byte boundary at header offset + block offset.
+"""
+
+import json
+import struct
+import sys
+from array import array
+from flask import Response, request
+
+PACKED_MAGIC = b'GRC1'
+PACKED_MIMETYPE = 'application/vnd.georesource.columns'
+ALIGN = 8
+
+# Coordinates as float32 are good to ~1 m, well below marker precision
+FLOAT32_COLUMNS = ('latitude', 'longitude')
+
+INT32_MIN, INT32_MAX = -2 ** 31, 2 ** 31 - 1
+
+def wants_packed():
+    """True when the client asked for the packed columnar format."""
+    return request.args.get('format') == 'bin'
+
+# ============================================================
+# COLUMN ENCODERS
+# ============================================================
+
+class _Blocks:
+    """Aligned binary blocks and their offsets."""
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def add(self, values):
+        """Append a typed array; returns its block descriptor."""
+        if sys.byteorder == 'big':
+            values = array(values.typecode, values)
+            values.byteswap()
+        data = values.tobytes()
+        block = {'offset': self.size, 'length': len(values)}
+        padding = -len(data) % ALIGN
+        self.parts.append(data + b'\0' * padding)
+        self.size += len(data) + padding
+        return block
+
+def _code_type(size):
+    if size <= 1 << 8:
+        return 'uint8', 'B'
+    if size <= 1 << 16:
+        return 'uint16', 'H'
+    return 'uint32', 'I'
+
+def _dictionary_column(values, blocks):
+    """Text (or mixed) values as codes into a list of distinct values."""
+    index = {}
+    dictionary = []
+    codes = []
+    for value in values:
+        if value is not None and not isinstance(value, (str, int, float)):
+            value = str(value)
+        code = index.get(value)
+        if code is None:
+            code = index[value] = len(dictionary)
+            dictionary.append(value)
+        codes.append(code)
+    name, typecode = _code_type(len(dictionary))
+    column = blocks.add(array(typecode, codes))
+    column.update(type=name, dictionary=dictionary)
+    return column
+
+def _polygon_column(values, blocks):
+    """
+    GeoJSON Polygon/MultiPolygon dicts flattened GeoArrow-style: feature →
+    polygon → ring offsets, then interleaved lon/lat float32 coordinates.
+    Rows without a polygon have an empty polygon range.
+    """
+    features, polygons, rings = array('I', [0]), array('I', [0]), array('I', [0])
+    coords = array('f')
+    for geometry in values:
+        if geometry and geometry.get('type') in ('Polygon', 'MultiPolygon'):
+            parts = geometry['coordinates']
+            if geometry['type'] == 'Polygon':
+                parts = [parts]
+            for polygon in parts:
+                for ring in polygon:
+                    for lon, lat in ring:
+                        coords.append(lon)
+                        coords.append(lat)
+                    rings.append(len(coords) // 2)
+                polygons.append(len(rings) - 1)
+        features.append(len(polygons) - 1)
+    return {
+        'type': 'polygons',
+        'features': blocks.add(features),
+        'polygons': blocks.add(polygons),
+        'rings': blocks.add(rings),
+        'coords': blocks.add(coords),
+    }
+
+def _column(name, values, blocks):
+    """Encode one column, choosing the narrowest layout that is exact."""
+    present = [v for v in values if v is not None]
+    if any(isinstance(v, dict) for v in present):
+        return _polygon_column(values, blocks)
+    if present and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in present):
+        if len(present) == len(values) and all(
+                isinstance(v, int) and INT32_MIN <= v <= INT32_MAX for v in present):
+            column = blocks.add(array('i', values))
+            column['type'] = 'int32'
+            return column
+        # NaN marks NULL; float64 keeps integer ids and reserve figures exact
+        nan = float('nan')
+        floats = [nan if v is None else float(v) for v in values]
+        if name in FLOAT32_COLUMNS:
+            column = blocks.add(array('f', floats))
+            column['type'] = 'float32'
+        else:
+            column = blocks.add(array('d', floats))
+            column['type'] = 'float64'
+        return column
+    return _dictionary_column(values, blocks)
+
+# ============================================================
+# RESPONSE
+# ============================================================
+
+def pack_rows(rows, columns=None):
+    """Encode a list of row dicts as a packed columnar body."""
+    if columns is None:
+        columns = list(rows[0]) if rows else []
+    blocks = _Blocks()
+    encoded = []
+    for name in columns:
+        column = _column(name, [row.get(name) for row in rows], blocks)
+        column['name'] = name
+        encoded.append(column)
+
+    header = json.dumps({'count': len(rows), 'columns': encoded}, separators=(',', ':')).encode('utf-8')
+    # Magic + length + header end on an 8-byte boundary so blocks stay aligned
+    header += b' ' * (-(len(header) + 8) % ALIGN)
+    return PACKED_MAGIC + struct.pack('<I', len(header)) + header + b''.join(blocks.parts)
+
+def packed_response(rows, columns=None):
+    """Response carrying rows in the packed columnar format."""
+    return Response(pack_rows(rows, columns), mimetype=PACKED_MIMETYPE)
@@ -0,0 +1,194 @@
+"""
+Keyset (Cursor) Pagination
+Pages are fetched with "WHERE sort keys come after the last row" instead
+of OFFSET, so every page costs the same as the first. Cursors are opaque
+URL-safe tokens holding the sort-key values of the last row served.
+"""
+
+import base64
+import json
+import re
+from flask import request, url_for
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+_SELECT = re.compile(r'^\s*SELECT\s+', re.IGNORECASE)
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor token cannot be decoded for this listing."""
+
+def encode_cursor(values):
+    """Encode sort-key values as an opaque URL-safe token."""
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(token, size):
+    """Decode a cursor token, checking it holds `size` scalar values."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError):
+        raise InvalidCursor("Malformed cursor")
+
+    if (not isinstance(values, list) or len(values) != size
+            or not all(isinstance(v, (str, int, float)) for v in values)):
+        raise InvalidCursor("Cursor does not match this listing")
+    return values
+
+class Keyset:
+    """
+    Sort specification for a keyset-paginated query.
+
+    Each key is (sql expression, 'asc' | 'desc'); the last key must be
+    unique (normally the primary key) so the order is total. Nullable
+    columns should be wrapped in COALESCE so comparisons stay defined.
+    """
+
+    def __init__(self, *keys):
+        self.keys = [(expr, direction.lower()) for expr, direction in keys]
+
+    def select_sql(self):
+        """Extra SELECT columns exposing the key values of each row."""
+        return ', '.join(f"{expr} AS _k{i}" for i, (expr, _) in enumerate(self.keys))
+
+    def order_sql(self):
+        return 'ORDER BY ' + ', '.join(f"{expr} {direction.upper()}" for expr, direction in self.keys)
+
+    def after_sql(self, values):
+        """
+        Condition selecting rows that sort after the given key values.
+        Uniform directions use a row-value comparison, which SQLite turns
+        into an index seek. Mixed directions add a bound on the leading
+        key so the scan still starts at the cursor position.
+        """
+        directions = {direction for _, direction in self.keys}
+        exprs = [expr for expr, _ in self.keys]
+
+        if len(directions) == 1:
+            op = '>' if directions == {'asc'} else '<'
+            placeholders = ', '.join('?' * len(exprs))
+            return f"({', '.join(exprs)}) {op} ({placeholders})", list(values)
+
+        clauses = []
+        params = []
+        for i, (expr, direction) in enumerate(self.keys):
+            op = '>' if direction == 'asc' else '<'
+            terms = [f"{exprs[j]} = ?" for j in range(i)] + [f"{expr} {op} ?"]
+            clauses.append('(' + ' AND '.join(terms) + ')')
+            params.extend(values[:i + 1])
+
+        lead_expr, lead_direction = self.keys[0]
+        lead_op = '>=' if lead_direction == 'asc' else '<='
+        return (f"{lead_expr} {lead_op} ? AND ({' OR '.join(clauses)})",
+                [values[0]] + params)
+
+def page_args(default_size=DEFAULT_PAGE_SIZE):
+    """Read (cursor, limit) from the query string."""
+    limit = request.args.get('limit', default_size, type=int)
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
+    return request.args.get('cursor') or None, limit
+
+def where_sql(where):
+    """AND together condition strings into a WHERE clause ('' if none)."""
+    if not where:
+        return ''
+    return 'WHERE ' + ' AND '.join(f"({w})" for w in where)
+
+def paginate(db, select, where, params, keyset, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Fetch one page of a keyset-paginated query.
+
+    Args:
+        select: "SELECT ... FROM ... [JOIN ...]" without WHERE/ORDER BY
+        where: list of AND-ed condition strings (may be empty)
+        params: parameters for the where conditions
+        keyset: Keyset describing the sort order
+        cursor: token from a previous page, or None for the first page
+        limit: page size
+
+    Returns:
+        (rows as dicts, next cursor token or None)
+    """
+    where = list(where)
+    params = list(params)
+
+    if cursor:
+        values = decode_cursor(cursor, len(keyset.keys))
+        condition, cursor_params = keyset.after_sql(values)
+        where.append(condition)
+        params.extend(cursor_params)
+
+    query = _SELECT.sub(f"SELECT {keyset.select_sql()}, ", select, count=1)
+    query += f" {where_sql(where)} {keyset.order_sql()} LIMIT ?"
+    params.append(limit + 1)
+
+    rows = [dict(r) for r in db.execute(query, params).fetchall()]
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = encode_cursor([last[f"_k{i}"] for i in range(len(keyset.keys))])
+
+    for row in rows:
+        for i in range(len(keyset.keys)):
+            row.pop(f"_k{i}", None)
+
+    return rows, next_cursor
+
+def approximate_count(db, table):
+    """
+    Cheap row-count estimate for a table.
+    Uses ANALYZE statistics when available, otherwise the highest rowid.
+    """
+    # The first number of every sqlite_stat1 entry is the table row count
+    stat = db.execute(
+        "SELECT stat FROM sqlite_stat1 WHERE tbl = ? LIMIT 1",
+        (table,)
+    ).fetchone() if _has_stats(db) else None
+    if stat and stat['stat']:
+        return int(stat['stat'].split()[0])
+
+    row = db.execute(f"SELECT MAX(rowid) AS n FROM {table}").fetchone()
+    return row['n'] or 0
+
+def _has_stats(db):
+    return db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+    ).fetchone() is not None
+
+def next_page_url(next_cursor):
+    """URL of the next page for the current request, or None."""
+    if not next_cursor:
+        return None
+    args = request.args.to_dict()
+    args['cursor'] = next_cursor
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+def set_page_headers(response, next_cursor, total=None):
+    """
+    Advertise pagination on a JSON list response without changing its body:
+    a Link rel="next" header plus X-Next-Cursor (and an optional estimate).
+    """
+    if next_cursor:
+        response.headers['Link'] = f'<{next_page_url(next_cursor)}>; rel="next"'
+        response.headers['X-Next-Cursor'] = next_cursor
+    if total is not None:
+        response.headers['X-Total-Count-Approx'] = str(total)
+    return response
+
+def first_page_url():
+    """URL of the first page for the current request (cursor removed)."""
+    args = request.args.to_dict()
+    args.pop('cursor', None)
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+def init_pagination(app):
+    """Expose pagination helpers to templates and reject bad cursors with 400."""
+    app.jinja_env.globals.update(next_page_url=next_page_url, first_page_url=first_page_url)
+
+    @app.errorhandler(InvalidCursor)
+    def invalid_cursor(error):
+        return {'error': str(error)}, 400
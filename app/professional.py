@@ -4,9 +4,18 @@ Handles deposits, regulations, claims, and exploration data
 """
 
 from flask import render_template, request, jsonify, redirect, session
-from app.db import get_db
+from app.db import get_db, execute_write
 from app.roles import require_geologist, require_explorer, is_geologist, is_explorer, is_admin, has_permission
 from app.helpers import login_required
+from app.pagination import Keyset, page_args, paginate, where_sql
+
+# Listing orders; each has a matching expression index (migration 5)
+DEPOSITS_KEYSET = Keyset(("COALESCE(d.status, '')", 'desc'),
+                         ("COALESCE(d.discovery_year, -1)", 'desc'),
+                         ("d.id", 'desc'))
+CLAIMS_KEYSET = Keyset(("COALESCE(c.issue_date, '')", 'desc'), ("c.id", 'desc'))
+SITES_KEYSET = Keyset(("COALESCE(e.exploration_status, '')", 'desc'), ("e.id", 'desc'))
+REPORTS_KEYSET = Keyset(("COALESCE(r.report_date, '')", 'desc'), ("r.id", 'desc'))
 
 def professional_routes(app):
     
@@ -23,12 +32,9 @@ def professional_routes(app):
         # Get all states with statistics
         states = db.execute("""
             SELECT s.*, 
-                   COUNT(DISTINCT e.id) as site_count,
-                   COUNT(DISTINCT d.id) as deposit_count
+                   (SELECT COUNT(*) FROM ss_exploration_sites e WHERE e.state_id = s.id) as site_count,
+                   (SELECT COUNT(*) FROM deposits d WHERE d.state_id = s.id) as deposit_count
             FROM ss_states s
-            LEFT JOIN ss_exploration_sites e ON s.id = e.state_id
-            LEFT JOIN deposits d ON e.deposit_id = d.id
-            GROUP BY s.id
             ORDER BY s.name
         """).fetchall()
         states = [dict(s) for s in states]
@@ -69,9 +75,9 @@ def professional_routes(app):
             FROM deposits d
             JOIN mineral_types mt ON d.mineral_type_id = mt.id
             JOIN ore_types ot ON d.ore_type_id = ot.id
-            WHERE d.region = ?
+            WHERE d.state_id = ?
             ORDER BY d.status DESC
-        """, (state_name,)).fetchall()
+        """, (state['id'],)).fetchall()
         deposits = [dict(d) for d in deposits]
         
         # Get exploration sites
@@ -107,38 +113,47 @@ def professional_routes(app):
         country_filter = request.args.get('country', '')
         status_filter = request.args.get('status', '')
         
-        # Base query
-        query = """
-            SELECT d.*, mt.name as mineral_name, mt.category as mineral_category,
-                   ot.name as ore_name
-            FROM deposits d
-            JOIN mineral_types mt ON d.mineral_type_id = mt.id
-            JOIN ore_types ot ON d.ore_type_id = ot.id
-            WHERE 1=1
-        """
+        where = []
         params = []
         
         # Add filters
         if search:
-            query += " AND (d.name LIKE ? OR d.location_name LIKE ?)"
+            where.append("d.name LIKE ? OR d.location_name LIKE ?")
             params.extend([f'%{search}%', f'%{search}%'])
         
         if mineral_filter:
-            query += " AND mt.id = ?"
+            where.append("mt.id = ?")
             params.append(int(mineral_filter))
         
         if country_filter:
-            query += " AND d.country = ?"
+            where.append("d.country = ?")
             params.append(country_filter)
         
         if status_filter:
-            query += " AND d.status = ?"
+            where.append("d.status = ?")
             params.append(status_filter)
         
-        query += " ORDER BY d.status DESC, d.discovery_year DESC"
-        
-        deposits = db.execute(query, params).fetchall()
-        deposits = [dict(d) for d in deposits]
+        cursor, limit = page_args()
+        deposits, next_cursor = paginate(db, """
+            SELECT d.*, mt.name as mineral_name, mt.category as mineral_category,
+                   ot.name as ore_name
+            FROM deposits d
+            JOIN mineral_types mt ON d.mineral_type_id = mt.id
+            JOIN ore_types ot ON d.ore_type_id = ot.id
+        """, where, params, DEPOSITS_KEYSET, cursor, limit)
+        
+        # Summary cards cover every matching deposit, not just this page
+        stats = db.execute(f"""
+            SELECT COUNT(*) as total,
+                   SUM(CASE WHEN d.status = 'active' THEN 1 ELSE 0 END) as active,
+                   COALESCE(SUM(d.estimated_reserves_tonnes), 0) as total_reserves,
+                   COUNT(DISTINCT d.country) as countries,
+                   COALESCE(AVG(d.average_grade), 0) as avg_grade
+            FROM deposits d
+            JOIN mineral_types mt ON d.mineral_type_id = mt.id
+            JOIN ore_types ot ON d.ore_type_id = ot.id
+            {where_sql(where)}
+        """, params).fetchone()
         
         # Get filter options
         minerals = db.execute("SELECT id, name FROM mineral_types ORDER BY name").fetchall()
@@ -148,6 +163,8 @@ def professional_routes(app):
         
         return render_template("deposits.html",
                              deposits=deposits,
+                             stats=dict(stats),
+                             next_cursor=next_cursor,
                              minerals=minerals,
                              countries=countries,
                              search=search)
@@ -253,28 +270,25 @@ def professional_routes(app):
         search = request.args.get('q', '')
         status_filter = request.args.get('status', '')
         
-        # Base query
-        query = """
-            SELECT c.*, d.name as deposit_name FROM mining_claims c
-            LEFT JOIN deposits d ON c.deposit_id = d.id
-            WHERE 1=1
-        """
+        where = []
         params = []
         
         if search:
-            query += " AND (c.claim_id LIKE ? OR c.company_name LIKE ?)"
+            where.append("c.claim_id LIKE ? OR c.company_name LIKE ?")
             params.extend([f'%{search}%', f'%{search}%'])
         
         if status_filter:
-            query += " AND c.status = ?"
+            where.append("c.status = ?")
             params.append(status_filter)
         
-        query += " ORDER BY c.issue_date DESC"
-        
-        claims = db.execute(query, params).fetchall()
-        claims = [dict(c) for c in claims]
+        cursor, limit = page_args()
+        claims, next_cursor = paginate(db, """
+            SELECT c.*, d.name as deposit_name FROM mining_claims c
+            LEFT JOIN deposits d ON c.deposit_id = d.id
+        """, where, params, CLAIMS_KEYSET, cursor, limit)
         
-        return render_template("claims.html", claims=claims, search=search)
+        return render_template("claims.html", claims=claims, search=search,
+                             next_cursor=next_cursor)
     
     @app.route("/claims/<claim_id>")
     def claim_detail(claim_id):
@@ -304,10 +318,8 @@ def professional_routes(app):
     def add_claim():
         """Add new mining claim (explorer only)"""
         if request.method == "POST":
-            db = get_db()
-            
             try:
-                db.execute("""
+                execute_write("""
                     INSERT INTO mining_claims
                     (claim_id, deposit_id, owner_id, company_name, location_description,
                      area_hectares, claim_type, issue_date, expiry_date, status, latitude, longitude)
@@ -326,7 +338,6 @@ def professional_routes(app):
                     float(request.form.get('latitude', 0)),
                     float(request.form.get('longitude', 0))
                 ))
-                db.commit()
                 
                 return redirect(f"/claims/{request.form.get('claim_id')}")
             except Exception as e:
@@ -354,25 +365,22 @@ def professional_routes(app):
         state_filter = request.args.get('state', '')
         accessibility_filter = request.args.get('accessibility', '')
         
-        query = """
-            SELECT e.*, s.name as state_name FROM ss_exploration_sites e
-            JOIN ss_states s ON e.state_id = s.id
-            WHERE 1=1
-        """
+        where = []
         params = []
         
         if state_filter:
-            query += " AND s.id = ?"
+            where.append("s.id = ?")
             params.append(int(state_filter))
         
         if accessibility_filter:
-            query += " AND e.accessibility = ?"
+            where.append("e.accessibility = ?")
             params.append(accessibility_filter)
         
-        query += " ORDER BY e.exploration_status DESC"
-        
-        sites = db.execute(query, params).fetchall()
-        sites = [dict(s) for s in sites]
+        cursor, limit = page_args()
+        sites, next_cursor = paginate(db, """
+            SELECT e.*, s.name as state_name FROM ss_exploration_sites e
+            JOIN ss_states s ON e.state_id = s.id
+        """, where, params, SITES_KEYSET, cursor, limit)
         
         # Get state options
         states = db.execute(
@@ -380,7 +388,8 @@ def professional_routes(app):
         ).fetchall()
         states = [dict(s) for s in states]
         
-        return render_template("exploration_sites.html", sites=sites, states=states)
+        return render_template("exploration_sites.html", sites=sites, states=states,
+                             next_cursor=next_cursor)
     
     # ============================================================
     # GEOLOGICAL REPORTS
@@ -391,33 +400,22 @@ def professional_routes(app):
         """Browse geological reports"""
         db = get_db()
         
-        query = """
-            SELECT r.*, d.name as deposit_name FROM geological_reports r
-            LEFT JOIN deposits d ON r.deposit_id = d.id
-            WHERE r.access_level IN ('public', 'restricted')
-            ORDER BY r.report_date DESC
-        """
-        
         if session.get('user_id'):
             # Logged-in users can see private reports they authored
-            query = """
-                SELECT r.*, d.name as deposit_name FROM geological_reports r
-                LEFT JOIN deposits d ON r.deposit_id = d.id
-                WHERE r.access_level IN ('public', 'restricted') 
-                   OR (r.access_level = 'private' AND r.author_id = ?)
-                ORDER BY r.report_date DESC
-            """
-            reports = db.execute(query, (session['user_id'],)).fetchall()
+            where = ["r.access_level IN ('public', 'restricted') "
+                     "OR (r.access_level = 'private' AND r.author_id = ?)"]
+            params = [session['user_id']]
         else:
-            reports = db.execute("""
-                SELECT r.*, d.name as deposit_name FROM geological_reports r
-                LEFT JOIN deposits d ON r.deposit_id = d.id
-                WHERE r.access_level = 'public'
-                ORDER BY r.report_date DESC
-            """).fetchall()
-        reports = [dict(r) for r in reports]
+            where = ["r.access_level = 'public'"]
+            params = []
+        
+        cursor, limit = page_args()
+        reports, next_cursor = paginate(db, """
+            SELECT r.*, d.name as deposit_name FROM geological_reports r
+            LEFT JOIN deposits d ON r.deposit_id = d.id
+        """, where, params, REPORTS_KEYSET, cursor, limit)
         
-        return render_template("reports.html", reports=reports)
+        return render_template("reports.html", reports=reports, next_cursor=next_cursor)
     
     print("✓ Professional geology routes registered")
 
@@ -3,8 +3,9 @@ Role-Based Access Control System
 Defines user roles and permissions for the professional geology app
 """
 
+from collections import namedtuple
 from functools import wraps
-from flask import session, redirect, abort, jsonify
+from flask import g, session, redirect, abort, jsonify
 from app.db import get_db
 
 # ============================================================
@@ -88,18 +89,50 @@ ROLES = {
 # UTILITY FUNCTIONS
 # ============================================================
 
-def get_user_role():
-    """Get current user's role from session"""
-    if 'user_id' not in session:
-        return 'viewer'  # Default anonymous role
+# Compact view of the logged-in user, loaded once per request
+Identity = namedtuple('Identity', 'id username role is_admin organization expertise')
+
+ANONYMOUS = Identity(None, None, 'viewer', False, None, None)
+
+def current_identity():
+    """
+    Get the current user's identity.
+    The users row is read once per request and cached on g, so the
+    decorators, context processors and template helpers share one query.
+    """
+    user_id = session.get('user_id')
+    identity = g.get('identity')
+    if identity is not None and identity.id == user_id:
+        return identity
     
-    db = get_db()
-    user = db.execute(
-        "SELECT role FROM users WHERE id = ?",
-        (session['user_id'],)
-    ).fetchone()
+    if user_id is None:
+        identity = ANONYMOUS
+    else:
+        db = get_db()
+        user = db.execute(
+            "SELECT id, username, role, is_admin, organization, expertise FROM users WHERE id = ?",
+            (user_id,)
+        ).fetchone()
+        
+        if user:
+            identity = Identity(
+                id=user['id'],
+                username=user['username'],
+                role=user['role'] or 'viewer',
+                is_admin=user['is_admin'] == 1,
+                organization=user['organization'],
+                expertise=user['expertise']
+            )
+        else:
+            # Stale session for a deleted user: treat as anonymous viewer
+            identity = ANONYMOUS._replace(id=user_id)
     
-    return user['role'] if user and user['role'] else 'viewer'
+    g.identity = identity
+    return identity
+
+def get_user_role():
+    """Get current user's role from session"""
+    return current_identity().role
 
 def has_permission(permission):
     """Check if current user has a specific permission"""
@@ -118,16 +151,17 @@ def has_permission(permission):
 
 def get_user_data():
     """Get current user's full data"""
-    if 'user_id' not in session:
+    identity = current_identity()
+    if identity.username is None:
         return None
     
-    db = get_db()
-    user = db.execute(
-        "SELECT id, username, role, organization, expertise FROM users WHERE id = ?",
-        (session['user_id'],)
-    ).fetchone()
-    
-    return dict(user) if user else None
+    return {
+        'id': identity.id,
+        'username': identity.username,
+        'role': identity.role,
+        'organization': identity.organization,
+        'expertise': identity.expertise
+    }
 
 def is_geologist():
     """Check if user is a geologist"""
@@ -8,6 +8,14 @@ from app.mapping import mapping_routes
 from app.geospatial import geospatial_routes
 from app.deposits import deposit_routes
 from app.learning import learning_routes
+from app.search import search_routes
+from app.clustering import clustering_routes
+from app.tiles import tile_routes
+from app.nearby import nearby_routes
+from app.states import state_routes
+from app.heatmap import heatmap_routes
+from app.export import export_routes
+from app.import_jobs import import_job_routes
 
 def register_routes(app):
     auth_routes(app)
@@ -20,3 +28,11 @@ def register_routes(app):
     geospatial_routes(app)
     deposit_routes(app)
     learning_routes(app)
+    search_routes(app)
+    clustering_routes(app)
+    tile_routes(app)
+    nearby_routes(app)
+    state_routes(app)
+    heatmap_routes(app)
+    export_routes(app)
+    import_job_routes(app)
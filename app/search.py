@@ -0,0 +1,266 @@
+"""
+Full-Text Search
+FTS5 query building and ranked search helpers
+"""
+
+import re
+from flask import jsonify, request
+from markupsafe import Markup, escape
+from app.db import get_db
+from app.helpers import login_required
+
+# Private-use markers wrapped around matches by snippet(); replaced with
+# <mark> only after the surrounding text has been HTML-escaped
+_MATCH_START = '\x02'
+_MATCH_END = '\x03'
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+# bm25 column weights for minerals_fts: name, formula, properties, uses, countries
+MINERAL_WEIGHTS = (10.0, 5.0, 1.0, 1.0, 2.0)
+MINERAL_RANK = f"bm25(minerals_fts, {', '.join(str(w) for w in MINERAL_WEIGHTS)})"
+
+def fts_query(text, column=None, prefix=True):
+    """
+    Turn free user input into a safe FTS5 MATCH expression.
+    Every word becomes a quoted phrase (so FTS5 operators in the input
+    are treated as text), optionally prefix-matched, and all words must
+    match. Returns None if the input has no searchable words.
+    """
+    if not text:
+        return None
+    
+    tokens = _TOKEN.findall(text)
+    if not tokens:
+        return None
+    
+    suffix = '*' if prefix else ''
+    terms = ' '.join(f'"{token}"{suffix}' for token in tokens)
+    
+    if column:
+        return f'{column} : ({terms})'
+    return terms
+
+def highlight(snippet):
+    """Escape a snippet() result and turn its match markers into <mark> tags."""
+    if not snippet:
+        return None
+    
+    text = str(escape(snippet))
+    text = text.replace(_MATCH_START, '<mark>').replace(_MATCH_END, '</mark>')
+    return Markup(text)
+
+def search_minerals(db, match, limit=None, offset=0):
+    """
+    BM25-ranked mineral search.
+    Returns mineral dicts with a highlighted 'snippet' for the best column.
+    """
+    query = f"""
+        SELECT m.*, {MINERAL_RANK} AS rank,
+               snippet(minerals_fts, -1, '{_MATCH_START}', '{_MATCH_END}', '…', 16) AS snippet
+        FROM minerals_fts
+        JOIN minerals m ON m.id = minerals_fts.rowid
+        WHERE minerals_fts MATCH ?
+        ORDER BY rank
+    """
+    params = [match]
+    
+    if limit is not None:
+        query += " LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+    
+    results = []
+    for row in db.execute(query, params).fetchall():
+        result = dict(row)
+        result['snippet'] = highlight(result['snippet'])
+        results.append(result)
+    return results
+
+def count_minerals(db, match):
+    """Number of minerals matching an FTS5 expression."""
+    return db.execute(
+        "SELECT COUNT(*) AS cnt FROM minerals_fts WHERE minerals_fts MATCH ?",
+        (match,)
+    ).fetchone()['cnt']
+
+# ============================================================
+# UNIFIED SEARCH INDEX
+# ============================================================
+# One FTS5 table spans every searchable entity. Rowids are derived from
+# (entity id, type code) so triggers can update a single entry by rowid.
+
+SEARCH_TYPE_BITS = 3
+
+# Entity types in the index (see migrations.SEARCH_SOURCES_V4); ?type= filters by them
+SEARCH_TYPES = ('mineral', 'deposit', 'claim', 'lesson', 'regulation')
+
+# bm25 column weights for minerals_fts: name, formula, properties, uses, countries
+MINERAL_WEIGHTS = (10.0, 5.0, 1.0, 1.0, 2.0)
+MINERAL_RANK = f"bm25(minerals_fts, {', '.join(str(w) for w in MINERAL_WEIGHTS)})"
+
+def fts_query(text, column=None, prefix=True):
+    """
+    Turn free user input into a safe FTS5 MATCH expression.
+    Every word becomes a quoted phrase (so FTS5 operators in the input
+    are treated as text), optionally prefix-matched, and all words must
+    match. Returns None if the input has no searchable words.
+    """
+    if not text:
+        return None
+    
+    tokens = _TOKEN.findall(text)
+    if not tokens:
+        return None
+    
+    suffix = '*' if prefix else ''
+    terms = ' '.join(f'"{token}"{suffix}' for token in tokens)
+    
+    if column:
+        return f'{column} : ({terms})'
+    return terms
+
+def highlight(snippet):
+    """Escape a snippet() result and turn its match markers into <mark> tags."""
+    if not snippet:
+        return None
+    
+    text = str(escape(snippet))
+    text = text.replace(_MATCH_START, '<mark>').replace(_MATCH_END, '</mark>')
+    return Markup(text)
+
+def search_minerals(db, match, limit=None, offset=0):
+    """
+    BM25-ranked mineral search.
+    Returns mineral dicts with a highlighted 'snippet' for the best column.
+    """
+    query = f"""
+        SELECT m.*, {MINERAL_RANK} AS rank,
+               snippet(minerals_fts, -1, '{_MATCH_START}', '{_MATCH_END}', '…', 16) AS snippet
+        FROM minerals_fts
+        JOIN minerals m ON m.id = minerals_fts.rowid
+        WHERE minerals_fts MATCH ?
+        ORDER BY rank
+    """
+    params = [match]
+    
+    if limit is not None:
+        query += " LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+    
+    results = []
+    for row in db.execute(query, params).fetchall():
+        result = dict(row)
+        result['snippet'] = highlight(result['snippet'])
+        results.append(result)
+    return results
+
+def count_minerals(db, match):
+    """Number of minerals matching an FTS5 expression."""
+    return db.execute(
+        "SELECT COUNT(*) AS cnt FROM minerals_fts WHERE minerals_fts MATCH ?",
+        (match,)
+    ).fetchone()['cnt']
+
+# ============================================================
+# UNIFIED SEARCH INDEX
+# ============================================================
+# One FTS5 table spans every searchable entity. Rowids are derived from
+# (entity id, type code) so triggers can update a single entry by rowid.
+
+SEARCH_TYPE_BITS = 3
+
+# type: (code, table, title expression, body expression, url expression)
+SEARCH_SOURCES = {
+    'mineral': (1, 'minerals',
+                "{r}.name",
+                "coalesce({r}.formula, '') || ' ' || coalesce({r}.properties, '') || ' ' || "
+                "coalesce({r}.uses, '') || ' ' || coalesce({r}.countries, '')",
+                "'/mineral/' || {r}.id"),
+    'deposit': (2, 'deposits',
+                "{r}.name",
+                "coalesce({r}.location_name, '') || ' ' || coalesce({r}.region, '') || ' ' || "
+                "coalesce({r}.country, '') || ' ' || coalesce({r}.status, '') || ' ' || coalesce({r}.notes, '')",
+                "'/deposits/' || {r}.id"),
+    'claim': (3, 'mining_claims',
+              "{r}.claim_id || ' ' || coalesce({r}.company_name, '')",
+              "coalesce({r}.location_description, '') || ' ' || coalesce({r}.claim_type, '') || ' ' || "
+              "coalesce({r}.status, '')",
+              "'/claims/' || {r}.claim_id"),
+    'lesson': (4, 'learning_content',
+               "{r}.title",
+               "coalesce({r}.category, '') || ' ' || coalesce({r}.summary, '') || ' ' || coalesce({r}.content, '')",
+               "'/learn/' || {r}.id"),
+    'regulation': (5, 'ss_regulations',
+                   "{r}.title",
+                   "coalesce({r}.description, '') || ' ' || coalesce({r}.requirements, '') || ' ' || "
+                   "coalesce({r}.applicable_states, '')",
+                   "'/regulations/' || {r}.id"),
+}
+
+# bm25 column weights for search_index: title, body
+SEARCH_WEIGHTS = (5.0, 1.0)
+
+def search_all(db, match, types=None, limit=20, offset=0):
+    """
+    Ranked search across every entity type in one query.
+    Returns (hits, total) where each hit has type, id, title, snippet, url.
+    """
+    weights = ', '.join(str(w) for w in SEARCH_WEIGHTS)
+    where = "search_index MATCH :match"
+    params = {'match': match, 'limit': limit, 'offset': offset}
+    
+    if types:
+        names = [f":type{i}" for i in range(len(types))]
+        where += f" AND type IN ({', '.join(names)})"
+        params.update({name[1:]: t for name, t in zip(names, types)})
+    
+    # FTS5 auxiliary functions cannot be combined with window functions,
+    # so the total comes from an uncorrelated scalar subquery instead
+    query = f"""
+        SELECT rowid, type, title, url, bm25(search_index, {weights}) AS rank,
+               snippet(search_index, 1, '{_MATCH_START}', '{_MATCH_END}', '…', 16) AS snippet,
+               (SELECT COUNT(*) FROM search_index WHERE {where}) AS total
+        FROM search_index
+        WHERE {where}
+        ORDER BY rank
+        LIMIT :limit OFFSET :offset
+    """
+    
+    rows = db.execute(query, params).fetchall()
+    hits = [{
+        'type': row['type'],
+        'id': row['rowid'] >> SEARCH_TYPE_BITS,
+        'title': row['title'],
+        'snippet': str(highlight(row['snippet']) or ''),
+        'url': row['url'],
+        'score': -row['rank'],
+    } for row in rows]
+    total = rows[0]['total'] if rows else 0
+    return hits, total
+
+def search_routes(app):
+    """Register the unified search API"""
+    
+    @app.route("/api/search")
+    @login_required
+    def api_search():
+        """Ranked, paginated search over minerals, deposits, claims, lessons and regulations"""
+        q = request.args.get('q', '')
+        types = [t for t in request.args.get('type', '').split(',') if t in SEARCH_TYPES]
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+        
+        match = fts_query(q)
+        if not match:
+            return jsonify({'error': 'Query must contain at least one word'}), 400
+        
+        hits, total = search_all(get_db(), match, types, per_page, (page - 1) * per_page)
+        
+        return jsonify({
+            'query': q,
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+            'pages': (total + per_page - 1) // per_page,
+            'results': hits
+        })
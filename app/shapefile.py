@@ -0,0 +1,267 @@
+"""
+Shapefile Reader
+Streams the features of an ESRI Shapefile out of an uploaded zip without
+extracting it: the .shp geometry records and the .dbf attribute records
+are read in lockstep from their (decompressing) zip members, one record
+at a time. A bare .shp is read the same way, without attributes.
+
+Features are yielded as GeoJSON-like dicts, so the QGIS importer parses
+them exactly like GeoJSON features. Points and polygons are decoded
+(Z/M values are dropped); other shape types yield no geometry.
+"""
+
+import codecs
+import re
+import struct
+import zipfile
+from app.geometry import locate, OUTSIDE
+
+SHP_HEADER_SIZE = 100
+SHP_FILE_CODE = 9994
+NO_DATA = -1e38  # values below this are "no data" in shapefiles
+
+POINT_TYPES = {1, 11, 21}        # Point, PointZ, PointM
+POLYGON_TYPES = {5, 15, 25}      # Polygon, PolygonZ, PolygonM
+
+# Normalised DATUM names of WGS 84 (ESRI "D_WGS_1984", OGC "WGS_1984", WKT2)
+WGS84_DATUMS = ('DWGS1984', 'WGS1984', 'WORLDGEODETICSYSTEM1984')
+
+class InvalidShapefile(ValueError):
+    """The upload is not a readable shapefile."""
+
+def _read(stream, size, what):
+    data = stream.read(size)
+    if len(data) != size:
+        raise InvalidShapefile(f"Truncated {what}")
+    return data
+
+# ============================================================
+# GEOMETRY (.shp)
+# ============================================================
+
+def _signed_area(ring):
+    return sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1])) / 2
+
+def _polygon_geometry(rings):
+    """
+    GeoJSON geometry of shapefile rings: clockwise rings are exteriors,
+    counter-clockwise rings holes of the exterior containing them.
+    """
+    polygons, holes = [], []
+    for ring in rings:
+        if _signed_area(ring) < 0:
+            polygons.append([ring])
+        else:
+            holes.append(ring)
+    if not polygons:
+        # Some writers ignore the winding rule; treat every ring as an exterior
+        polygons, holes = [[ring] for ring in rings], []
+
+    for hole in holes:
+        for polygon in polygons:
+            if locate(hole[0], polygon[:1]) != OUTSIDE:
+                polygon.append(hole)
+                break
+        else:
+            polygons.append([hole])
+
+    if len(polygons) == 1:
+        return {'type': 'Polygon', 'coordinates': polygons[0]}
+    return {'type': 'MultiPolygon', 'coordinates': polygons}
+
+def shape_geometry(content):
+    """GeoJSON geometry of one .shp record's content, or None."""
+    shape_type, = struct.unpack_from('<i', content)
+    if shape_type in POINT_TYPES:
+        x, y = struct.unpack_from('<2d', content, 4)
+        if x < NO_DATA or y < NO_DATA:
+            return None
+        return {'type': 'Point', 'coordinates': [x, y]}
+
+    if shape_type in POLYGON_TYPES:
+        num_parts, num_points = struct.unpack_from('<2i', content, 36)
+        if not num_parts or not num_points:
+            return None
+        parts = struct.unpack_from(f'<{num_parts}i', content, 44) + (num_points,)
+        coords = struct.unpack_from(f'<{2 * num_points}d', content, 44 + 4 * num_parts)
+        points = list(zip(coords[0::2], coords[1::2]))
+        rings = [points[start:end] for start, end in zip(parts, parts[1:]) if end - start >= 3]
+        return _polygon_geometry(rings) if rings else None
+
+    # Null shapes, lines and multipoints carry no importable geometry
+    return None
+
+def shp_records(stream):
+    """Yield the geometry (or None) of each record of a .shp stream."""
+    header = _read(stream, SHP_HEADER_SIZE, ".shp header")
+    if struct.unpack_from('>i', header)[0] != SHP_FILE_CODE:
+        raise InvalidShapefile("Not a .shp file")
+
+    while True:
+        record_header = stream.read(8)
+        if not record_header:
+            return
+        if len(record_header) != 8:
+            raise InvalidShapefile("Truncated .shp record")
+        _, words = struct.unpack('>2i', record_header)
+        content = _read(stream, 2 * words, ".shp record")
+        try:
+            yield shape_geometry(content) if content else None
+        except struct.error:
+            raise InvalidShapefile("Malformed .shp record")
+
+# ============================================================
+# ATTRIBUTES (.dbf)
+# ============================================================
+
+def _field_decoder(field_type, decimals, encoding):
+    """Function turning the raw bytes of a .dbf field into a value."""
+    if field_type in b'NF':
+        def number(raw):
+            text = raw.strip(b' \0*')
+            if not text:
+                return None
+            try:
+                return int(text) if decimals == 0 and b'.' not in text else float(text)
+            except ValueError:
+                return None
+        return number
+
+    if field_type == b'L':
+        return lambda raw: {b'Y': True, b'T': True, b'N': False, b'F': False}.get(raw.strip().upper()[:1])
+
+    if field_type == b'D':
+        def date(raw):
+            text = raw.strip().decode('ascii', 'replace')
+            return f"{text[:4]}-{text[4:6]}-{text[6:]}" if len(text) == 8 and text.isdigit() else None
+        return date
+
+    return lambda raw: raw.rstrip(b' \0').decode(encoding, 'replace').strip()
+
+def dbf_records(stream, encoding='utf-8'):
+    """Yield (deleted, properties) for each record of a .dbf stream."""
+    header = _read(stream, 32, ".dbf header")
+    count, header_length, record_length = struct.unpack_from('<IHH', header, 4)
+
+    fields = []
+    offset = 1  # the deletion flag comes first
+    descriptors = _read(stream, header_length - 32, ".dbf header")
+    for start in range(0, len(descriptors) - 31, 32):
+        descriptor = descriptors[start:start + 32]
+        if descriptor[:1] == b'\r':
+            break
+        name = descriptor[:11].split(b'\0', 1)[0].decode('latin-1').strip()
+        length, decimals = descriptor[16], descriptor[17]
+        fields.append((name, offset, offset + length, _field_decoder(descriptor[11:12], decimals, encoding)))
+        offset += length
+
+    for _ in range(count):
+        record = _read(stream, record_length, ".dbf record")
+        yield record[:1] == b'*', {name: decode(record[start:end]) for name, start, end, decode in fields}
+
+# ============================================================
+# SHAPEFILE
+# ============================================================
+
+def is_wgs84_prj(wkt):
+    """Whether .prj WKT describes geographic WGS 84 longitude/latitude."""
+    text = wkt.strip().upper()
+    if not text.startswith(('GEOGCS[', 'GEOGCRS[')):
+        return False
+    datum = re.search(r'DATUM\[\s*"([^"]*)"', text)
+    return datum is not None and re.sub(r'[^A-Z0-9]', '', datum.group(1)).startswith(WGS84_DATUMS)
+
+class _Counted:
+    """A stream that counts the bytes read from it."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def read(self, size):
+        data = self.stream.read(size)
+        self.count += len(data)
+        return data
+
+class ShapefileReader:
+    """
+    Features of a zipped shapefile (the first .shp in the archive with its
+    .dbf, and the .cpg encoding and .prj check if present) or of a bare .shp
+    file, read from a binary file. tell() estimates how far through the
+    file it is.
+    """
+
+    def __init__(self, f):
+        self.file = f
+        f.seek(0, 2)
+        self.size = f.tell()
+        f.seek(0)
+        self.archive = zipfile.ZipFile(f) if zipfile.is_zipfile(f) else None
+        f.seek(0)
+        self.shp = self.dbf = None
+
+    def _members(self):
+        """
+        (.shp info, .dbf info or None, encoding) of the archive. A .prj,
+        if present, must be WGS 84 since coordinates are not reprojected.
+        """
+        names = {info.filename.lower(): info for info in self.archive.infolist()
+                 if not info.filename.startswith('__MACOSX/')}
+        shp = next((info for name, info in names.items() if name.endswith('.shp')), None)
+        if shp is None:
+            raise InvalidShapefile("No .shp file found in the zip")
+        stem = shp.filename.lower()[:-4]
+        dbf = names.get(stem + '.dbf')
+
+        prj = names.get(stem + '.prj')
+        if prj is not None and not is_wgs84_prj(self.archive.read(prj).decode('utf-8-sig', 'replace')):
+            raise InvalidShapefile("The layer must use WGS 84 (EPSG:4326) coordinates")
+
+        encoding = 'utf-8'
+        cpg = names.get(stem + '.cpg')
+        if cpg is not None:
+            try:
+                encoding = codecs.lookup(self.archive.read(cpg).decode('ascii').strip()).name
+            except (LookupError, UnicodeDecodeError):
+                pass
+        return shp, dbf, encoding
+
+    def __iter__(self):
+        if self.archive is None:
+            self.shp = _Counted(self.file)
+            self._total = self.size
+            for geometry in shp_records(self.shp):
+                yield {'type': 'Feature', 'properties': {}, 'geometry': geometry}
+            return
+
+        shp_info, dbf_info, encoding = self._members()
+        self._total = shp_info.file_size + (dbf_info.file_size if dbf_info else 0)
+        with self.archive.open(shp_info) as shp_stream:
+            self.shp = _Counted(shp_stream)
+            if dbf_info is None:
+                for geometry in shp_records(self.shp):
+                    yield {'type': 'Feature', 'properties': {}, 'geometry': geometry}
+                return
+
+            with self.archive.open(dbf_info) as dbf_stream:
+                self.dbf = _Counted(dbf_stream)
+                attributes = dbf_records(self.dbf, encoding)
+                for geometry in shp_records(self.shp):
+                    deleted, properties = next(attributes, (False, {}))
+                    if deleted:
+                        continue
+                    yield {'type': 'Feature', 'properties': properties, 'geometry': geometry}
+
+    def tell(self):
+        """Position in the uploaded file, scaled from the members read so far."""
+        if self.shp is None or not self._total:
+            return 0
+        read = self.shp.count + (self.dbf.count if self.dbf else 0)
+        return min(self.size, self.size * read // self._total)
+
+def read_shapefile(f):
+    """Features of a zipped shapefile or .shp opened in binary mode."""
+    try:
+        return ShapefileReader(f)
+    except zipfile.BadZipFile:
+        raise InvalidShapefile("Corrupt zip file")
@@ -0,0 +1,121 @@
+"""
+Geometry Simplification Levels
+Claim polygons and state boundaries are simplified ahead of time for a
+few zoom levels (Douglas-Peucker at half a pixel, coordinates rounded to
+the precision the zoom can show) and stored in geometry_levels. Map APIs
+pick the level for the requested zoom instead of shipping full-resolution
+rings to every zoom.
+"""
+
+import json
+import math
+from app.geometry import parse_polygons, simplify_shape, to_geojson
+
+# Zoom levels with a stored simplification; above the last one the full
+# geometry is served (still quantised to the zoom)
+LEVEL_ZOOMS = (3, 6, 9, 12)
+TILE_SIZE = 256
+MAX_DIGITS = 7  # ~1 cm
+
+# layer: table holding the GeoJSON geometry column
+SIMPLIFY_LAYERS = {
+    'claims': 'mining_claims',
+    'states': 'ss_states',
+}
+
+# ============================================================
+# ZOOM → TOLERANCE
+# ============================================================
+
+def degrees_per_pixel(zoom):
+    return 360.0 / (TILE_SIZE << zoom)
+
+def zoom_digits(zoom):
+    """Decimal places that resolve half a pixel at a zoom."""
+    return min(MAX_DIGITS, max(0, math.ceil(-math.log10(degrees_per_pixel(zoom) / 2))))
+
+def level_for_zoom(zoom):
+    """Stored level serving a zoom: the first at or above it, or None for full detail."""
+    return next((level for level in LEVEL_ZOOMS if level >= zoom), None)
+
+def simplified(shape, zoom):
+    """Shape simplified and quantised for a zoom; None if it is sub-pixel."""
+    return simplify_shape(shape, degrees_per_pixel(zoom) / 2, zoom_digits(zoom))
+
+def quantized(shape, zoom):
+    """Shape rounded to a zoom's precision without dropping vertices."""
+    return simplify_shape(shape, 0.0, zoom_digits(zoom))
+
+# ============================================================
+# STORAGE
+# ============================================================
+
+def store_levels(conn, layer, ids=None):
+    """(Re)compute the stored levels of a layer's rows (all when ids is None)."""
+    table = SIMPLIFY_LAYERS[layer]
+    if ids is None:
+        rows = conn.execute(f"SELECT id, geometry FROM {table} WHERE geometry IS NOT NULL")
+    else:
+        rows = conn.execute(f"""
+            SELECT id, geometry FROM {table}
+            WHERE geometry IS NOT NULL AND id IN (SELECT value FROM json_each(?))
+        """, (json.dumps(list(ids)),))
+
+    levels = []
+    for row_id, geometry in rows.fetchall():
+        shape = parse_polygons(json.loads(geometry))
+        for zoom in LEVEL_ZOOMS:
+            level = simplified(shape, zoom)
+            levels.append((layer, row_id, zoom, _dumps(level)))
+
+    conn.executemany(
+        "INSERT OR REPLACE INTO geometry_levels (layer, id, zoom, geometry) VALUES (?, ?, ?, ?)",
+        levels
+    )
+    return len(levels)
+
+def _dumps(shape):
+    return json.dumps(to_geojson(shape), separators=(',', ':')) if shape else None
+
+# ============================================================
+# LOOKUP
+# ============================================================
+
+def geometries_for_zoom(db, layer, ids, zoom=None):
+    """
+    GeoJSON geometry dicts for rows of a layer at a zoom (full detail when
+    zoom is None). Rows without a polygon, or smaller than a pixel at the
+    zoom, are left out so callers fall back to the point.
+    """
+    if not ids:
+        return {}
+    table = SIMPLIFY_LAYERS[layer]
+    level = level_for_zoom(zoom) if zoom is not None else None
+    id_list = json.dumps(list(ids))
+
+    result = {}
+    stored = set()
+    if level is not None:
+        for row in db.execute("""
+            SELECT id, geometry FROM geometry_levels
+            WHERE layer = ? AND zoom = ? AND id IN (SELECT value FROM json_each(?))
+        """, (layer, level, id_list)):
+            stored.add(row[0])
+            if row[1]:
+                result[row[0]] = json.loads(row[1])
+
+    # Full detail, or levels not stored yet (e.g. rows edited outside the import paths)
+    missing = [i for i in ids if i not in stored]
+    if missing:
+        for row in db.execute(f"""
+            SELECT id, geometry FROM {table}
+            WHERE geometry IS NOT NULL AND id IN (SELECT value FROM json_each(?))
+        """, (json.dumps(missing),)):
+            if zoom is None:
+                result[row[0]] = json.loads(row[1])
+                continue
+            shape = parse_polygons(json.loads(row[1]))
+            shape = simplified(shape, level) if level is not None else quantized(shape, zoom)
+            if shape:
+                result[row[0]] = to_geojson(shape)
+    return result
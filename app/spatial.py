@@ -0,0 +1,155 @@
+"""
+Spatial Indexing
+SQLite R*Tree indexes over the map layers plus bounding-box and
+tile-grid helpers, so map APIs only return what is in the viewport.
+"""
+
+import hashlib
+import math
+from flask import request
+
+# Web Mercator latitude limit; tiles do not extend past it
+MAX_LATITUDE = 85.0511287798
+MAX_ZOOM = 22
+
+# ============================================================
+# R*TREE INDEXES
+# ============================================================
+# layer: (table, rtree table); app.migrations creates the R*Trees and their triggers
+
+SPATIAL_LAYERS = {
+    'deposits': ('deposits', 'deposits_rtree'),
+    'claims': ('mining_claims', 'mining_claims_rtree'),
+    'sites': ('ss_exploration_sites', 'exploration_sites_rtree'),
+    'states': ('ss_states', 'ss_states_rtree'),
+}
+
+# ============================================================
+# CHANGE LOG
+# ============================================================
+# Every insert, update or delete on a map layer appends a row to spatial_changes. The
+# highest seq of a layer is its version: caches derived from a layer
+# (clusters, tiles, ...) compare versions and replay newer changes.
+
+def layer_version(db, layer):
+    """Current version of a map layer (0 before its first change)."""
+    row = db.execute(
+        "SELECT MAX(seq) FROM spatial_changes WHERE layer = ?", (layer,)
+    ).fetchone()
+    return row[0] or 0
+
+def layers_etag(db, layers, key=''):
+    """
+    ETag for a response derived from map layers: it changes whenever one
+    of the layers does, and with the key (e.g. the query string).
+    """
+    versions = [(layer, layer_version(db, layer)) for layer in layers]
+    digest = hashlib.sha1(repr((versions, key)).encode('utf-8')).hexdigest()[:16]
+    return f"{'-'.join(layers)}-{digest}"
+
+# ============================================================
+# BOUNDING BOXES & TILE GRID
+# ============================================================
+
+def parse_bbox(value):
+    """
+    Parse "west,south,east,north" in degrees.
+    west > east describes a box crossing the antimeridian.
+    """
+    try:
+        west, south, east, north = (float(v) for v in value.split(','))
+    except ValueError:
+        raise ValueError("bbox must be four numbers: west,south,east,north")
+
+    if not all(math.isfinite(v) for v in (west, south, east, north)):
+        raise ValueError("bbox values must be finite")
+    if not (-180 <= west <= 180 and -180 <= east <= 180):
+        raise ValueError("bbox longitudes must be between -180 and 180")
+    if not (-90 <= south <= north <= 90):
+        raise ValueError("bbox latitudes must satisfy -90 <= south <= north <= 90")
+    return west, south, east, north
+
+def tile_x(lon, zoom):
+    n = 1 << zoom
+    return min(max(int((lon + 180.0) / 360.0 * n), 0), n - 1)
+
+def tile_y(lat, zoom):
+    n = 1 << zoom
+    lat = min(max(lat, -MAX_LATITUDE), MAX_LATITUDE)
+    rad = math.radians(lat)
+    y = (1.0 - math.log(math.tan(rad) + 1.0 / math.cos(rad)) / math.pi) / 2.0 * n
+    return min(max(int(y), 0), n - 1)
+
+def tile_bounds(x, y, zoom):
+    """(west, south, east, north) of a Web Mercator tile."""
+    n = 1 << zoom
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y)
+
+def snap_bbox(bbox, zoom):
+    """
+    Expand a bbox outward to whole tiles at the given zoom, so nearby
+    viewports produce identical (cacheable) queries.
+    """
+    west, south, east, north = bbox
+    snapped_west = tile_bounds(tile_x(west, zoom), 0, zoom)[0]
+    snapped_east = tile_bounds(tile_x(east, zoom), 0, zoom)[2]
+    # Tiles stop at the Mercator limit; keep polar edges as requested
+    snapped_north = tile_bounds(0, tile_y(north, zoom), zoom)[3] if north < MAX_LATITUDE else north
+    snapped_south = tile_bounds(0, tile_y(south, zoom), zoom)[1] if south > -MAX_LATITUDE else south
+    return snapped_west, snapped_south, snapped_east, snapped_north
+
+def bbox_condition(layer, alias, bbox):
+    """
+    SQL condition (and params) restricting a layer query to rows whose
+    R*Tree bounds (point or geometry bbox) intersect the bbox. R*Tree coordinates are stored as
+    32-bit floats rounded outward, so features within that rounding of
+    the edge are included.
+    """
+    _, rtree = SPATIAL_LAYERS[layer]
+    west, south, east, north = bbox
+
+    lookup = f"SELECT id FROM {rtree} WHERE max_lon >= ? AND min_lon <= ? AND max_lat >= ? AND min_lat <= ?"
+    if west <= east:
+        return f"{alias}.id IN ({lookup})", [west, east, south, north]
+
+    # Crossing the antimeridian: west..180 plus -180..east
+    return (f"{alias}.id IN ({lookup} UNION ALL {lookup})",
+            [west, 180.0, south, north, -180.0, east, south, north])
+
+def viewport_args():
+    """
+    Read bbox= and zoom= from the query string.
+    Returns (bbox or None, zoom or None); with both, the bbox is snapped
+    to the zoom's tile grid. Raises ValueError on invalid input.
+    """
+    bbox = request.args.get('bbox')
+    zoom = request.args.get('zoom')
+
+    if zoom is not None:
+        try:
+            zoom = int(zoom)
+        except ValueError:
+            raise ValueError("zoom must be an integer")
+        if not 0 <= zoom <= MAX_ZOOM:
+            raise ValueError(f"zoom must be between 0 and {MAX_ZOOM}")
+
+    if bbox is not None:
+        bbox = parse_bbox(bbox)
+        if zoom is not None:
+            bbox = snap_bbox(bbox, zoom)
+    return bbox, zoom
+
+def viewport_filter(layer, alias):
+    """
+    (where, params) for a layer query limited to the requested viewport;
+    both are empty when no bbox was given.
+    """
+    bbox, _ = viewport_args()
+    if bbox is None:
+        return [], []
+    condition, params = bbox_condition(layer, alias, bbox)
+    return [condition], params
@@ -0,0 +1,323 @@
+"""
+State Assignment
+Links deposits, mining claims and exploration sites to the South Sudan
+state whose boundary polygon contains them (ss_states.geometry).
+
+Points are matched in bulk: each state's bbox prefilters the batch, then
+ray casting runs edge by edge over the remaining coordinates held in
+arrays sorted by latitude, so every edge only visits the points level
+with it. Rows no boundary contains fall back to their free-text region.
+
+Usage:
+    python -m app.states backfill [db_path]
+"""
+
+import json
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from flask import current_app, jsonify, request
+from werkzeug.utils import secure_filename
+from app.db import get_pool, get_writer, run_write
+from app.geometry import POLYGON_TYPES, parse_polygons, shape_bbox, shape_centroid, extent_columns
+from app.geojson_stream import InvalidGeoJSON, iter_features
+from app.helpers import login_required, large_upload
+from app.simplify import store_levels
+from app.utils import is_admin
+
+BACKFILL_BATCH = 5000
+
+# layer: (table, free-text column naming the state when no boundary matches)
+STATE_LAYERS = {
+    'deposits': ('deposits', 'region'),
+    'claims': ('mining_claims', None),
+    'sites': ('ss_exploration_sites', None),
+}
+
+# Feature properties that may carry the state name in boundary files
+STATE_NAME_PROPERTIES = ('name', 'NAME', 'state', 'STATE', 'ADM1_EN', 'admin1Name')
+
+# ============================================================
+# POINT-IN-POLYGON ENGINE
+# ============================================================
+
+def _inside(xs, ys, rings):
+    """
+    Even-odd inside flags for points sorted by latitude (xs, ys arrays).
+    A horizontal ray from a point crosses an edge when the point's
+    latitude is in the edge's half-open [low, high) span, so each edge
+    only scans that slice of the points.
+    """
+    flags = bytearray(len(ys))
+    for ring_x, ring_y in rings:
+        ax, ay = ring_x[-1], ring_y[-1]
+        for bx, by in zip(ring_x, ring_y):
+            if ay != by:
+                low, high = (ay, by) if ay < by else (by, ay)
+                slope = (bx - ax) / (by - ay)
+                for i in range(bisect_left(ys, low), bisect_left(ys, high)):
+                    if xs[i] < ax + (ys[i] - ay) * slope:
+                        flags[i] ^= 1
+            ax, ay = bx, by
+    return flags
+
+class StateLocator:
+    """Point-in-polygon lookup over a set of state boundaries."""
+
+    def __init__(self, states):
+        """states: iterable of (state id, parsed shape) pairs."""
+        self.states = []
+        for state_id, shape in states:
+            rings = [(array('d', (p[0] for p in ring)), array('d', (p[1] for p in ring)))
+                     for polygon in shape for ring in polygon]
+            self.states.append((state_id, shape_bbox(shape), rings))
+
+    def __len__(self):
+        return len(self.states)
+
+    def assign(self, points):
+        """
+        Map point ids to the state containing them; points are
+        (id, lon, lat). Points outside every boundary are left out.
+        """
+        points = sorted(points, key=lambda p: p[2])
+        ids = [p[0] for p in points]
+        xs = array('d', (p[1] for p in points))
+        ys = array('d', (p[2] for p in points))
+
+        found = {}
+        for state_id, (west, south, east, north), rings in self.states:
+            candidates = [i for i in range(bisect_left(ys, south), bisect_right(ys, north))
+                          if west <= xs[i] <= east and ids[i] not in found]
+            if not candidates:
+                continue
+            flags = _inside(array('d', map(xs.__getitem__, candidates)),
+                            array('d', map(ys.__getitem__, candidates)), rings)
+            for i, inside in zip(candidates, flags):
+                if inside:
+                    found[ids[i]] = state_id
+        return found
+
+def load_locator(db):
+    """StateLocator over every state with a boundary."""
+    rows = db.execute(
+        "SELECT id, geometry FROM ss_states WHERE geometry IS NOT NULL ORDER BY id"
+    ).fetchall()
+    return StateLocator((row[0], parse_polygons(json.loads(row[1]))) for row in rows)
+
+# ============================================================
+# ASSIGNMENT
+# ============================================================
+
+def state_changes(locator, rows):
+    """
+    Updates for rows of (id, longitude, latitude, state_id).
+    Returns ((state_id, id) pairs whose state changed, ids not located).
+    """
+    found = locator.assign([(r[0], r[1], r[2]) for r in rows
+                            if r[1] is not None and r[2] is not None])
+    changes = [(found[r[0]], r[0]) for r in rows if r[0] in found and found[r[0]] != r[3]]
+    unlocated = [r[0] for r in rows if r[0] not in found]
+    return changes, unlocated
+
+def apply_state_changes(conn, layer, changes, unlocated=()):
+    """Write located states, then region-name states for unlocated rows."""
+    table, name_column = STATE_LAYERS[layer]
+    conn.executemany(f"UPDATE {table} SET state_id = ? WHERE id = ?", changes)
+    updated = len(changes)
+
+    if name_column and unlocated:
+        by_name = f"(SELECT s.id FROM ss_states s WHERE s.name = {table}.{name_column})"
+        updated += conn.execute(f"""
+            UPDATE {table} SET state_id = {by_name}
+            WHERE id IN (SELECT value FROM json_each(?))
+              AND {by_name} IS NOT NULL AND state_id IS NOT {by_name}
+        """, (json.dumps(unlocated),)).rowcount
+    return updated
+
+def assign_states(conn, layer, ids):
+    """Assign states to rows of a layer, e.g. right after inserting them."""
+    if not ids:
+        return 0
+    table = STATE_LAYERS[layer][0]
+    rows = conn.execute(f"""
+        SELECT id, longitude, latitude, state_id FROM {table}
+        WHERE id IN (SELECT value FROM json_each(?))
+    """, (json.dumps(list(ids)),)).fetchall()
+    changes, unlocated = state_changes(load_locator(conn), rows)
+    return apply_state_changes(conn, layer, changes, unlocated)
+
+def backfill_states(database, layers=None, batch_size=BACKFILL_BATCH, progress=None):
+    """
+    Reassign every row of the layers in id batches. Matching runs on the
+    calling thread against a read connection; only the updates go to the
+    writer, one batch per write job. Returns rows updated per layer.
+    """
+    db = get_pool(database, readonly=True).connect()
+    writer = get_writer(database)
+    updated = {}
+    try:
+        locator = load_locator(db)
+        tables = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        for layer in layers or STATE_LAYERS:
+            table = STATE_LAYERS[layer][0]
+            if table not in tables:
+                continue
+            updated[layer] = 0
+            last_id = 0
+            while True:
+                rows = db.execute(f"""
+                    SELECT id, longitude, latitude, state_id FROM {table}
+                    WHERE id > ? ORDER BY id LIMIT ?
+                """, (last_id, batch_size)).fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                changes, unlocated = state_changes(locator, rows)
+                updated[layer] += writer.submit(apply_state_changes, layer, changes, unlocated).result()
+                if progress:
+                    progress(layer, last_id)
+    finally:
+        db.close()
+    return updated
+
+# ============================================================
+# BACKFILL JOB
+# ============================================================
+
+_jobs = {}  # database -> status dict
+_jobs_lock = threading.Lock()
+
+def start_backfill(database, layers=None):
+    """Run backfill_states on a background thread; False if one is running."""
+    with _jobs_lock:
+        if _jobs.get(database, {}).get('status') == 'running':
+            return False
+        status = _jobs[database] = {'status': 'running', 'layer': None, 'last_id': 0, 'updated': None}
+
+    def progress(layer, last_id):
+        status.update(layer=layer, last_id=last_id)
+
+    def run():
+        try:
+            status['updated'] = backfill_states(database, layers, progress=progress)
+            status['status'] = 'done'
+        except Exception as e:
+            status.update(status='failed', error=str(e))
+
+    threading.Thread(target=run, name='state-backfill', daemon=True).start()
+    return True
+
+def backfill_status(database):
+    return dict(_jobs.get(database, {'status': 'idle'}))
+
+# ============================================================
+# BOUNDARY IMPORT
+# ============================================================
+
+def parse_boundaries(features):
+    """(state name, parsed shape) for each polygon feature with a name."""
+    boundaries = []
+    for feature in features:
+        if not isinstance(feature, dict):
+            continue
+        props = feature.get('properties') or {}
+        geom = feature.get('geometry') or {}
+        name = next((props[key] for key in STATE_NAME_PROPERTIES if props.get(key)), None)
+        if not name or geom.get('type') not in POLYGON_TYPES:
+            continue
+        try:
+            boundaries.append((str(name).strip(), parse_polygons(geom)))
+        except ValueError:
+            continue
+    return boundaries
+
+def save_boundaries(conn, boundaries):
+    """Store boundaries on the matching ss_states rows (names match case-insensitively)."""
+    states = {row[1].lower(): row[0] for row in conn.execute("SELECT id, name FROM ss_states")}
+    updated = []
+    unmatched = []
+    for name, shape in boundaries:
+        state_id = states.get(name.lower())
+        if state_id is None:
+            unmatched.append(name)
+            continue
+        columns = extent_columns(shape)
+        lon, lat = shape_centroid(shape)
+        conn.execute("""
+            UPDATE ss_states
+            SET geometry = ?, min_lon = ?, max_lon = ?, min_lat = ?, max_lat = ?,
+                latitude = COALESCE(latitude, ?), longitude = COALESCE(longitude, ?)
+            WHERE id = ?
+        """, (columns['geometry'], columns['min_lon'], columns['max_lon'],
+              columns['min_lat'], columns['max_lat'], lat, lon, state_id))
+        updated.append((state_id, name))
+
+    store_levels(conn, 'states', [state_id for state_id, _ in updated])
+    return [name for _, name in updated], unmatched
+
+def state_routes(app):
+    """Register state boundary import and assignment routes"""
+
+    @app.route("/admin/states/boundaries", methods=["POST"])
+    @login_required
+    @large_upload
+    def import_state_boundaries():
+        """Import state boundary polygons from GeoJSON, then reassign states"""
+        if not is_admin():
+            return jsonify({'error': 'Not authorized'}), 403
+
+        file = request.files.get('file')
+        if not file or not file.filename:
+            return jsonify({'error': 'No file provided'}), 400
+        if not secure_filename(file.filename).lower().endswith(('.geojson', '.json')):
+            return jsonify({'error': 'Boundaries must be GeoJSON'}), 400
+
+        try:
+            boundaries = parse_boundaries(iter_features(file.stream))
+        except (InvalidGeoJSON, UnicodeDecodeError):
+            return jsonify({'error': 'Invalid GeoJSON format'}), 400
+
+        if not boundaries:
+            return jsonify({'error': 'No named polygon features found'}), 400
+
+        updated, unmatched = run_write(save_boundaries, boundaries)
+        started = bool(updated) and start_backfill(current_app.config['DATABASE'])
+
+        return jsonify({
+            'success': True,
+            'updated': updated,
+            'unmatched': unmatched,
+            'backfill_started': started
+        })
+
+    @app.route("/admin/states/backfill", methods=["GET", "POST"])
+    @login_required
+    def state_backfill():
+        """Start (POST) or check (GET) the state assignment backfill"""
+        if not is_admin():
+            return jsonify({'error': 'Not authorized'}), 403
+
+        database = current_app.config['DATABASE']
+        if request.method == "POST":
+            layers = request.form.getlist('layer') or None
+            if layers and not set(layers) <= set(STATE_LAYERS):
+                return jsonify({'error': f"layer must be one of {', '.join(STATE_LAYERS)}"}), 400
+            if not start_backfill(database, layers):
+                return jsonify({'error': 'A backfill is already running'}), 409
+            return jsonify(backfill_status(database)), 202
+
+        return jsonify(backfill_status(database))
+
+    print("✓ State assignment routes registered")
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if not args or args[0] != "backfill":
+        print(__doc__)
+        sys.exit(2)
+    db_path = args[1] if len(args) > 1 else "minerals.db"
+
+    result = backfill_states(db_path, progress=lambda layer, last_id: print(f"  {layer}: up to id {last_id}"))
+    print(f"Updated state_id: {result}")
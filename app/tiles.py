@@ -0,0 +1,395 @@
+"""
+Map Tiles
+Serves the map layers as /tiles/<layer>/<z>/<x>/<y> in GeoJSON or
+Mapbox Vector Tile (.mvt) encoding. Up to MAX_CLUSTER_ZOOM a tile holds
+the layer's clusters for its grid cells; deeper tiles hold raw points.
+Claims and states are drawn with their polygon simplified for the zoom
+wherever it is bigger than a pixel.
+
+Rendered tiles up to CACHE_MAX_ZOOM that hold features are cached on
+disk under the layer version, so a change to a layer invalidates exactly
+that layer's tiles and the cache stays bounded by the data.
+
+Usage:
+    python -m app.tiles seed <layer> <zooms> [--bbox=w,s,e,n] [--workers=N] [--format=geojson|mvt]
+                                             [--db=path] [--cache=dir]
+    e.g. python -m app.tiles seed deposits 0-10 --bbox=24,3,36,13
+"""
+
+import json
+import multiprocessing
+import os
+import shutil
+import struct
+import sys
+import tempfile
+from flask import Response, abort, current_app, request
+from app.db import ConnectionPool, get_db, DATABASE_PATH
+from app.helpers import map_read
+from app.spatial import (SPATIAL_LAYERS, MAX_LATITUDE, MAX_ZOOM, bbox_condition, layer_version,
+                         parse_bbox, tile_bounds, tile_x, tile_y)
+from app.clustering import (MAX_CLUSTER_ZOOM, CELLS_PER_TILE, cluster_features, ensure_clusters,
+                            get_clusters, layer_points, mercator, sync_clusters)
+from app.simplify import SIMPLIFY_LAYERS, geometries_for_zoom
+
+TILE_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'tile_cache')
+CACHE_MAX_ZOOM = 12  # deeper tiles are rendered on every request
+
+# format: mimetype
+TILE_FORMATS = {
+    'geojson': 'application/geo+json',
+    'mvt': 'application/vnd.mapbox-vector-tile',
+}
+FORMAT_ALIASES = {'json': 'geojson', 'pbf': 'mvt'}
+
+MVT_EXTENT = 4096
+
+# ============================================================
+# TILE CONTENT
+# ============================================================
+
+def polygon_features(db, layer, z, x, y):
+    """Features of a polygon layer's rows whose polygon is visible in a tile."""
+    condition, params = bbox_condition(layer, 't', tile_bounds(x, y, z))
+    features = layer_points(db, layer, f"{condition} AND t.geometry IS NOT NULL", params)
+    geometries = geometries_for_zoom(db, layer, [f['properties']['id'] for f in features], z)
+    for feature in features:
+        feature['geometry'] = geometries.get(feature['properties']['id'])
+    return [feature for feature in features if feature['geometry']]
+
+def tile_features(db, layer, z, x, y):
+    """GeoJSON features (lon/lat) of one tile."""
+    if z > MAX_CLUSTER_ZOOM:
+        features = get_clusters(db, layer, z, tile_bounds(x, y, z))
+    else:
+        # Exactly the grid cells inside this tile, so no feature is in two tiles
+        first_x, first_y = x * CELLS_PER_TILE, y * CELLS_PER_TILE
+        features = cluster_features(db, layer, z,
+                                    [(first_x, first_x + CELLS_PER_TILE - 1)],
+                                    (first_y, first_y + CELLS_PER_TILE - 1))
+    if layer not in SIMPLIFY_LAYERS:
+        return features
+
+    # Polygons go in every tile they overlap and replace their point
+    polygons = polygon_features(db, layer, z, x, y)
+    drawn = {feature['properties']['id'] for feature in polygons}
+    return [feature for feature in features
+            if feature['properties'].get('cluster') or feature['properties']['id'] not in drawn] + polygons
+
+def render_tile(db, layer, z, x, y, fmt):
+    """Render one tile; returns (bytes in the given format, feature count)."""
+    features = tile_features(db, layer, z, x, y)
+    if fmt == 'mvt':
+        return encode_mvt(layer, features, z, x, y), len(features)
+    return json.dumps({'type': 'FeatureCollection', 'features': features},
+                      separators=(',', ':')).encode('utf-8'), len(features)
+
+# ============================================================
+# MAPBOX VECTOR TILE ENCODING
+# ============================================================
+# Minimal protobuf writer for the MVT 2.1 schema, so no protobuf
+# dependency is needed. Field numbers follow vector_tile.proto.
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+def _field(number, wire_type, payload):
+    key = _varint((number << 3) | wire_type)
+    if wire_type == 0:
+        return key + _varint(payload)
+    if wire_type == 1:
+        return key + payload
+    return key + _varint(len(payload)) + payload
+
+def _packed(number, values):
+    return _field(number, 2, b''.join(_varint(v) for v in values))
+
+def _encode_value(value):
+    if isinstance(value, bool):
+        return _field(7, 0, int(value))
+    if isinstance(value, int):
+        return _field(6, 0, _zigzag(value))
+    if isinstance(value, float):
+        return _field(3, 1, struct.pack('<d', value))
+    return _field(1, 2, str(value).encode('utf-8'))
+
+def _command(command_id, count):
+    return (command_id & 0x7) | (count << 3)
+
+class _Cursor:
+    """Projects lon/lat to tile coordinates and emits delta-encoded commands."""
+
+    def __init__(self, z, x, y):
+        self.scale = 1 << z
+        self.origin = (x, y)
+        self.position = (0, 0)
+
+    def project(self, lon, lat):
+        mx, my = mercator(lon, lat)
+        return (round((mx * self.scale - self.origin[0]) * MVT_EXTENT),
+                round((my * self.scale - self.origin[1]) * MVT_EXTENT))
+
+    def path(self, points):
+        """Projected points with consecutive duplicates removed."""
+        projected = []
+        for lon, lat in points:
+            point = self.project(lon, lat)
+            if not projected or projected[-1] != point:
+                projected.append(point)
+        return projected
+
+    def moves(self, points):
+        params = []
+        for px, py in points:
+            params += [_zigzag(px - self.position[0]), _zigzag(py - self.position[1])]
+            self.position = (px, py)
+        return params
+
+def _signed_area(ring):
+    return sum(x1 * y2 - x2 * y1 for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]))
+
+def _encode_geometry(geometry, cursor):
+    """Return (MVT geometry type, command integers) or (None, None)."""
+    kind = geometry['type']
+    coords = geometry['coordinates']
+
+    if kind in ('Point', 'MultiPoint'):
+        points = cursor.path([coords] if kind == 'Point' else coords)
+        return 1, [_command(1, len(points))] + cursor.moves(points)
+
+    if kind in ('LineString', 'MultiLineString'):
+        commands = []
+        for line in ([coords] if kind == 'LineString' else coords):
+            line = cursor.path(line)
+            if len(line) < 2:
+                continue
+            commands += [_command(1, 1)] + cursor.moves(line[:1])
+            commands += [_command(2, len(line) - 1)] + cursor.moves(line[1:])
+        return (2, commands) if commands else (None, None)
+
+    if kind in ('Polygon', 'MultiPolygon'):
+        commands = []
+        for polygon in ([coords] if kind == 'Polygon' else coords):
+            for index, ring in enumerate(polygon):
+                ring = cursor.path(ring)
+                if len(ring) > 1 and ring[0] == ring[-1]:
+                    ring = ring[:-1]
+                if len(ring) < 3:
+                    if index == 0:
+                        break  # degenerate exterior: skip the whole polygon
+                    continue
+                # Exterior rings have positive area in tile space, holes negative
+                if (_signed_area(ring) > 0) != (index == 0):
+                    ring.reverse()
+                commands += [_command(1, 1)] + cursor.moves(ring[:1])
+                commands += [_command(2, len(ring) - 1)] + cursor.moves(ring[1:])
+                commands.append(_command(7, 1))
+        return (3, commands) if commands else (None, None)
+
+    return None, None
+
+def encode_mvt(layer, features, z, x, y):
+    """Encode GeoJSON features as a single-layer Mapbox Vector Tile."""
+    cursor = _Cursor(z, x, y)
+    keys, values = {}, {}
+    encoded = []
+
+    for feature in features:
+        cursor.position = (0, 0)  # each feature's geometry starts at the origin
+        geom_type, commands = _encode_geometry(feature['geometry'], cursor)
+        if geom_type is None:
+            continue
+
+        tags = []
+        for key, value in feature['properties'].items():
+            if value is None:
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault((type(value), value), len(values)))
+
+        body = b''
+        feature_id = feature['properties'].get('id')
+        if isinstance(feature_id, int) and feature_id >= 0:
+            body += _field(1, 0, feature_id)
+        body += _packed(2, tags) + _field(3, 0, geom_type) + _packed(4, commands)
+        encoded.append(_field(2, 2, body))
+
+    layer_body = (
+        _field(15, 0, 2)
+        + _field(1, 2, layer.encode('utf-8'))
+        + b''.join(encoded)
+        + b''.join(_field(3, 2, key.encode('utf-8')) for key in keys)
+        + b''.join(_field(4, 2, _encode_value(value)) for _, value in values)
+        + _field(5, 0, MVT_EXTENT)
+    )
+    return _field(3, 2, layer_body)
+
+# ============================================================
+# DISK CACHE
+# ============================================================
+
+def tile_path(cache_dir, layer, version, z, x, y, fmt):
+    return os.path.join(cache_dir, layer, f"v{version}", str(z), str(x), f"{y}.{fmt}")
+
+def prune_tile_cache(cache_dir, layer, version):
+    """Delete cached tiles of older versions of a layer."""
+    layer_dir = os.path.join(cache_dir, layer)
+    if not os.path.isdir(layer_dir):
+        return
+    for name in os.listdir(layer_dir):
+        if name != f"v{version}":
+            shutil.rmtree(os.path.join(layer_dir, name), ignore_errors=True)
+
+def get_tile(db, cache_dir, layer, version, z, x, y, fmt, max_zoom=CACHE_MAX_ZOOM):
+    """
+    Return tile bytes from the disk cache, rendering and storing them on
+    a miss. Tiles deeper than max_zoom and empty tiles are rendered but
+    never stored. The first tile of a new version prunes older versions.
+    """
+    if z > max_zoom:
+        return render_tile(db, layer, z, x, y, fmt)[0]
+
+    path = tile_path(cache_dir, layer, version, z, x, y, fmt)
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+
+    data, count = render_tile(db, layer, z, x, y, fmt)
+    if not count:
+        return data
+
+    version_dir = os.path.join(cache_dir, layer, f"v{version}")
+    if not os.path.isdir(version_dir):
+        prune_tile_cache(cache_dir, layer, version)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Write to a temporary file first so readers never see a partial tile
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return data
+
+# ============================================================
+# ROUTES
+# ============================================================
+
+def tile_routes(app):
+    """Register the map tile endpoint"""
+    app.config.setdefault('TILE_CACHE_DIR', TILE_CACHE_DIR)
+    app.config.setdefault('TILE_CACHE_MAX_ZOOM', CACHE_MAX_ZOOM)
+
+    @app.route("/tiles/<layer>/<int:z>/<int:x>/<int:y>")
+    @app.route("/tiles/<layer>/<int:z>/<int:x>/<int:y>.<fmt>")
+    @map_read
+    def tile(layer, z, x, y, fmt='geojson'):
+        """One map tile of a layer (GeoJSON by default, .mvt for vector tiles)"""
+        fmt = FORMAT_ALIASES.get(fmt, fmt)
+        if layer not in SPATIAL_LAYERS or fmt not in TILE_FORMATS:
+            abort(404)
+        if z > MAX_ZOOM or x >= (1 << z) or y >= (1 << z):
+            abort(404)
+
+        db = get_db()
+        version = ensure_clusters(db, layer)
+
+        etag = f"{layer}-v{version}"
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            data = get_tile(db, current_app.config['TILE_CACHE_DIR'], layer, version, z, x, y, fmt,
+                            current_app.config['TILE_CACHE_MAX_ZOOM'])
+            response = Response(data, mimetype=TILE_FORMATS[fmt])
+        # Revalidate on every use: the ETag changes with the layer version
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    print("✓ Map tile routes registered")
+
+# ============================================================
+# PARALLEL SEEDING
+# ============================================================
+
+_worker = {}
+
+def _init_worker(db_path, cache_dir, layer, version, fmt):
+    _worker.update(
+        db=ConnectionPool(db_path, readonly=True).connect(),
+        cache_dir=cache_dir, layer=layer, version=version, fmt=fmt
+    )
+
+def _seed_one(tile):
+    z, x, y = tile
+    get_tile(_worker['db'], _worker['cache_dir'], _worker['layer'], _worker['version'],
+             z, x, y, _worker['fmt'])
+
+def tiles_in_bbox(bbox, z):
+    """Every (z, x, y) tile touching a bbox."""
+    west, south, east, north = bbox
+    last = (1 << z) - 1
+    x0, x1 = tile_x(west, z), tile_x(east, z)
+    x_ranges = [(x0, x1)] if west <= east else [(x0, last), (0, x1)]
+    for first, stop in x_ranges:
+        for tx in range(first, stop + 1):
+            for ty in range(tile_y(north, z), tile_y(south, z) + 1):
+                yield z, tx, ty
+
+def seed_tiles(db_path, layer, zooms, bbox=None, workers=None, cache_dir=TILE_CACHE_DIR, fmt='geojson'):
+    """
+    Pre-render a layer's tile pyramid with a pool of worker processes.
+    Clusters are brought up to date first; zooms above CACHE_MAX_ZOOM are
+    skipped since they are never cached. Returns the number of tiles.
+    """
+    conn = ConnectionPool(db_path).connect()
+    try:
+        sync_clusters(conn, layer)
+        conn.commit()
+        version = layer_version(conn, layer)
+    finally:
+        conn.close()
+
+    prune_tile_cache(cache_dir, layer, version)
+    bbox = bbox or (-180.0, -MAX_LATITUDE, 180.0, MAX_LATITUDE)
+    tiles = [tile for z in zooms if z <= CACHE_MAX_ZOOM for tile in tiles_in_bbox(bbox, z)]
+
+    with multiprocessing.Pool(workers, _init_worker, (db_path, cache_dir, layer, version, fmt)) as pool:
+        for _ in pool.imap_unordered(_seed_one, tiles, chunksize=64):
+            pass
+    return len(tiles)
+
+def _parse_zooms(value):
+    first, _, last = value.partition('-')
+    return range(int(first), int(last or first) + 1)
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    options = dict(a[2:].split("=", 1) for a in sys.argv[1:] if a.startswith("--") and "=" in a)
+
+    if len(args) != 3 or args[0] != "seed" or args[1] not in SPATIAL_LAYERS:
+        print(__doc__)
+        sys.exit(1)
+
+    count = seed_tiles(
+        options.get("db", DATABASE_PATH),
+        args[1],
+        _parse_zooms(args[2]),
+        bbox=parse_bbox(options["bbox"]) if "bbox" in options else None,
+        workers=int(options["workers"]) if "workers" in options else None,
+        cache_dir=options.get("cache", TILE_CACHE_DIR),
+        fmt=FORMAT_ALIASES.get(options.get("format", "geojson"), options.get("format", "geojson")),
+    )
+    print(f"✓ Seeded {count} {args[1]} tiles")
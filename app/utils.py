@@ -1,5 +1,5 @@
 from flask import session
-from app.db import get_db
+from app.roles import current_identity
 import pathlib
 import os
 import re
@@ -68,13 +68,7 @@ def is_admin():
     if "user_id" not in session:
         return False
 
-    db = get_db()
-    user = db.execute(
-        "SELECT is_admin FROM users WHERE id = ?",
-        (session["user_id"],)
-    ).fetchone()
-
-    return user and user["is_admin"] == 1
+    return current_identity().is_admin
 
 def sanitize_input(text, allowed_tags=None):
     """
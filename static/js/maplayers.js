@@ -0,0 +1,177 @@
+/*
+ * Viewport-driven layers for the Leaflet map pages. The pages ship as
+ * static shells; each layer fetches its rows for the visible area from the
+ * list APIs once panning/zooming settles, follows X-Next-Cursor pages up to
+ * a cap, and only redraws when the responses' ETags change.
+ *
+ * Layers with a `clusters` name load /api/clusters/<name> instead while the
+ * map is zoomed out below rawZoom and no filter is set, so every point is
+ * counted at every zoom; raw rows are only paged once zoomed in.
+ *
+ *   const deposits = MapLayers.viewportLayer(map, {
+ *       url: '/api/deposits',
+ *       packed: true,                          // ?format=bin via GeoPacked
+ *       clusters: 'deposits',                  // optional, see above
+ *       params: () => ({status: statusSelect.value}),
+ *       render: (rows, info) => { ... }        // info.truncated when capped,
+ *   });                                        // info.clusters when clustered
+ *   statusSelect.addEventListener('change', deposits.refresh);
+ */
+(function (global) {
+    'use strict';
+
+    const DEBOUNCE_MS = 300;
+    const MAX_ROWS = 5000;
+    const RAW_ZOOM = 9;  // default zoom from which clustered layers page raw rows
+    const PADDING = 0.2;  // fetch a margin around the view so small pans hit cache
+
+    function bboxParam(map) {
+        const bounds = map.getBounds().pad(PADDING);
+        const south = Math.max(bounds.getSouth(), -90);
+        const north = Math.min(bounds.getNorth(), 90);
+        let west = bounds.getWest(), east = bounds.getEast();
+        if (east - west >= 360) {
+            west = -180;
+            east = 180;
+        } else {
+            // Leaflet longitudes run past ±180 on a wrapped world
+            west = ((west + 180) % 360 + 360) % 360 - 180;
+            east = ((east + 180) % 360 + 360) % 360 - 180;
+        }
+        return [west, south, east, north].map(v => v.toFixed(5)).join(',');
+    }
+
+    function viewportLayer(map, options) {
+        let timer = null;
+        let controller = null;
+        let lastTag = null;
+
+        function filters() {
+            const extra = options.params ? options.params() : {};
+            return Object.keys(extra)
+                .filter(key => extra[key] !== '' && extra[key] != null)
+                .map(key => [key, extra[key]]);
+        }
+
+        // The cluster API has no filters, so filtered views page raw rows
+        function clustered() {
+            return Boolean(options.clusters) && map.getZoom() < (options.rawZoom || RAW_ZOOM)
+                && filters().length === 0;
+        }
+
+        function clusterUrl() {
+            const params = new URLSearchParams({bbox: bboxParam(map), zoom: map.getZoom()});
+            return '/api/clusters/' + options.clusters + '?' + params;
+        }
+
+        function pageUrl(cursor) {
+            const params = new URLSearchParams(filters());
+            if (!options.global) params.set('bbox', bboxParam(map));
+            params.set('zoom', map.getZoom());
+            if (options.packed) params.set('format', 'bin');
+            if (cursor) params.set('cursor', cursor);
+            return options.url + '?' + params;
+        }
+
+        // The browser revalidates with If-None-Match; an unchanged page comes
+        // back from its HTTP cache with the same ETag.
+        async function fetchPage(url, signal) {
+            if (options.packed) {
+                const result = await GeoPacked.fetch(url, {signal: signal});
+                return {rows: result.table.rows(), response: result.response};
+            }
+            const response = await fetch(url, {signal: signal});
+            if (!response.ok) throw new Error('Request failed: ' + response.status);
+            return {rows: await response.json(), response: response};
+        }
+
+        // Single points become rows of their properties; clusters are
+        // {latitude, longitude, count, expansion_zoom}
+        async function loadClusters(signal) {
+            const response = await fetch(clusterUrl(), {signal: signal});
+            if (!response.ok) throw new Error('Request failed: ' + response.status);
+            const body = await response.json();
+            const rows = [];
+            const clusters = [];
+            body.features.forEach(feature => {
+                const [longitude, latitude] = feature.geometry.coordinates;
+                const props = feature.properties;
+                if (props.cluster) {
+                    clusters.push({latitude: latitude, longitude: longitude,
+                                   count: props.point_count, expansion_zoom: props.expansion_zoom});
+                } else {
+                    rows.push(Object.assign({latitude: latitude, longitude: longitude}, props));
+                }
+            });
+            return {rows: rows, clusters: clusters};
+        }
+
+        async function load() {
+            if (controller) controller.abort();
+            controller = new AbortController();
+            const signal = controller.signal;
+
+            if (clustered()) {
+                let result;
+                try {
+                    result = await loadClusters(signal);
+                } catch (error) {
+                    if (error.name !== 'AbortError') console.error(options.url, error);
+                    return;
+                }
+                lastTag = null;  // so switching back to raw rows always redraws
+                options.render(result.rows, {truncated: false, clusters: result.clusters});
+                return;
+            }
+
+            let rows = [];
+            const tags = [];
+            let cursor = null;
+            try {
+                do {
+                    const page = await fetchPage(pageUrl(cursor), signal);
+                    rows = rows.concat(page.rows);
+                    tags.push(page.response.headers.get('ETag'));
+                    cursor = page.response.headers.get('X-Next-Cursor');
+                } while (cursor && rows.length < MAX_ROWS);
+            } catch (error) {
+                if (error.name !== 'AbortError') console.error(options.url, error);
+                return;
+            }
+
+            const tag = tags.every(Boolean) ? tags.join(',') : null;
+            if (tag && tag === lastTag) return;
+            lastTag = tag;
+            options.render(rows, {truncated: Boolean(cursor)});
+        }
+
+        function schedule() {
+            clearTimeout(timer);
+            timer = setTimeout(load, DEBOUNCE_MS);
+        }
+
+        map.on('moveend', schedule);
+        load();
+
+        return {
+            refresh: function () {
+                clearTimeout(timer);
+                load();
+            }
+        };
+    }
+
+    // Count bubble for a cluster from info.clusters; a click zooms in on it
+    function clusterMarker(map, cluster) {
+        const size = cluster.count < 100 ? 30 : cluster.count < 1000 ? 38 : 46;
+        const icon = L.divIcon({
+            html: `<div style="background: rgba(13, 110, 253, 0.75); color: white; width: ${size}px; height: ${size}px; line-height: ${size}px; border-radius: 50%; text-align: center; font-weight: bold; border: 2px solid white; box-shadow: 0 0 5px rgba(0,0,0,0.5);">${cluster.count.toLocaleString()}</div>`,
+            className: 'cluster-marker',
+            iconSize: [size, size]
+        });
+        return L.marker([cluster.latitude, cluster.longitude], {icon: icon})
+            .on('click', () => map.setView([cluster.latitude, cluster.longitude], cluster.expansion_zoom));
+    }
+
+    global.MapLayers = {viewportLayer: viewportLayer, clusterMarker: clusterMarker};
+})(window);
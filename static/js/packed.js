@@ -0,0 +1,134 @@
+/*
+ * Decoder for the packed columnar API format (?format=bin, see app/packed.py).
+ *
+ *   const { table } = await GeoPacked.fetch('/api/deposits?format=bin&bbox=...');
+ *   table.columns.latitude   // Float32Array, no per-row parsing
+ *   table.value('status', i) // dictionary-decoded text
+ *   table.rows()             // plain objects, for popups and lists
+ */
+(function (global) {
+    'use strict';
+
+    const MAGIC = 'GRC1';
+    const ARRAYS = {
+        uint8: Uint8Array,
+        uint16: Uint16Array,
+        uint32: Uint32Array,
+        int32: Int32Array,
+        float32: Float32Array,
+        float64: Float64Array
+    };
+
+    function view(buffer, base, block, Type) {
+        return new Type(buffer, base + block.offset, block.length);
+    }
+
+    function decode(buffer) {
+        const bytes = new Uint8Array(buffer);
+        if (String.fromCharCode(bytes[0], bytes[1], bytes[2], bytes[3]) !== MAGIC) {
+            throw new Error('Not a packed columnar response');
+        }
+        const headerLength = new DataView(buffer).getUint32(4, true);
+        const header = JSON.parse(new TextDecoder().decode(bytes.subarray(8, 8 + headerLength)));
+        const base = 8 + headerLength;
+
+        const columns = {};
+        const dictionaries = {};
+        header.columns.forEach(function (column) {
+            if (column.type === 'polygons') {
+                columns[column.name] = {
+                    features: view(buffer, base, column.features, Uint32Array),
+                    polygons: view(buffer, base, column.polygons, Uint32Array),
+                    rings: view(buffer, base, column.rings, Uint32Array),
+                    coords: view(buffer, base, column.coords, Float32Array)
+                };
+                return;
+            }
+            columns[column.name] = view(buffer, base, column, ARRAYS[column.type]);
+            if (column.dictionary) {
+                dictionaries[column.name] = column.dictionary;
+            }
+        });
+
+        return new Table(header.count, header.columns.map(function (c) { return c.name; }),
+                         columns, dictionaries);
+    }
+
+    function Table(count, names, columns, dictionaries) {
+        this.count = count;
+        this.names = names;
+        this.columns = columns;
+        this.dictionaries = dictionaries;
+    }
+
+    Table.prototype.value = function (name, i) {
+        const column = this.columns[name];
+        if (column.coords) {
+            return this.geometry(name, i);
+        }
+        const dictionary = this.dictionaries[name];
+        if (dictionary) {
+            return dictionary[column[i]];
+        }
+        const value = column[i];
+        return Number.isNaN(value) ? null : value;
+    };
+
+    // GeoJSON geometry of row i, or null when the row has no polygon
+    Table.prototype.geometry = function (name, i) {
+        const g = this.columns[name];
+        const first = g.features[i], last = g.features[i + 1];
+        if (first === last) {
+            return null;
+        }
+        const polygons = [];
+        for (let p = first; p < last; p++) {
+            const rings = [];
+            for (let r = g.polygons[p]; r < g.polygons[p + 1]; r++) {
+                const ring = [];
+                for (let c = g.rings[r]; c < g.rings[r + 1]; c++) {
+                    ring.push([g.coords[2 * c], g.coords[2 * c + 1]]);
+                }
+                rings.push(ring);
+            }
+            polygons.push(rings);
+        }
+        return polygons.length === 1
+            ? { type: 'Polygon', coordinates: polygons[0] }
+            : { type: 'MultiPolygon', coordinates: polygons };
+    };
+
+    Table.prototype.row = function (i) {
+        const row = {};
+        for (const name of this.names) {
+            row[name] = this.value(name, i);
+        }
+        return row;
+    };
+
+    Table.prototype.rows = function () {
+        const rows = new Array(this.count);
+        for (let i = 0; i < this.count; i++) {
+            rows[i] = this.row(i);
+        }
+        return rows;
+    };
+
+    // Fetch and decode; resolves to {table, response} so callers can read
+    // pagination headers, or null on 304 Not Modified.
+    function fetchPacked(url, options) {
+        return fetch(url, options).then(function (response) {
+            if (response.status === 304) {
+                return null;
+            }
+            if (!response.ok) {
+                throw new Error('Request failed: ' + response.status);
+            }
+            return response.arrayBuffer().then(function (buffer) {
+                return { table: decode(buffer), response: response };
+            });
+        });
+    }
+
+    global.GeoPacked = { decode: decode, fetch: fetchPacked };
+})(window);
@@ -0,0 +1,63 @@
+"""
+Export round trips: a layer written by the GeoJSON, CSV and GeoPackage
+exporters must import back through the QGIS importer without losing its
+attribute columns.
+"""
+
+import csv
+import io
+import json
+import pytest
+from app.export import EXPORT_LAYERS, GPKG_COLUMN_TYPES, GPKG_GEOMETRY_TYPES, gpkg_features, stream_csv, stream_geojson
+from app.geopackage import read_geopackage, write_geopackage
+from app.geospatial import parse_csv_rows, parse_geojson_features
+
+DEPOSIT = {
+    'id': 7, 'name': 'Kapoeta Gold', 'mineral': 'Gold', 'location_name': 'Kapoeta East',
+    'country': 'South Sudan', 'region': 'Eastern Equatoria', 'state': 'Eastern Equatoria',
+    'status': 'Active', 'estimated_reserves_tonnes': 125000.0, 'average_grade': 3.5,
+    'confidence_level': 'Indicated', 'discovery_year': 2011,
+    'latitude': 4.77, 'longitude': 33.59, 'geometry': None,
+}
+SQUARE = {'type': 'Polygon', 'coordinates': [[[30.0, 5.0], [30.1, 5.0], [30.1, 5.1], [30.0, 5.1], [30.0, 5.0]]]}
+CLAIM = {
+    'id': 3, 'claim_id': 'CLM-2024-003', 'company_name': 'Nile Minerals Ltd',
+    'location_description': 'Near Juba', 'area_hectares': 1234.5, 'claim_type': 'Mining',
+    'issue_date': '2024-01-01', 'expiry_date': '2029-01-01', 'status': 'Active',
+    'deposit': None, 'state': 'Central Equatoria',
+    'latitude': 5.05, 'longitude': 30.05, 'geometry': json.dumps(SQUARE),
+}
+
+# layer: (exported row, importer kind, columns that must survive)
+CASES = {
+    'deposits': (DEPOSIT, 'deposits', ['name', 'location_name', 'country', 'region', 'status',
+                                       'estimated_reserves_tonnes', 'average_grade',
+                                       'confidence_level', 'discovery_year']),
+    'claims': (CLAIM, 'claims', ['claim_id', 'company_name', 'location_description',
+                                 'area_hectares', 'claim_type', 'status']),
+}
+
+def export_geojson(layer, row, tmp_path):
+    text = ''.join(stream_geojson([row], EXPORT_LAYERS[layer][3]))
+    return parse_geojson_features(json.loads(text)['features'], CASES[layer][1])
+
+def export_csv(layer, row, tmp_path):
+    text = ''.join(stream_csv([row], EXPORT_LAYERS[layer][3]))
+    return parse_csv_rows(csv.DictReader(io.StringIO(text)), CASES[layer][1])
+
+def export_gpkg(layer, row, tmp_path):
+    fields = EXPORT_LAYERS[layer][3]
+    path = tmp_path / f"{layer}.gpkg"
+    columns = [(f, GPKG_COLUMN_TYPES.get(f, 'TEXT')) for f in fields if f != 'id']
+    write_geopackage(str(path), layer, GPKG_GEOMETRY_TYPES[layer], columns, gpkg_features([row], fields))
+    with open(path, 'rb') as f:
+        return parse_geojson_features(read_geopackage(f), CASES[layer][1])
+
+@pytest.mark.parametrize("export", [export_geojson, export_csv, export_gpkg],
+                         ids=['geojson', 'csv', 'gpkg'])
+@pytest.mark.parametrize("layer", sorted(CASES))
+def test_export_reimports(tmp_path, layer, export):
+    row, _, columns = CASES[layer]
+    [parsed] = export(layer, row, tmp_path)
+    assert {c: parsed[c] for c in columns} == {c: row[c] for c in columns}
+    assert (parsed['latitude'], parsed['longitude']) == pytest.approx((row['latitude'], row['longitude']))
@@ -0,0 +1,41 @@
+"""
+Query plan checks: a fresh database with every migration applied must
+answer each hot query (EXPECTED_PLANS) through its index.
+"""
+
+import os
+import runpy
+import sqlite3
+import pytest
+from app.enhanced_init_db import create_enhanced_db
+from app.migrations import EXPECTED_PLANS, MIGRATIONS, run_migrations
+
+@pytest.fixture(scope="module")
+def conn(tmp_path_factory):
+    """A database built like a deployment: init_db, the enhanced schema, migrations."""
+    directory = tmp_path_factory.mktemp("db")
+    cwd = os.getcwd()
+    os.chdir(directory)  # init_db writes ./minerals.db
+    try:
+        runpy.run_module("app.init_db")
+    finally:
+        os.chdir(cwd)
+    path = str(directory / "minerals.db")
+    create_enhanced_db(path)
+    conn = sqlite3.connect(path)
+    run_migrations(conn)
+    yield conn
+    conn.close()
+
+def test_all_migrations_applied(conn):
+    applied = {row[0] for row in conn.execute("SELECT version FROM schema_migrations")}
+    assert applied == {version for version, _, _ in MIGRATIONS}
+
+def test_migrations_are_idempotent(conn):
+    assert run_migrations(conn) == []
+
+@pytest.mark.parametrize("description, query, params, index_name", EXPECTED_PLANS,
+                         ids=[plan[0] for plan in EXPECTED_PLANS])
+def test_query_plan(conn, description, query, params, index_name):
+    plan = " | ".join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params))
+    assert index_name in plan, f"{description}: {plan}"